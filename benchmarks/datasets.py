@@ -0,0 +1,58 @@
+## Synthetic scale datasets
+## Square cells on a regular lattice over NYC, with a rent surface that rises toward Midtown and a
+## commute column from the mock server's travel model - shaped like the merged frame, so loading,
+## scoring and rendering see realistic columns. Built once & cached as GeoParquet in benchmarks/data/.
+import sys
+from pathlib import Path
+import numpy as np
+import geopandas as gpd
+from shapely import box
+BENCH_PATH = Path(__file__).resolve().parent
+sys.path.append(str(BENCH_PATH.parent))
+sys.path.append(str(BENCH_PATH.parent / "scripts"))
+import storage
+import scoring
+from constants import COMMUTE_KEY
+from mock_directions import travel_seconds, DESTINATION_LATLON
+
+DATA_PATH = BENCH_PATH / "data"
+DATASETS = {'zcta_180': 180, 'grid_10k': 10_000, 'grid_100k': 100_000} ## name -> rows
+BBOX = (-74.05, 40.57, -73.75, 40.90) ## minx, miny, maxx, maxy (lon/lat)
+ZCTA_COUNT = 180 ## grid cells are assigned to this many fake zips, like the real grid mode
+BR_MULTIPLIERS = [0.85, 1.0, 1.2, 1.5, 1.75] ## rent per BR count, relative to 1BR
+SEED = 0
+
+def synthetic_frame(rows, seed=SEED):
+	'''rows square cells (lon/lat) with zcta, lat/lon centroids, rent_{n}BR and COMMUTE_KEY.'''
+	rng = np.random.default_rng(seed)
+	minx, miny, maxx, maxy = BBOX
+	side = int(np.ceil(np.sqrt(rows)))
+	step_x, step_y = (maxx - minx) / side, (maxy - miny) / side
+	index = np.arange(rows)
+	lons = minx + (index % side + 0.5) * step_x
+	lats = miny + (index // side + 0.5) * step_y
+	geometry = box(lons - step_x/2, lats - step_y/2, lons + step_x/2, lats + step_y/2)
+	km_to_midtown = np.hypot((lats - DESTINATION_LATLON[0])*111, (lons - DESTINATION_LATLON[1])*111*np.cos(np.radians(lats)))
+	rent_1br = np.clip(4200 - 110*km_to_midtown + rng.normal(0, 250, rows), 1100, None).round(-1)
+	frame = gpd.GeoDataFrame({
+		'zcta': [f"{10001 + i*ZCTA_COUNT // rows}" for i in index],
+		'lat': lats, 'lon': lons,
+		**{scoring.rent_key(br_count): (rent_1br*multiplier).round(-1) for br_count, multiplier in zip(scoring.BR_COUNTS, BR_MULTIPLIERS)},
+		COMMUTE_KEY: [round(travel_seconds(f"{lat},{lon}") / 60, 2) for lat, lon in zip(lats, lons)],
+	}, geometry=geometry, crs="EPSG:4326")
+	return frame
+
+def dataset_path(name):
+	return DATA_PATH / f"{name}.parquet"
+
+def build(name, rebuild=False):
+	'''Writes the named dataset (if missing) and returns its path.'''
+	path = dataset_path(name)
+	if rebuild or not path.exists():
+		path.parent.mkdir(parents=True, exist_ok=True)
+		storage.write_frame(synthetic_frame(DATASETS[name]), path)
+	return path
+
+if __name__ == '__main__':
+	for name in (sys.argv[1:] or DATASETS):
+		print(f"{name}: {build(name, rebuild=True)}")
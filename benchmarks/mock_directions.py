@@ -0,0 +1,188 @@
+## Stand-in Google Maps server
+## Replays the recorded Directions / Distance Matrix responses in benchmarks/recorded/ over plain HTTP,
+## with configurable latency, UNKNOWN_ERROR / OVER_QUERY_LIMIT rates and a requests-per-second throttle
+## (past it, requests get OVER_QUERY_LIMIT - like the real API). Durations are a deterministic function
+## of the origin, so repeated runs compare like for like.
+## usage: python benchmarks/mock_directions.py --port 8765 --latency-ms 120 --unknown-error-rate 0.02
+## then run with GOOGLE_MAPS_BASE_URL=http://127.0.0.1:8765 (or set commute.API_BASE_URL)
+import argparse
+import copy
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+RECORDED_PATH = Path(__file__).resolve().parent / "recorded"
+PORT = 8765
+DESTINATION_LATLON = (40.7580, -73.9855) ## every destination is treated as Times Square
+BASE_SECONDS = 600 ## walking & waiting
+SECONDS_PER_KM = 150 ## ~24 km/h door to door
+NOISE_SECONDS = 300
+
+class MockConfig:
+	'''Behaviour of the stand-in server - rates are per request, in [0, 1].'''
+	def __init__(self, latency_ms=80, jitter_ms=40, unknown_error_rate=0.0, over_query_limit_rate=0.0,
+			zero_results_rate=0.01, max_qps=None, seed=0):
+		self.latency_ms = latency_ms
+		self.jitter_ms = jitter_ms
+		self.unknown_error_rate = unknown_error_rate
+		self.over_query_limit_rate = over_query_limit_rate
+		self.zero_results_rate = zero_results_rate
+		self.max_qps = max_qps
+		self.seed = seed
+
+class MockState:
+	'''Shared across handler threads: seeded randomness, the throttle, and request counts by status.'''
+	def __init__(self, config):
+		self.config = config
+		self.random = random.Random(config.seed)
+		self.lock = threading.Lock()
+		self.tokens = float(config.max_qps or 0)
+		self.updated = time.monotonic()
+		self.counts = {}
+		self.directions = json.loads((RECORDED_PATH / "directions_ok.json").read_text())
+		self.zero_results = json.loads((RECORDED_PATH / "directions_zero_results.json").read_text())
+		self.element = json.loads((RECORDED_PATH / "distancematrix_element.json").read_text())
+
+	def draw(self):
+		with self.lock:
+			return self.random.random(), self.random.gauss(0, 1)
+
+	def throttled(self):
+		'''Non-blocking token bucket - True means this request is over max_qps.'''
+		if not self.config.max_qps:
+			return False
+		with self.lock:
+			now = time.monotonic()
+			self.tokens = min(float(self.config.max_qps), self.tokens + (now - self.updated)*self.config.max_qps)
+			self.updated = now
+			if self.tokens < 1:
+				return True
+			self.tokens -= 1
+			return False
+
+	def record(self, status):
+		with self.lock:
+			self.counts[status] = self.counts.get(status, 0) + 1
+
+	def failure(self):
+		'''A request-level error status, or None.'''
+		if self.throttled():
+			return 'OVER_QUERY_LIMIT'
+		roll, _ = self.draw()
+		if roll < self.config.unknown_error_rate:
+			return 'UNKNOWN_ERROR'
+		if roll < self.config.unknown_error_rate + self.config.over_query_limit_rate:
+			return 'OVER_QUERY_LIMIT'
+		return None
+
+def travel_seconds(origin):
+	'''Deterministic for a given origin: distance to DESTINATION_LATLON plus origin-seeded noise.'''
+	lat, lon = (float(part) for part in origin.split(','))
+	dy = (lat - DESTINATION_LATLON[0]) * 111.0
+	dx = (lon - DESTINATION_LATLON[1]) * 111.0 * math.cos(math.radians(lat))
+	noise = random.Random(origin).gauss(0, 1) * NOISE_SECONDS
+	return int(max(120, BASE_SECONDS + SECONDS_PER_KM*math.hypot(dx, dy) + noise))
+
+def directions_response(state, params):
+	status = state.failure()
+	if status:
+		return {'routes': [], 'status': status}
+	roll, _ = state.draw()
+	if roll < state.config.zero_results_rate:
+		return state.zero_results
+	body = copy.deepcopy(state.directions)
+	seconds = travel_seconds(params['origin'][0])
+	body['routes'][0]['legs'][0]['duration'] = {'text': f"{round(seconds/60)} mins", 'value': seconds}
+	return body
+
+def matrix_response(state, params):
+	status = state.failure()
+	origins = params['origins'][0].split('|')
+	destinations = params['destinations'][0].split('|')
+	if status:
+		return {'destination_addresses': [], 'origin_addresses': [], 'rows': [], 'status': status}
+	rows = []
+	for origin in origins:
+		elements = []
+		for _ in destinations:
+			roll, _ = state.draw()
+			if roll < state.config.zero_results_rate:
+				elements.append({'status': 'ZERO_RESULTS'})
+				continue
+			element = copy.deepcopy(state.element)
+			seconds = travel_seconds(origin)
+			element['duration'] = {'text': f"{round(seconds/60)} mins", 'value': seconds}
+			elements.append(element)
+		rows.append({'elements': elements})
+	return {'destination_addresses': destinations, 'origin_addresses': origins, 'rows': rows, 'status': 'OK'}
+
+ROUTES = {'/maps/api/directions/json': directions_response, '/maps/api/distancematrix/json': matrix_response}
+
+def make_handler(state):
+	class MockHandler(BaseHTTPRequestHandler):
+		def do_GET(self):
+			url = urlparse(self.path)
+			route = ROUTES.get(url.path)
+			if route is None:
+				self.send_error(404)
+				return
+			_, gauss = state.draw()
+			time.sleep(max(0.0, state.config.latency_ms + gauss*state.config.jitter_ms) / 1000)
+			body = route(state, parse_qs(url.query))
+			state.record(body['status'])
+			payload = json.dumps(body).encode()
+			self.send_response(200) ## the Maps APIs report errors in the body, not the HTTP status
+			self.send_header('Content-Type', 'application/json; charset=UTF-8')
+			self.send_header('Content-Length', str(len(payload)))
+			self.end_headers()
+			self.wfile.write(payload)
+
+		def log_message(self, format, *args):
+			pass
+	return MockHandler
+
+class MockServer:
+	'''Runs the stand-in on a background thread: with MockServer(config) as server: ... server.base_url'''
+	def __init__(self, config=None, host='127.0.0.1', port=0):
+		self.state = MockState(config or MockConfig())
+		self.httpd = ThreadingHTTPServer((host, port), make_handler(self.state))
+		self.httpd.daemon_threads = True
+		self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+	@property
+	def base_url(self):
+		host, port = self.httpd.server_address[:2]
+		return f"http://{host}:{port}"
+
+	def __enter__(self):
+		self.thread.start()
+		return self
+
+	def __exit__(self, *exc_info):
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Serve recorded Directions / Distance Matrix responses locally.")
+	parser.add_argument('--port', type=int, default=PORT)
+	parser.add_argument('--latency-ms', type=float, default=80)
+	parser.add_argument('--jitter-ms', type=float, default=40)
+	parser.add_argument('--unknown-error-rate', type=float, default=0.0)
+	parser.add_argument('--over-query-limit-rate', type=float, default=0.0)
+	parser.add_argument('--zero-results-rate', type=float, default=0.01)
+	parser.add_argument('--max-qps', type=float, default=None, help="throttle: requests past this rate get OVER_QUERY_LIMIT")
+	parser.add_argument('--seed', type=int, default=0)
+	args = parser.parse_args()
+	config = MockConfig(args.latency_ms, args.jitter_ms, args.unknown_error_rate, args.over_query_limit_rate,
+		args.zero_results_rate, args.max_qps, args.seed)
+	server = MockServer(config, port=args.port)
+	print(f"Mock Maps API on {server.base_url} (set GOOGLE_MAPS_BASE_URL={server.base_url})")
+	try:
+		server.httpd.serve_forever()
+	except KeyboardInterrupt:
+		print(f"Responses by status: {server.state.counts}")
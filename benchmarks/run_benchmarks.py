@@ -0,0 +1,177 @@
+## Benchmark suite
+## Times loading, fetching, scoring and rendering on the synthetic datasets, with the fetch path
+## (fetch_engine -> retry_logic -> commute) pointed at the local mock server - no quota is spent.
+## Reports throughput, p50/p99 latency & peak traced memory per (stage, dataset), writes a JSON result,
+## and with --baseline exits non-zero when anything regressed past REGRESSION_TOLERANCE.
+## usage: python benchmarks/run_benchmarks.py [--datasets zcta_180 grid_10k] [--stages load score] [--baseline results/x.json]
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+BENCH_PATH = Path(__file__).resolve().parent
+sys.path.append(str(BENCH_PATH.parent))
+sys.path.append(str(BENCH_PATH.parent / "scripts"))
+import config.commute_config as commute_config
+import storage
+import scoring
+import render
+import commute
+import commute_cache
+import fetch_engine
+import retry_logic
+import datasets
+from constants import COMMUTE_KEY
+from mock_directions import MockServer, MockConfig
+
+STAGES = ['load', 'fetch', 'score', 'render']
+DEFAULT_DATASETS = ['zcta_180', 'grid_10k'] ## grid_100k on request - it's slow to render
+REPEATS = 5
+FETCH_LIMIT = 2000 ## origins per fetch run - throughput settles well before this
+FETCH_WORKERS = 16
+FETCH_RPS = 200
+RESULTS_PATH = BENCH_PATH / "results"
+REGRESSION_TOLERANCE = 0.25 ## p50 up, or throughput down, by more than this fails --baseline
+
+def measure(fn, repeats=REPEATS):
+	'''Runs fn() repeats times. Returns (durations in seconds, peak traced MB over every run, last result).'''
+	tracemalloc.start()
+	durations, peak, result = [], 0, None
+	try:
+		for _ in range(repeats):
+			tracemalloc.reset_peak()
+			start = time.perf_counter()
+			result = fn()
+			durations.append(time.perf_counter() - start)
+			peak = max(peak, tracemalloc.get_traced_memory()[1])
+	finally:
+		tracemalloc.stop()
+	return durations, peak / (1 << 20), result
+
+def summarize(stage, dataset, items, durations, peak_mb, latencies=None, **extra):
+	'''Throughput is items per second of median wall time; p50/p99 are over latencies (per request) or durations (per run).'''
+	latencies = np.asarray(latencies if latencies is not None else durations, dtype=float)
+	return {'stage': stage, 'dataset': dataset, 'items': items, 'runs': len(durations),
+		'throughput_per_s': round(items / float(np.median(durations)), 1),
+		'p50_ms': round(float(np.percentile(latencies, 50))*1000, 2), 'p99_ms': round(float(np.percentile(latencies, 99))*1000, 2),
+		'peak_mb': round(peak_mb, 1), **extra}
+
+def bench_load(name, path):
+	durations, peak, frame = measure(lambda: storage.read_frame(path))
+	return summarize('load', name, len(frame), durations, peak)
+
+def bench_fetch(name, frame, mock_config, limit=FETCH_LIMIT):
+	'''One pass over up to `limit` origins through the real fetch path, against the mock server.'''
+	origins = frame[['lat', 'lon']].iloc[:limit]
+	latencies = []
+	def timed_call(row):
+		start = time.perf_counter()
+		result = retry_logic.call_api_with_limits(row)
+		latencies.append(time.perf_counter() - start) ## includes retries & backoff, like a real run
+		return result
+	with MockServer(mock_config) as server:
+		commute.API_BASE_URL = server.base_url
+		durations, peak, minutes = measure(lambda: fetch_engine.fetch_commute_times(origins, fetch_fn=timed_call,
+			max_workers=FETCH_WORKERS, requests_per_second=FETCH_RPS), repeats=1)
+		statuses = dict(server.state.counts)
+	return summarize('fetch', name, len(origins), durations, peak, latencies=latencies,
+		bad_values=int((minutes == retry_logic.BAD_VAL).sum()), statuses=statuses)
+
+def bench_score(name, frame):
+	durations, peak, _ = measure(lambda: scoring.score_all(frame, commute_col=COMMUTE_KEY))
+	return summarize('score', name, len(frame), durations, peak)
+
+def bench_render(name, frame, repeats=REPEATS):
+	'''Building the polygon collection once, then one PNG - what render_metrics pays for its first metric.'''
+	values = scoring.score_all(frame)[scoring.metric_key('score', 1)].values
+	with tempfile.TemporaryDirectory() as outdir:
+		durations, peak, _ = measure(lambda: render.MapRenderer(frame).render(values, 'score', Path(outdir) / "score.png"), repeats=repeats)
+	return summarize('render', name, len(frame), durations, peak)
+
+def isolate_fetch(no_backoff=False):
+	'''Google provider, no cache, no journal, no quota limits - nothing here touches the real API, the quota ledger or the journal dir.'''
+	commute_config.PROVIDER = 'google'
+	commute.google_api_key = 'benchmark'
+	commute_cache.ENABLED = False
+	retry_logic.JOURNAL_ENABLED = False ## no journal & no ledger reads or writes - counts stay in memory
+	## and should anything still reach for them, the ledger & journals live in a scratch dir, not data/cache
+	scratch = Path(tempfile.mkdtemp(prefix="bench-quota-"))
+	retry_logic.LEDGER_FILE = scratch / "quota_ledger.sqlite"
+	retry_logic.JOURNAL_PATH = scratch / "journal"
+	retry_logic.JOURNAL_FILE = retry_logic.JOURNAL_PATH / f"{retry_logic.RUN_ID}.jsonl"
+	retry_logic.MAX_API_CALLS_PER_RUN = retry_logic.MAX_API_CALLS_PER_MONTH = float('inf')
+	retry_logic.VERBOSE = fetch_engine.VERBOSE = render.VERBOSE = False
+	if no_backoff:
+		retry_logic.RETRY_BACKOFF = [0]*len(retry_logic.RETRY_BACKOFF)
+
+def compare(results, baseline, tolerance=REGRESSION_TOLERANCE):
+	'''Regression messages for every (stage, dataset) that got slower than the baseline.'''
+	previous = {(row['stage'], row['dataset']): row for row in baseline['results']}
+	regressions = []
+	for row in results:
+		old = previous.get((row['stage'], row['dataset']))
+		if old is None:
+			continue
+		if row['p50_ms'] > old['p50_ms']*(1 + tolerance):
+			regressions.append(f"{row['stage']}/{row['dataset']}: p50 {old['p50_ms']}ms -> {row['p50_ms']}ms")
+		if row['throughput_per_s'] < old['throughput_per_s']*(1 - tolerance):
+			regressions.append(f"{row['stage']}/{row['dataset']}: throughput {old['throughput_per_s']}/s -> {row['throughput_per_s']}/s")
+	return regressions
+
+def print_table(results):
+	print(f"{'stage':<8} {'dataset':<10} {'items':>8} {'items/s':>11} {'p50 ms':>9} {'p99 ms':>9} {'peak MB':>8}")
+	for row in results:
+		print(f"{row['stage']:<8} {row['dataset']:<10} {row['items']:>8} {row['throughput_per_s']:>11} {row['p50_ms']:>9} {row['p99_ms']:>9} {row['peak_mb']:>8}")
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Benchmark load/fetch/score/render on synthetic data, against a mock Maps server.")
+	parser.add_argument('--datasets', nargs='+', default=DEFAULT_DATASETS, choices=list(datasets.DATASETS))
+	parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+	parser.add_argument('--fetch-limit', type=int, default=FETCH_LIMIT)
+	parser.add_argument('--latency-ms', type=float, default=80)
+	parser.add_argument('--jitter-ms', type=float, default=40)
+	parser.add_argument('--unknown-error-rate', type=float, default=0.01)
+	parser.add_argument('--over-query-limit-rate', type=float, default=0.0)
+	parser.add_argument('--max-qps', type=float, default=None, help="mock throttle - past it, requests get OVER_QUERY_LIMIT")
+	parser.add_argument('--no-backoff', action='store_true', help="skip retry sleeps, to time the fetch path itself")
+	parser.add_argument('--baseline', help="earlier result JSON to check for regressions")
+	parser.add_argument('--out', default=None, help="result JSON (default: benchmarks/results/bench-<timestamp>.json)")
+	args = parser.parse_args()
+
+	isolate_fetch(no_backoff=args.no_backoff)
+	mock_config = MockConfig(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, unknown_error_rate=args.unknown_error_rate,
+		over_query_limit_rate=args.over_query_limit_rate, max_qps=args.max_qps)
+	results = []
+	for name in args.datasets:
+		path = datasets.build(name)
+		frame = storage.read_frame(path)
+		print(f"[{name}] {len(frame)} rows")
+		if 'load' in args.stages:
+			results.append(bench_load(name, path))
+		if 'fetch' in args.stages:
+			results.append(bench_fetch(name, frame, mock_config, limit=args.fetch_limit))
+		if 'score' in args.stages:
+			results.append(bench_score(name, frame))
+		if 'render' in args.stages:
+			results.append(bench_render(name, frame, repeats=1 if len(frame) > 50_000 else REPEATS))
+	print_table(results)
+
+	outfile = Path(args.out) if args.out else RESULTS_PATH / f"bench-{datetime.now():%Y%m%d-%H%M%S}.json"
+	outfile.parent.mkdir(parents=True, exist_ok=True)
+	with open(outfile, 'w') as f:
+		json.dump({'created': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(), 'machine': platform.machine(),
+			'mock': vars(mock_config), 'no_backoff': args.no_backoff, 'results': results}, f, indent=1)
+	print(f"Results: {outfile}")
+
+	if args.baseline:
+		with open(args.baseline) as f:
+			regressions = compare(results, json.load(f))
+		if regressions:
+			print("Regressions vs baseline:\n\t" + "\n\t".join(regressions))
+			sys.exit(1)
+		print("No regressions vs baseline.")
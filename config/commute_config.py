@@ -0,0 +1,26 @@
+## commute provider config for nyc-heatmap
+## paths are relative to the project root
+
+PROVIDER = "google"  # "google" (Directions / Distance Matrix API) or "local" (offline routing)
+
+LOCAL = {
+    "mode": "transit",  # "transit" (GTFS), "walk" (straight-line), or "drive" (road edge list)
+    "routing": "isochrone",  # "isochrone" (one reverse search per destination) or "all_pairs" (per-origin lookups)
+    "gtfs_path": "data/raw/gtfs_subway",  # unzipped GTFS feed: stops.txt, stop_times.txt, (transfers.txt)
+    "road_nodes": "data/raw/road_graph/nodes.csv",  # node_id, lat, lon
+    "road_edges": "data/raw/road_graph/edges.csv",  # from, to, minutes
+    "walk_speed_kmh": 4.8,
+    "walk_circuity": 1.3,  # street distance / straight-line distance
+    "access_nodes": 5,  # nearest stops considered at each end of a trip
+    "max_access_walk_m": 1500,
+    "transfer_walk_m": 300,  # stops this close get a walking transfer
+    "boarding_penalty_min": 5,  # average wait, charged on every boarding
+    "headway_waits": True,  # transit: first-boarding wait = half the scheduled headway in the departure's hour
+    "max_wait_min": 30,  # wait charged in hours without service
+}
+
+## the local provider can't geocode - destinations need coordinates here
+DESTINATION_COORDS = {
+    "Times Square, New York, NY": (40.7580, -73.9855),
+    "40 Ludlow St, New York, NY 10002": (40.7163, -73.9899),
+}
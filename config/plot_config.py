@@ -45,6 +45,26 @@ SETTINGS = {
         "tooltip_fmt": "{:.0f}",
         "normalize": False
     },
+    "commute_minutes_median": {
+        "label": "Median Commute over the Departure Sweep",
+        "units": "min",
+        "colorscale": "Blues",
+        "vmin": 0,
+        "vmax": 60,
+        "interactive": True,
+        "tooltip_fmt": "{:.0f}",
+        "normalize": False
+    },
+    "commute_minutes_p90": {
+        "label": "90th Percentile Commute over the Departure Sweep",
+        "units": "min",
+        "colorscale": "Blues",
+        "vmin": 0,
+        "vmax": 60,
+        "interactive": True,
+        "tooltip_fmt": "{:.0f}",
+        "normalize": False
+    },
     "rent_1BR": {
         "label": "Estimated Rent (1BR)",
         "units": "$",
@@ -96,3 +116,12 @@ SETTINGS = {
         "normalize": False
     }
 }
+
+## metric formulas - expressions over "rent" (per bedroom column) and "commute" (minutes, per destination),
+## compiled once by scripts/scoring.py and evaluated for every BR count x destination at once
+## allowed: numbers, + - * / // % **, and log, log1p, sqrt, exp, abs, minimum, maximum, clip, where
+METRICS = {
+    "score": "rent / (commute + 1)",
+    "gravity": "rent / (commute**2 + 1)",
+    "antigravity": "(commute**2 + 1) / rent",
+}
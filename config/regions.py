@@ -0,0 +1,28 @@
+## region registry for nyc-heatmap
+## a region is selected by any of:
+##   "zips"     - an explicit ZCTA list (exact, used as-is)
+##   "counties" - 5-digit county GEOIDs (state FIPS + county FIPS)
+##   "bbox"     - (minx, miny, maxx, maxy) in lon/lat
+##   "boundary" - path to a polygon file (relative to the project root)
+## county/bbox/boundary regions keep every ZCTA whose representative point falls inside the region
+
+REGIONS = {
+    "nyc": {
+        "label": "New York City",
+        "counties": ["36005", "36047", "36061", "36081", "36085"],  # Bronx, Kings, New York, Queens, Richmond
+        "zcta_file": "data/processed/nyc_zcta_2020.shp",  # prebuilt - skips the national file entirely
+    },
+    "boston": {"label": "Boston", "counties": ["25025", "25017", "25021"]},
+    "philadelphia": {"label": "Philadelphia", "counties": ["42101"]},
+    "washington_dc": {"label": "Washington, DC", "counties": ["11001", "51013", "51510"]},
+    "chicago": {"label": "Chicago", "counties": ["17031"]},
+    "atlanta": {"label": "Atlanta", "counties": ["13121", "13089"]},
+    "miami": {"label": "Miami", "counties": ["12086"]},
+    "houston": {"label": "Houston", "counties": ["48201"]},
+    "denver": {"label": "Denver", "counties": ["08031"]},
+    "seattle": {"label": "Seattle", "counties": ["53033"]},
+    "san_francisco": {"label": "San Francisco", "counties": ["06075", "06001"]},
+    "los_angeles": {"label": "Los Angeles", "counties": ["06037"]},
+}
+
+DEFAULT_REGION = "nyc"
@@ -1,12 +1,13 @@
 ## NYC Heatmap 
 ## by Dave Nair
 
-import geopandas as gpd
 import matplotlib.pyplot as plt
 import pandas as pd
+import numpy as np
 import json
 import warnings
 import os
+import argparse
 from pathlib import Path
 import sys
 ## we can add $PARENT_PATH to root, so we can run & import stuff inside
@@ -14,10 +15,24 @@ PARENT_PATH = Path(__file__).resolve().parent.parent
 sys.path.append(str(PARENT_PATH))
 
 import config.plot_config as plot_config
+import config.regions as region_config
 from lib import utils
 import commute
-from constants import RENT_COLUMN_RENAMES, GEOM_COLUMN_RENAMES, COMMUTE_KEY, SCORE_KEY, GRAVIKEY, ANTIGRAV_KEY, NYC_ZIPS, BAD_VAL
+from constants import RENT_COLUMN_RENAMES, GEOM_COLUMN_RENAMES, COMMUTE_KEY, SCORE_KEY, ESTIMATED_KEY, MERGED_FILENAME, NYC_ZIPS, BAD_VAL
 import retry_logic
+import fetch_engine
+import commute_providers
+import grid
+import storage
+import pipeline
+import rent_store
+import regions
+import geometry_artifact
+import render
+import scoring
+import planner
+import interpolate
+import telemetry
 from retry_logic import MAX_API_CALLS_PER_RUN, MAX_API_CALLS_PER_MONTH
 
 # == INPUTS, CONSTANTS, & UI PLACEHOLDERS ===
@@ -27,18 +42,43 @@ CHOSEN_BR_COUNT = 1
 CHOSEN_METRIC = SCORE_KEY #; CHOSEN_METRIC = 'rent_1BR'
 VERBOSE = True
 VERBOSE_DETAILED = False
+SHOW_PLOT = True # plt.show() after rendering; the PNG is written either way
+COMMUTE_MODE = 'directions' # 'directions' (one call per origin & trip) or 'matrix' (batched origins x destinations, per departure)
+## weighted trips: (destination, departure "HH:MM" or True for commute.CHOSEN_DEPARTURE, weight)
+## ie - [("Times Square, New York, NY", "08:00", 5), ("40 Ludlow St, New York, NY 10002", "18:00", 2)]
+TRIPS = [(commute.DEFAULT_DESTINATION, True, 1)]
+COMMUTE_AGGREGATE = 'mean' # how TRIPS reduce to COMMUTE_KEY: 'mean' (weighted), 'max', or 'p<NN>' (ie - 'p90', weighted)
+INTERPOLATE_MISSING = True # fill failed/unroutable commutes from neighbours (flagged in ESTIMATED_KEY); False drops those rows
+INTERPOLATION_METHOD = 'idw' # 'idw' or 'gaussian' - see interpolate.py
+SAMPLE_FRACTION = None # ie - 0.25: only fetch that share of origins (spread out), interpolate the rest
+SWEEP_WINDOW = None # ie - ("07:00", "11:00"): also sweep every commute.SLOT_MINUTES for the first trip's destination
+SWEEP_STATS = ['median', 'p90'] # per-origin stats over the sweep -> commute_minutes_median, commute_minutes_p90
+SPATIAL_MODE = 'zcta' # 'zcta' (one row per zip), 'grid' (square cells), or 'hex'
+GRID_CELL_METERS = 250 # grid/hex modes only
+REGION = region_config.DEFAULT_REGION # any region in config/regions.py - also the --region default
+RENDER_ALL = False # also write one PNG per metric in plot_config.SETTINGS (headless, one pass)
+RENDER_LEVEL = 'geom_50m' # simplified geometry for batch maps (zcta mode) - see geometry_artifact.SIMPLIFY_LEVELS
+RENDER_PROCESSES = 1 # >1 splits the batch maps across worker processes
 
 ## INPUTS THAT DON'T CHANGE MUCH
-ZCTA_GEOFILE = "nyc_zcta_2020.shp" # these are actually multiple files that need to be next to each other
+ZCTA_GEOFILE = regions.region_file(REGION) # nyc: data/processed/nyc_zcta_2020.shp (multiple files that need to be next to each other)
 RENT_FILE = "HUD_FY2025_FairMarketRent_SmallArea.xls"
-MERGED_FILE = "nyc-ScorePerZCTA.geojson"
-MERGED_FILE = "test.geojson"
+MERGED_FILE = MERGED_FILENAME # GeoParquet cache (see constants.py - tiles.py & query_service.py read it back)
+MATRIX_FILE = "commute_matrix.parquet" # long-format origin x destination table (matrix mode)
+PROFILE_FILE = "commute_profile.parquet" # origin x departure-slot minutes (sweep mode)
+EXPORT_GEOJSON = False # also write MERGED_FILE as .geojson (for sharing - never read back)
+EXPORT_TILES = False # also write vector tiles + viewer to outputs/tiles (serve with: python scripts/tiles.py serve)
+RUN_REPORT_FILE = "run_report.json" # per-stage timings, request latencies, retries & cache hits (see telemetry.py)
+METRICS_FILE = None # ie - "heatmap.prom": same numbers in Prometheus text format
 
 ## PATHS & FILENAMES SET
 DATA_PATH = PARENT_PATH / "data"
-ZCTA_GEOFILE = DATA_PATH / "processed" / ZCTA_GEOFILE
 RENT_FILE = DATA_PATH / "raw" / RENT_FILE
 MERGED_FILE = PARENT_PATH / "outputs" / MERGED_FILE
+MATRIX_FILE = PARENT_PATH / "outputs" / MATRIX_FILE
+PROFILE_FILE = PARENT_PATH / "outputs" / PROFILE_FILE
+MAPS_PATH = PARENT_PATH / "outputs" / "maps"
+RUN_REPORT_FILE = PARENT_PATH / "outputs" / RUN_REPORT_FILE
 
 
 # === FUNCTIONS ===
@@ -59,28 +99,20 @@ def sanity_check(dataframe, name=''):
 		return True
 	return False
 
-def estimate_upcoming_api_calls(dataframe, dest_col=False, lat_col='lat', lon_col='lon', intro='Beginning API requests...\n'):
-	if intro:
-		print(intro)
-	unique_origins = len(dataframe[[lat_col, lon_col]].dropna().drop_duplicates())
-	if dest_col==False:
-		unique_destinations = 1
-	else:
-		unique_destinations = len(dataframe[[dest_col]].dropna().drop_duplicates())
-	current_estimate = unique_origins*unique_destinations
-
+def print_upcoming_usage(current_estimate):
 	## print the usage & MAX as well, if this is verbose
 	if VERBOSE:
 		run_percentage = float(current_estimate) / MAX_API_CALLS_PER_RUN
 		monthly_percentage = float(_PERSISTED_PRECOUNTER+current_estimate) / MAX_API_CALLS_PER_MONTH
 		print(f"Upcoming API calls:\n\tRun Max: \t{current_estimate} \t\t/{MAX_API_CALLS_PER_RUN} ({run_percentage*100:.1f}%)\n\tMonthly Max: \t{current_estimate}+{_PERSISTED_PRECOUNTER} \t/{MAX_API_CALLS_PER_MONTH} ({monthly_percentage*100:.1f}%)\n")
-	return current_estimate
 
-def prompt_user_for_confirmation(number_to_confirm):
+def prompt_user_for_confirmation(number_to_confirm, naive_calls=None):
 	if (number_to_confirm >= MAX_API_CALLS_PER_RUN) or ((_PERSISTED_PRECOUNTER+number_to_confirm) >= MAX_API_CALLS_PER_MONTH) or VERBOSE_DETAILED:
 		monthly_percentage = float(_PERSISTED_PRECOUNTER+number_to_confirm) / MAX_API_CALLS_PER_MONTH
 		run_percentage = float(number_to_confirm) / MAX_API_CALLS_PER_RUN
 		print(f"Detected large amount of upcoming API calls:\n\t{number_to_confirm} calls ({monthly_percentage*100:.1f}% monthly max; {run_percentage*100:.1f}% run max)")
+		if naive_calls is not None:
+			print(f"\t(planned - a naive run would make {naive_calls} calls)")
 		## check user
 		user_input = False
 		while user_input==False or user_input[0]!='y':
@@ -94,71 +126,43 @@ def prompt_user_for_confirmation(number_to_confirm):
 		print("Continuing...")
 	pass
 
-def plot(dataframe, column=CHOSEN_METRIC, legend=True, missing_kwds={'color':'lightgrey'}):
-	settings = plot_config.SETTINGS.get(column, {})
-	## let's interpret ALL settings
-	cmap = settings.get("colorscale", "viridis")
-	if settings.get("reverse_color", False):
-		cmap += '_r'
-	alpha = settings.get("alpha", 1)
-	vmin = settings.get("vmin", None)
-	vmax = settings.get("vmax", None)
-	label = settings.get("label", column)
-	units = settings.get("units", "")
-	fmt = settings.get("tooltip_fmt", "{:.0f}")
-	edge_color = settings.get("edge_color", "black")
-	edge_width = settings.get("edge_width", 0.1)
-
-	dataframe.plot(column=column, cmap=cmap, alpha=alpha, legend=legend, 
-		edgecolor=edge_color, linewidth=edge_width, 
-		vmin=vmin, vmax=vmax, missing_kwds=missing_kwds)
-
-	# Title: (example) "Rent per Commute Minute ($/min)"
-	title = f"{label} ({units})" if units else label
-	plt.title(title)
-	plt.show()
+def plot(dataframe, column=CHOSEN_METRIC, legend=True, missing_kwds={'color':'lightgrey'}, outfile=False, show=True):
+	## settings are interpreted in one place, shared with the batch renderer (render.py)
+	style = render.style_for(column)
+	dataframe.plot(column=column, cmap=style['cmap'], alpha=style['alpha'], legend=legend, 
+		edgecolor=style['edge_color'], linewidth=style['edge_width'], 
+		vmin=style['vmin'], vmax=style['vmax'], missing_kwds=missing_kwds)
+	plt.title(style['title'])
+	if outfile:
+		plt.savefig(outfile, dpi=150, bbox_inches='tight')
+	if show:
+		plt.show()
+	plt.close()
 	return True
 
 def file_exists(filepath):
 	return os.path.exists(filepath)
 
 def load_geoms(geomfile, RenameDict):
-	'''This function includes all transformations.'''
-	gdata = gpd.read_file(geomfile)
-	gdata = gdata.rename(columns=RenameDict)
-	# now our normalized keys should work
-	gdata = gdata[list(RenameDict.values())]
-	gdata['zcta'] = gdata['zcta'].astype(str).str.zfill(5)
-	#### add centroids to nta
-	gdata = gdata.to_crs(epsg=4326) ## coord ref system WGS84 (EPSG:4326) << WE MIGHT CHANGE THIS
-	with warnings.catch_warnings():
-		warnings.filterwarnings("ignore", message='Geometry is in a geographic CRS.')
-		## UserWarning keeps getting thrown about calculating centroids 
-		gdata['centroid'] = gdata.geometry.centroid
-	gdata['lat'] = gdata['centroid'].y 
-	gdata['lon'] = gdata['centroid'].x
-	## after the centroid step, we've added an extra geom column - lets recast to prevent downstream issues
-	gdata = gpd.GeoDataFrame(gdata, geometry='geometry')
-	gdata.set_crs("EPSG:4326", inplace=True) # just re-enforcing crs
+	'''This function includes all transformations.
+	They're precomputed once per geometry file (see geometry_artifact.py): renames, equal-area centroids
+	(lat/lon in WGS84), and simplified shapes - so this is just a columnar read.'''
+	gdata = geometry_artifact.GeometryArtifact(geomfile, RenameDict).frame()
 	sanity_check(gdata, name='NTA')
 	return gdata
 
-def load_rent(rentfile, RenameDict):
-	'''This function includes all transformations.'''
-	rdata = pd.read_excel(rentfile)
-	rdata = rdata.rename(columns=RenameDict)
-	## now RENT_KEY and others should work!
-	rdata = rdata[RenameDict.values()]
-	rdata['rent_zip'] = rdata['rent_zip'].astype(str).str.zfill(5)
-	## we still need to:
-	## - filter to NYC Zips
-	rdata = rdata[(rdata['rent_zip'].isin(NYC_ZIPS))]
+def load_rent(rentfile, RenameDict, zips=NYC_ZIPS):
+	'''This function includes all transformations.
+	The .xls is only parsed once (see rent_store.py) - after that this is a keyed Parquet read.'''
+	## renames & zip padding happen in the conversion, and the region's Zip filter is pushed down to the read
+	rdata = rent_store.read_rent(rentfile, RenameDict, zips=zips)
 	# we can add county-to-borough-to-zip logic some other time if we need to
 	sanity_check(rdata, name='RENT')
 	return rdata
 
-def store_df(dataframe, outpath, OVERWRITE=False, DRIVER="GeoJSON", RemoveCols=False, PrettyPrint=False):
-	'''Geopandas has a bad prettyprint - we'll be using json.'''
+def store_df(dataframe, outpath, OVERWRITE=False, DRIVER="Parquet", RemoveCols=False, PrettyPrint=False):
+	'''Parquet (GeoParquet) by default - any other DRIVER goes through to_file.
+	Geopandas has a bad prettyprint - we'll be using json.'''
 	if outpath==True: 
 		outpath = utils.tempfile(prefix=f"store_df-")
 	if RemoveCols!=False:
@@ -166,13 +170,15 @@ def store_df(dataframe, outpath, OVERWRITE=False, DRIVER="GeoJSON", RemoveCols=F
 	else:
 		outdf = dataframe
 	if OVERWRITE!=True and not os.path.exists(outpath):
-		if PrettyPrint==False:
+		if DRIVER=="Parquet":
+			storage.write_frame(outdf, outpath)
+		elif PrettyPrint==False:
 			outdf.to_file(outpath, driver=DRIVER)
 		elif PrettyPrint==True:
 			## switch to json
 			geojson_dict = json.loads(outdf.to_json())
 			geojson_dict["crs"] = {"type": "name", "properties": {"name": "EPSG:4326"}} # preserving crs in json
-			with open(outpath.replace('.geojson','.json'), "w") as f:
+			with open(str(outpath).replace('.geojson','.json'), "w") as f:
 				json.dump(geojson_dict, f, indent=2)
 		print(f"Wrote dataframe to location: {outpath}")
 		return True
@@ -185,37 +191,260 @@ def remove_bad_rows(dataframe, column, bad_val=BAD_VAL, badfile=False):
 	good_df = dataframe[dataframe[COMMUTE_KEY]!=BAD_VAL]
 	return good_df
 
+def geoms_stage():
+	geom_df = load_geoms(ZCTA_GEOFILE, RenameDict=GEOM_COLUMN_RENAMES)
+	if SPATIAL_MODE in ['grid', 'hex']:
+		## cells replace zips as rows - rent still joins by zip, via the cell's containing ZCTA
+		geom_df = grid.build_grid(geom_df, cell_size_m=GRID_CELL_METERS, shape='square' if SPATIAL_MODE=='grid' else 'hex')
+	return geom_df
+
+def trip_slots(trips=None):
+	'''TRIPS with departures resolved to cache slots: [(destination, "HH:MM", weight), ...]'''
+	return [(dest, commute.get_departure_slot(departure), weight) for dest, departure, weight in (TRIPS if trips is None else trips)]
+
+def fetch_trips(geom_df, trips):
+	'''Long table of (lat, lon, destination, departure, COMMUTE_KEY) for [(destination, slot), ...].
+	Slots the provider answers identically (see CommuteProvider.departure_bucket) are only computed once.'''
+	provider = commute_providers.get_provider()
+	buckets = {}
+	for dest, slot in trips:
+		buckets.setdefault(provider.departure_bucket(slot), {}).setdefault(slot, []).append(dest)
+	frames = []
+	for bucket_slots in buckets.values():
+		slot = next(iter(bucket_slots)) # any slot in the bucket stands in for the rest
+		destinations = list(dict.fromkeys(dest for dests in bucket_slots.values() for dest in dests))
+		if COMMUTE_MODE == 'matrix':
+			slot_df = fetch_engine.fetch_commute_matrix(geom_df, destinations, lat_col='lat', lon_col='lon', dest_col='destination', departure_time=slot)
+		else:
+			parts = []
+			for dest in destinations:
+				part = fetch_engine.unique_origins(geom_df).reset_index(drop=True)
+				part['destination'] = dest
+				## one call per unique origin, in parallel
+				part[COMMUTE_KEY] = fetch_engine.fetch_commute_times(part, lat_col='lat', lon_col='lon', destination=dest, departure_time=slot)
+				parts.append(part)
+			slot_df = pd.concat(parts, ignore_index=True)
+		for each_slot, dests in bucket_slots.items():
+			frames.append(slot_df[slot_df['destination'].isin(dests)].assign(departure=each_slot))
+	return pd.concat(frames, ignore_index=True)
+
+def origins_stage(merged_df):
+	'''Unique (lat, lon) worth routing - rows without RENT_KEY can't be scored, so they're pruned before any call is planned.
+	commute & sweep are keyed on this frame's content, so a rent change that keeps the same origins reuses them.'''
+	origins_df = planner.scored_origins(merged_df, rent_col=RENT_KEY)
+	print(f"{len(origins_df)} unique origins to route ({int((~planner.usable_rows(merged_df, rent_col=RENT_KEY)).sum())} rows pruned - no rent)\n")
+	return origins_df
+
+def planned_fetch(origins_df, trips):
+	'''Plans the billed calls (see planner.py), confirms them, fetches, and interpolates whatever is over budget.
+	Returns (commute table, complete) - incomplete if any origin was skipped, declined or failed.'''
+	global _PERSISTED_PRECOUNTER
+	_PERSISTED_PRECOUNTER = retry_logic.get_counter()
+	provider = commute_providers.get_provider()
+	if not provider.uses_quota:
+		commute_df = fetch_trips(origins_df, trips)
+		return commute_df, not (commute_df[COMMUTE_KEY] == BAD_VAL).any()
+	## before we run any commute api's, we can plan & estimate
+	plan = planner.plan_calls(origins_df, trips, provider.cache_mode, budget=retry_logic.remaining_budget(), sample_fraction=SAMPLE_FRACTION)
+	print("Beginning API requests...\n")
+	print(plan.describe())
+	print_upcoming_usage(plan.planned_calls)
+	prompt_user_for_confirmation(plan.planned_calls, naive_calls=plan.naive_calls)
+	## claim the batch from the shared monthly ledger up front - a concurrent run can't take it mid-fetch
+	granted = retry_logic.reserve_budget(plan.planned_calls)
+	if granted < plan.planned_calls:
+		print(f"Only {granted}/{plan.planned_calls} planned calls fit this month's remaining budget (other runs hold the rest) - "
+			"the others will be declined & interpolated.\n")
+	commute_df = fetch_trips(plan.fetch_origins, trips)
+	complete = not len(plan.skipped_origins) and not (commute_df[COMMUTE_KEY] == BAD_VAL).any()
+	if len(plan.skipped_origins):
+		commute_df = pd.concat([commute_df, planner.fill_skipped(commute_df, plan.skipped_origins, trips, method=INTERPOLATION_METHOD)], ignore_index=True)
+	return commute_df, complete
+
+def commute_stage(origins_df):
+	'''Long table of (lat, lon, destination, departure, COMMUTE_KEY).
+	Each unique (destination, departure) is fetched once; the cache makes trips seen before free.'''
+	trips = list(dict.fromkeys((dest, slot) for dest, slot, _ in trip_slots()))
+	commute_df, complete = planned_fetch(origins_df, trips)
+	retry_logic.checkpoint()
+	print(f"Finished commute computations & API calls.\n\tAPI calls: {retry_logic.API_RUN_COUNTER}\n\tCache hits: {retry_logic.CACHE_HIT_COUNTER}\n")
+	## skipped/declined/failed origins aren't frozen into the stage cache - a later run with budget fetches them
+	return commute_df if complete else pipeline.Transient(commute_df)
+
+def sweep_stage(origins_df):
+	'''Departure profile for the first trip's destination: one row per origin, one float32 column per slot.'''
+	destination = TRIPS[0][0]
+	trips = [(destination, slot) for slot in commute.departure_slots(*SWEEP_WINDOW)]
+	sweep_df, complete = planned_fetch(origins_df, trips)
+	retry_logic.checkpoint()
+	print(f"Finished departure sweep ({len(trips)} slots).\n\tAPI calls: {retry_logic.API_RUN_COUNTER}\n\tCache hits: {retry_logic.CACHE_HIT_COUNTER}\n")
+	profile = sweep_df.drop_duplicates(['lat','lon','departure']).pivot(index=['lat','lon'], columns='departure', values=COMMUTE_KEY)
+	profile = profile.replace(BAD_VAL, np.nan).astype(np.float32)
+	profile.columns = [str(col) for col in profile.columns]
+	profile = profile.reset_index().assign(destination=destination)
+	return profile if complete else pipeline.Transient(profile)
+
+def profile_stats(profile_df):
+	'''SWEEP_STATS per origin, over the slots that returned a time.'''
+	slots = [col for col in profile_df.columns if col not in ['lat','lon','destination']]
+	minutes = profile_df[slots].to_numpy(dtype=float)
+	stats = profile_df[['lat','lon']].copy()
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning) # all-NaN origins stay NaN
+		for stat in SWEEP_STATS:
+			percentile = 50 if stat == 'median' else float(stat[1:])
+			stats[f"{COMMUTE_KEY}_{stat}"] = np.nanpercentile(minutes, percentile, axis=1)
+	return stats
+
+def score_stage(merged_df, commute_df, profile_df=None):
+	## every trip side by side, in TRIPS order, reduced to one COMMUTE_KEY per origin
+	trips = trip_slots()
+	weights = np.array([weight for _, _, weight in trips], dtype=float)
+	wide = commute_df.drop_duplicates(['lat','lon','destination','departure']).pivot(index=['lat','lon'], columns=['destination','departure'], values=COMMUTE_KEY)
+	wide = wide.reindex(columns=pd.MultiIndex.from_tuples([(dest, slot) for dest, slot, _ in trips]))
+	trip_minutes = wide.to_numpy(dtype=float, copy=True) ## written below - under copy-on-write the plain view is read-only
+	bad = (trip_minutes == BAD_VAL).any(axis=1)
+	trip_minutes[trip_minutes == BAD_VAL] = np.nan
+	## planner estimates come in flagged; failures & no-route origins get filled per trip, over every origin at once
+	estimated = np.zeros(len(wide), dtype=bool)
+	if 'estimated' in commute_df.columns:
+		flags = commute_df.drop_duplicates(['lat','lon','destination','departure']).assign(estimated=lambda df: df['estimated'].fillna(False).astype(bool))
+		flags = flags.pivot(index=['lat','lon'], columns=['destination','departure'], values='estimated').reindex(index=wide.index, columns=wide.columns)
+		estimated |= flags.fillna(False).to_numpy(dtype=bool).any(axis=1)
+	if INTERPOLATE_MISSING:
+		lats, lons = wide.index.get_level_values('lat').values, wide.index.get_level_values('lon').values
+		for j in range(trip_minutes.shape[1]):
+			trip_minutes[:, j], filled = interpolate.fill_missing(lats, lons, trip_minutes[:, j], method=INTERPOLATION_METHOD)
+			estimated |= filled
+		bad[:] = False
+	aggregate = scoring.aggregate_commute(trip_minutes, weights, how=COMMUTE_AGGREGATE)
+	aggregate[bad] = BAD_VAL
+	trip_columns = [f"{COMMUTE_KEY}_t{j}" for j in range(len(trips))] if len(trips) > 1 else []
+	lookup = pd.DataFrame({COMMUTE_KEY: aggregate, ESTIMATED_KEY: estimated, **{col: trip_minutes[:, j] for j, col in enumerate(trip_columns)}}, index=wide.index)
+	geom_df = merged_df.merge(lookup.reset_index(), on=['lat','lon'], how='left')
+	if profile_df is not None:
+		geom_df = geom_df.merge(profile_stats(profile_df), on=['lat','lon'], how='left')
+	if not INTERPOLATE_MISSING:
+		## API can return BAD_VAL, so we need to remove those dataframes
+		geom_df = remove_bad_rows(geom_df, column=COMMUTE_KEY, bad_val=BAD_VAL, badfile=False)
+	## every metric x (aggregate + each trip) x BR count in one pass (see config/plot_config.METRICS)
+	rent, br_counts = scoring.rent_matrix(geom_df)
+	commute_matrix = geom_df[[COMMUTE_KEY] + trip_columns].to_numpy(dtype=float)
+	columns = {}
+	for metric, values in scoring.score_tensor(rent, commute_matrix).items():
+		for i, br_count in enumerate(br_counts):
+			columns[scoring.metric_key(metric, br_count)] = values[:, 0, i]
+			for j in range(len(trip_columns)):
+				columns[f"{scoring.metric_key(metric, br_count)}_t{j}"] = values[:, j+1, i]
+		columns[metric] = values[:, 0, br_counts.index(CHOSEN_BR_COUNT)]
+	return geom_df.assign(**columns)
+
+def plot_stage(outfile, geom_df):
+	plot(geom_df, column=CHOSEN_METRIC, outfile=outfile, show=SHOW_PLOT)
+
+def render_all(geom_df, outdir=MAPS_PATH):
+	'''Every configured metric in one pass - zcta maps swap in simplified shapes (grid cells are already simple).'''
+	render_df = geom_df
+	if SPATIAL_MODE == 'zcta':
+		simple_df = geometry_artifact.GeometryArtifact(ZCTA_GEOFILE, GEOM_COLUMN_RENAMES).frame(level=RENDER_LEVEL, columns=['zcta'])
+		attributes = geom_df.drop(columns=[col for col in ['geometry', 'centroid'] if col in geom_df.columns])
+		render_df = simple_df.merge(attributes, on='zcta', how='inner')
+	return render.render_metrics(render_df, outdir=outdir, prefix=f"{REGION}-", processes=RENDER_PROCESSES)
+
 # === MAIN ===
 
 RENT_KEY = f"rent_{CHOSEN_BR_COUNT}BR"
+REGION_ZIPS = None # set in main(), once the region's extract exists
 
-## check output (/cache)
-if MERGED_FILE not in [False,True] and file_exists(MERGED_FILE):
-	print(f"Found cached output file: {MERGED_FILE}\nLoading file and skipping transformations...\n")
-	geom_df = gpd.read_file(MERGED_FILE)
-	plot(geom_df)#, SCORE_KEY)
-else:
-	print(f"No merged-cache found. Beginning data load:\n\tGeom File:\t{ZCTA_GEOFILE}\n\tRent File:\t{RENT_FILE}\n")
-	## this is the MAIN
-	# load nta & rent
-	geom_df = load_geoms(ZCTA_GEOFILE, RenameDict=GEOM_COLUMN_RENAMES)
-	rent_df = load_rent(RENT_FILE, RenameDict=RENT_COLUMN_RENAMES)
-	# merge
-	geom_df = geom_df.merge(rent_df, left_on='zcta', right_on='rent_zip', how='left')
-	## before we run any commute api's, we can run a quick estimate 
-	_PERSISTED_PRECOUNTER = retry_logic.get_counter()
-	number_of_upcoming_requests = estimate_upcoming_api_calls(geom_df)
-	prompt_user_for_confirmation(number_of_upcoming_requests)
-	## apply google commute times & scores
-	geom_df[COMMUTE_KEY] = geom_df.apply(retry_logic.call_api_with_limits, axis=1) ## this function ASSUMES lat & lon columns
-	retry_logic.write_counter()
-	print("Finished commute computations & API calls.\n")
-	## API can return BAD_VAL, so we need to remove those dataframes
-	geom_df = remove_bad_rows(geom_df, column=COMMUTE_KEY, bad_val=BAD_VAL, badfile=False)
-	geom_df[SCORE_KEY] = geom_df[RENT_KEY] / (geom_df[COMMUTE_KEY]+1)
-	geom_df[GRAVIKEY] = geom_df[RENT_KEY] / ((geom_df[COMMUTE_KEY])**2+1)
-	plot(geom_df)#, SCORE_KEY)
-	store_df(geom_df, MERGED_FILE, OVERWRITE=False, RemoveCols=['centroid'], PrettyPrint=False)
-
-print("Done! Hope you enjoyed!")
+def main():
+	'''The whole run - behind the __main__ guard, so worker processes (ie - RENDER_PROCESSES > 1 under spawn) can import this file safely.'''
+	global REGION, ZCTA_GEOFILE, REGION_ZIPS
+	parser = argparse.ArgumentParser(description="NYC Rent + Commute Heatmap")
+	parser.add_argument('--dry-run', action='store_true', help="report which stages would recompute, then exit")
+	parser.add_argument('--region', default=REGION, help="region name from config/regions.py")
+	parser.add_argument('--render-all', action='store_true', default=RENDER_ALL, help="write a map for every metric in plot_config.SETTINGS")
+	parser.add_argument('--profile', nargs='?', const='auto', default=None, metavar='STAGE',
+		help="cProfile a stage (default: every stage, keeping the slowest) & trace per-stage peak memory. cProfile only sees the main thread, so the commute thread pool's work shows up as waits")
+	parser.add_argument('--metrics-file', default=METRICS_FILE, help="also write run telemetry in Prometheus text format")
+	ARGS, _ = parser.parse_known_args()
+	if ARGS.profile:
+		telemetry.PROFILE_STAGE = ARGS.profile
+		telemetry.TRACE_MEMORY = True
+	if ARGS.region != REGION:
+		REGION = ARGS.region
+		ZCTA_GEOFILE = regions.region_file(REGION)
+
+	regions.build_regions([REGION]) # no-op once the region's extract exists
+	REGION_ZIPS = regions.region_zips(REGION)
+	GEOM_FILES = [ZCTA_GEOFILE.with_suffix(suffix) for suffix in ['.shp', '.shx', '.dbf', '.prj']] if ZCTA_GEOFILE.suffix == '.shp' else [ZCTA_GEOFILE]
+
+	## stages are keyed on their inputs. commute & sweep are keyed on the origins' content, not the rent config - a new
+	## rent file or CHOSEN_BR_COUNT that leaves the same origins worth routing only reruns scoring
+	provider = commute_providers.get_provider()
+	stages = pipeline.Pipeline()
+	geoms = stages.stage('load_geoms', geoms_stage, files=GEOM_FILES,
+		params={'region': REGION, 'renames': GEOM_COLUMN_RENAMES, 'spatial_mode': SPATIAL_MODE, 'cell_m': GRID_CELL_METERS if SPATIAL_MODE != 'zcta' else None})
+	rents = stages.stage('load_rent', lambda: load_rent(RENT_FILE, RenameDict=RENT_COLUMN_RENAMES, zips=REGION_ZIPS),
+		files=[RENT_FILE], params={'renames': RENT_COLUMN_RENAMES, 'zips': REGION_ZIPS})
+	merged = stages.stage('merge', lambda geom_df, rent_df: geom_df.merge(rent_df, left_on='zcta', right_on='rent_zip', how='left'),
+		upstream=[geoms, rents])
+	origins = stages.stage('origins', origins_stage, upstream=[merged], params={'rent_key': RENT_KEY}, content_key=True)
+	commutes = stages.stage('commute', commute_stage, upstream=[origins],
+		params={'provider': provider.cache_mode, 'local': None if provider.uses_quota else provider.settings, 'mode': COMMUTE_MODE,
+			'trips': sorted(set((dest, slot) for dest, slot, _ in trip_slots())),
+			'sample_fraction': SAMPLE_FRACTION, 'interpolate': INTERPOLATION_METHOD})
+	sweeps = stages.stage('sweep', sweep_stage, upstream=[origins],
+		params={'provider': provider.cache_mode, 'local': None if provider.uses_quota else provider.settings, 'mode': COMMUTE_MODE,
+			'destination': TRIPS[0][0], 'window': SWEEP_WINDOW, 'slot_minutes': commute.SLOT_MINUTES,
+			'sample_fraction': SAMPLE_FRACTION, 'interpolate': INTERPOLATION_METHOD}) if SWEEP_WINDOW else None
+	## weights & the aggregate only change scoring - the fetched trips are reused
+	scored = stages.stage('score', score_stage, upstream=[merged, commutes] + ([sweeps] if sweeps else []),
+		params={'rent_key': RENT_KEY, 'metrics': plot_config.METRICS, 'trips': trip_slots(), 'aggregate': COMMUTE_AGGREGATE,
+			'sweep_stats': SWEEP_STATS if sweeps else None, 'interpolate': INTERPOLATION_METHOD if INTERPOLATE_MISSING else None})
+	plotted = stages.stage('plot', plot_stage, upstream=[scored], kind='file', suffix='.png',
+		params={'metric': CHOSEN_METRIC, 'settings': plot_config.SETTINGS.get(CHOSEN_METRIC, {})})
+
+	if ARGS.dry_run:
+		stages.dry_run(plotted)
+		return
+
+	## a run that died mid-fetch left its results & billed calls in the journal - fold them in before planning
+	recovered_results, recovered_calls = retry_logic.checkpoint()
+	if recovered_results or recovered_calls:
+		print(f"Recovered an interrupted run: {recovered_results} commute times cached, {recovered_calls} API calls counted.\n")
+	scored_needs_run = not scored.is_cached()
+	print(f"Running pipeline:\n\tGeom File:\t{ZCTA_GEOFILE}\n\tRent File:\t{RENT_FILE}\n")
+	try:
+		geom_df = scored.load()
+		print(f"Map: {plotted.load()}")
+		if scored_needs_run:
+			with telemetry.stage_timer('publish'):
+				## publish the final frames where people expect them
+				storage.write_frame(geom_df.drop(columns=[col for col in ['centroid'] if col in geom_df.columns]), MERGED_FILE)
+				if COMMUTE_MODE == 'matrix':
+					storage.write_frame(commutes.load(), MATRIX_FILE)
+				if sweeps:
+					storage.write_frame(sweeps.load(), PROFILE_FILE)
+					sweep_columns = [f"{COMMUTE_KEY}_{stat}" for stat in SWEEP_STATS]
+					print(f"Departure sweep {SWEEP_WINDOW[0]}-{SWEEP_WINDOW[1]} (per origin, then across origins):\n{geom_df[sweep_columns].describe().loc[['mean','50%','max']]}\n")
+				if EXPORT_GEOJSON:
+					storage.export_geojson(geom_df, MERGED_FILE.with_suffix('.geojson'))
+				if EXPORT_TILES:
+					import tiles ## mapbox_vector_tile is only needed here
+					tiles.export_tiles(geom_df)
+		if ARGS.render_all:
+			with telemetry.stage_timer('render_all'):
+				render_all(geom_df)
+	finally:
+		retry_logic.checkpoint()
+		## failed runs are the ones we most want numbers for
+		print(f"Run report: {telemetry.write_report(RUN_REPORT_FILE)} (cache hit ratio: {telemetry.cache_hit_ratio()})")
+		if ARGS.metrics_file:
+			telemetry.write_prometheus(ARGS.metrics_file)
+		if ARGS.profile:
+			telemetry.dump_profile(RUN_REPORT_FILE.parent)
+
+	print("Done! Hope you enjoyed!")
 
+if __name__ == '__main__':
+	main()
@@ -7,20 +7,36 @@ from dotenv import load_dotenv
 load_dotenv() ## this will load the .env contents into env
 from lib.utils import log_error
 from constants import BAD_VAL
-import retry_logic as retry 
 from retry_logic import run_with_retries
 
 CHOSEN_DEPARTURE = 'tomorrow'
+DEFAULT_DESTINATION = "Times Square, New York, NY"
+TRAVEL_MODE = 'transit'
+SLOT_MINUTES = 15 ## departure times are bucketed into slots for caching
+REQUEST_TIMEOUT = 30 # seconds
+## Distance Matrix per-request limits (each origin x destination pair is one billed element)
+MATRIX_MAX_ORIGINS = 25
+MATRIX_MAX_DESTINATIONS = 25
+MATRIX_MAX_ELEMENTS = 100
+POOL_SIZE = 16 ## keep >= fetch_engine.MAX_WORKERS so workers don't wait on connections
 VERBOSE = False
 
 ## Loading the key
 google_api_key = os.getenv("GOOGLE_MAPS_API_KEY")
+## point this at a stand-in server (ie - benchmarks/mock_directions.py) to run without quota
+API_BASE_URL = os.getenv("GOOGLE_MAPS_BASE_URL", "https://maps.googleapis.com").rstrip('/')
 
-def get_google_time(origin_lat, origin_lon, 
-		destination="Times Square, New York, NY",
-		# destination="40 Ludlow St, New York, NY 10002", 
-		departure_time=True):
-	# global google_api_key, VERBOSE, MAX_RETRIES, CHOSEN_DEPARTURE ## << i dont think this is needed ?
+## one pooled session shared by every request (and every fetch worker thread)
+SESSION = requests.Session()
+SESSION.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE))
+SESSION.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE))
+
+def get_departure_time(departure_time=True):
+	if isinstance(departure_time, str) and ':' in departure_time:
+		## a departure slot (ie - "17:30"), on the same day CHOSEN_DEPARTURE would use
+		hour, minute = (int(part) for part in departure_time.split(':'))
+		departure = datetime.now().replace(hour=hour, minute=minute, second=0, microsecond=0)
+		return int(time.mktime(departure.timetuple()))
 	if departure_time in [True,False,'DEFAULT','default']:
 		if CHOSEN_DEPARTURE == 'now':
 			departure_time = int(datetime.now().timestamp())
@@ -28,19 +44,38 @@ def get_google_time(origin_lat, origin_lon,
 			## Departure time: 8:00 AM tomorrow to avoid transit gaps
 			departure = datetime.now().replace(hour=8, minute=0, second=0, microsecond=0)
 			departure_time = int(time.mktime(departure.timetuple()))
+	return departure_time
+
+def get_departure_slot(departure_time=True):
+	'''Time-of-day bucket (ie - "08:00") for cache keys, so yesterday's 8AM run still matches today's.'''
+	departure = datetime.fromtimestamp(get_departure_time(departure_time))
+	minute = (departure.minute // SLOT_MINUTES) * SLOT_MINUTES
+	return f"{departure.hour:02d}:{minute:02d}"
+
+def departure_slots(start, end, step=SLOT_MINUTES):
+	'''Every slot from start up to (not including) end, ie - ("07:00", "11:00") -> ["07:00", "07:15", ..., "10:45"].'''
+	to_minutes = lambda slot: int(slot.split(':')[0])*60 + int(slot.split(':')[1])
+	return [f"{minute//60:02d}:{minute%60:02d}" for minute in range(to_minutes(start), to_minutes(end), step)]
+
+def get_google_time(origin_lat, origin_lon,
+		destination=DEFAULT_DESTINATION,
+		# destination="40 Ludlow St, New York, NY 10002",
+		departure_time=True):
+	# global google_api_key, VERBOSE, MAX_RETRIES, CHOSEN_DEPARTURE ## << i dont think this is needed ?
+	departure_time = get_departure_time(departure_time)
 	## build the url
 	url = (
-		"https://maps.googleapis.com/maps/api/directions/json?"
+		f"{API_BASE_URL}/maps/api/directions/json?"
 		f"origin={origin_lat},{origin_lon}"
 		f"&destination={destination}"
-		f"&mode=transit"
+		f"&mode={TRAVEL_MODE}"
 		f"&departure_time={departure_time}"
 		f"&key={google_api_key}"
 	)
 	## send the request
 	## build request sender
 	def call_api():
-		response = requests.get(url)
+		response = SESSION.get(url, timeout=REQUEST_TIMEOUT)
 		return response.json() # ie - data
 
 	def extract_google_status(json_data):
@@ -50,8 +85,12 @@ def get_google_time(origin_lat, origin_lon,
 		call_api,
 		log_label=f"({origin_lat},{origin_lon})",
 		retry_statuses=['UNKNOWN_ERROR'],
-		extract_status_fn=extract_google_status
+		extract_status_fn=extract_google_status,
+		endpoint='directions'
 		)
+	if not isinstance(result, dict):
+		## run_with_retries gave up (BAD_VAL)
+		return BAD_VAL
 	status = result.get('status')
 
 	## after we move on w a successful (non-retry) result
@@ -72,6 +111,65 @@ def get_google_time(origin_lat, origin_lon,
 		print(f"API Error: {result['status']} for ({origin_lat:.4f},{origin_lon:.4f}), after finishing retry_logic.run_with_retries()...")
 		return BAD_VAL
 
+def chunk_matrix(origins, destinations):
+	'''Yields (origin_chunk, destination_chunk) pairs that fit inside the Distance Matrix request limits.'''
+	dest_size = min(len(destinations), MATRIX_MAX_DESTINATIONS, MATRIX_MAX_ELEMENTS)
+	for d in range(0, len(destinations), dest_size):
+		dest_chunk = destinations[d:d+dest_size]
+		origin_size = max(1, min(MATRIX_MAX_ORIGINS, MATRIX_MAX_ELEMENTS // len(dest_chunk)))
+		for o in range(0, len(origins), origin_size):
+			yield origins[o:o+origin_size], dest_chunk
+
+def get_google_matrix(origins, destinations, departure_time=True):
+	'''One Distance Matrix request.
+	origins: [(lat, lon), ...] and destinations: [address, ...], already chunked (see chunk_matrix).
+	Returns {(lat, lon, destination): minutes} - NaN for ZERO_RESULTS, BAD_VAL for errors.'''
+	departure_time = get_departure_time(departure_time)
+	params = {
+		"origins": "|".join(f"{lat},{lon}" for lat, lon in origins),
+		"destinations": "|".join(destinations),
+		"mode": TRAVEL_MODE,
+		"departure_time": departure_time,
+		"key": google_api_key,
+	}
+	def call_api():
+		response = SESSION.get(f"{API_BASE_URL}/maps/api/distancematrix/json", params=params, timeout=REQUEST_TIMEOUT)
+		return response.json()
+
+	def extract_google_status(json_data):
+		return json_data.get('status')
+
+	result = run_with_retries(
+		call_api,
+		log_label=f"(matrix {len(origins)}x{len(destinations)}, first origin {origins[0]})",
+		retry_statuses=['UNKNOWN_ERROR'],
+		extract_status_fn=extract_google_status,
+		endpoint='matrix'
+		)
+	all_bad = {(lat, lon, dest): BAD_VAL for lat, lon in origins for dest in destinations}
+	if not isinstance(result, dict):
+		return all_bad
+	status = result.get('status')
+	if status == 'REQUEST_DENIED':
+		raise RuntimeError("API Access was rejected. Check API key & permissions. Exiting.")
+	elif status != 'OK':
+		log_error(f"[{status}] - matrix {len(origins)}x{len(destinations)}: {params['origins']} -> {params['destinations']}")
+		return all_bad
+
+	## rows follow origins, elements follow destinations
+	times = {}
+	for (lat, lon), row in zip(origins, result.get('rows', [])):
+		for dest, element in zip(destinations, row.get('elements', [])):
+			element_status = element.get('status')
+			if element_status == 'OK':
+				times[(lat, lon, dest)] = round(element["duration"]["value"] / 60, 2)
+			elif element_status == 'ZERO_RESULTS':
+				times[(lat, lon, dest)] = np.nan
+			else:
+				log_error(f"[{element_status}] - matrix element ({lat},{lon}) -> {dest}")
+				times[(lat, lon, dest)] = BAD_VAL
+	return {**all_bad, **times}
+
 ## example lat/lon (from NTA data)
 # origin_lat = 40.7831
 # origin_lon = -73.9712  # e.g., Upper West Side
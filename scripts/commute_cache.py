@@ -0,0 +1,83 @@
+## Persistent commute-time cache
+## Keyed on (origin lat/lon, destination, departure slot, mode), so re-runs for a new
+## rent file or a different CHOSEN_BR_COUNT never touch the API for origins we've seen.
+import sqlite3
+import time
+import math
+import threading
+from pathlib import Path
+
+CACHE_FILE = Path(__file__).resolve().parent.parent / "data" / "cache" / "commute_cache.sqlite"
+CACHE_TTL_DAYS = 30 ## transit schedules drift; older entries get refetched
+CACHE_MAX_ENTRIES = 250000 ## oldest entries are evicted past this size
+COORD_PRECISION = 5 ## ~1m at NYC latitudes - keeps float noise out of the key
+ENABLED = True
+
+_CONNECTION = None
+_LOCK = threading.RLock() ## one connection is shared by all fetch workers
+
+def _connect(cache_file=CACHE_FILE):
+	global _CONNECTION
+	with _LOCK:
+		if _CONNECTION is None:
+			Path(cache_file).parent.mkdir(parents=True, exist_ok=True)
+			_CONNECTION = sqlite3.connect(str(cache_file), check_same_thread=False)
+			_CONNECTION.execute(
+				"CREATE TABLE IF NOT EXISTS commute_cache ("
+				" origin_lat REAL NOT NULL, origin_lon REAL NOT NULL,"
+				" destination TEXT NOT NULL, departure_slot TEXT NOT NULL, mode TEXT NOT NULL,"
+				" minutes REAL, fetched_at REAL NOT NULL,"
+				" PRIMARY KEY (origin_lat, origin_lon, destination, departure_slot, mode))"
+			)
+			_CONNECTION.execute("CREATE INDEX IF NOT EXISTS idx_fetched_at ON commute_cache (fetched_at)")
+			_CONNECTION.commit()
+			evict()
+	return _CONNECTION
+
+def make_key(origin_lat, origin_lon, destination, departure_slot, mode):
+	return (round(float(origin_lat), COORD_PRECISION), round(float(origin_lon), COORD_PRECISION),
+		str(destination), str(departure_slot), str(mode))
+
+def get_cached_time(key):
+	'''Returns (hit, minutes). A hit can still hold NaN (ie - ZERO_RESULTS was cached).'''
+	if not ENABLED:
+		return False, None
+	cutoff = time.time() - CACHE_TTL_DAYS*86400
+	with _LOCK:
+		row = _connect().execute(
+			"SELECT minutes FROM commute_cache WHERE origin_lat=? AND origin_lon=? AND destination=?"
+			" AND departure_slot=? AND mode=? AND fetched_at>=?", (*key, cutoff)).fetchone()
+	if row is None:
+		return False, None
+	return True, (math.nan if row[0] is None else row[0])
+
+def store_times(items):
+	'''items is [(key, minutes), ...] - real answers (minutes or NaN), never BAD_VAL - written in one transaction.'''
+	if not ENABLED or not items:
+		return False
+	now = time.time()
+	rows = [(*key, (None if minutes is None or math.isnan(minutes) else minutes), now) for key, minutes in items]
+	with _LOCK:
+		conn = _connect()
+		conn.executemany("INSERT OR REPLACE INTO commute_cache VALUES (?,?,?,?,?,?,?)", rows)
+		conn.commit()
+	return True
+
+def evict(ttl_days=CACHE_TTL_DAYS, max_entries=CACHE_MAX_ENTRIES):
+	'''Drops expired rows, then the oldest rows past max_entries.'''
+	with _LOCK:
+		conn = _connect()
+		conn.execute("DELETE FROM commute_cache WHERE fetched_at < ?", (time.time() - ttl_days*86400,))
+		count = conn.execute("SELECT COUNT(*) FROM commute_cache").fetchone()[0]
+		if count > max_entries:
+			conn.execute("DELETE FROM commute_cache WHERE rowid IN "
+				"(SELECT rowid FROM commute_cache ORDER BY fetched_at ASC LIMIT ?)", (count - max_entries,))
+		conn.commit()
+	pass
+
+def clear():
+	with _LOCK:
+		conn = _connect()
+		conn.execute("DELETE FROM commute_cache")
+		conn.commit()
+	pass
@@ -0,0 +1,145 @@
+## Commute providers
+## Everything that needs a commute time goes through get_provider(), so the Google API
+## and the offline local router are swappable via config/commute_config.py.
+from pathlib import Path
+import numpy as np
+import config.commute_config as commute_config
+
+PARENT_PATH = Path(__file__).resolve().parent.parent
+
+class CommuteProvider:
+	'''Base interface. uses_quota=True means calls are billed - they go through the cache & counters in retry_logic.'''
+	name = 'base'
+	uses_quota = False
+
+	@property
+	def cache_mode(self):
+		return self.name
+
+	def departure_bucket(self, slot):
+		'''Departure slots ("HH:MM") that map to the same bucket give the same answer - a sweep only computes one per bucket.'''
+		return slot
+
+	def get_time(self, origin_lat, origin_lon, destination, departure_time=True):
+		raise NotImplementedError
+
+	def get_times(self, lats, lons, destination, departure_time=True):
+		return np.array([self.get_time(lat, lon, destination, departure_time) for lat, lon in zip(lats, lons)], dtype=float)
+
+	def get_matrix(self, origins, destinations, departure_time=True):
+		'''origins: [(lat, lon), ...] -> {(lat, lon, destination): minutes}'''
+		lats = [lat for lat, lon in origins]
+		lons = [lon for lat, lon in origins]
+		matrix = {}
+		for dest in destinations:
+			for (lat, lon), minutes in zip(origins, self.get_times(lats, lons, dest, departure_time)):
+				matrix[(lat, lon, dest)] = minutes
+		return matrix
+
+class GoogleProvider(CommuteProvider):
+	name = 'google'
+	uses_quota = True
+
+	@property
+	def cache_mode(self):
+		import commute
+		return commute.TRAVEL_MODE ## keeps keys from before providers existed valid
+
+	def get_time(self, origin_lat, origin_lon, destination, departure_time=True):
+		import commute
+		return commute.get_google_time(origin_lat, origin_lon, destination=destination, departure_time=departure_time)
+
+	def get_matrix(self, origins, destinations, departure_time=True):
+		import commute
+		matrix = {}
+		for origin_chunk, dest_chunk in commute.chunk_matrix(list(origins), list(destinations)):
+			matrix.update(commute.get_google_matrix(origin_chunk, dest_chunk, departure_time=departure_time))
+		return matrix
+
+class LocalProvider(CommuteProvider):
+	'''Offline routing over a GTFS feed ("transit"), a road edge list ("drive"), or straight-line walking ("walk").'''
+	name = 'local'
+	uses_quota = False
+
+	def __init__(self, settings=None):
+		self.settings = dict(commute_config.LOCAL, **(settings or {}))
+		self.mode = self.settings["mode"]
+		self._graph = None
+		self._graph_key = None
+		self._isochrones = {} ## destination -> minutes from every graph node
+		self._waits = None ## first-boarding wait per hour of day (transit + headway_waits only)
+
+	@property
+	def cache_mode(self):
+		return f"local-{self.mode}"
+
+	def departure_bucket(self, slot):
+		'''The graph is schedule-free - only the hour's headway changes the answer, so slots bucket by hour.'''
+		if self.mode == 'transit' and self.settings["headway_waits"]:
+			return f"{slot[:2]}:00"
+		return 'any'
+
+	def access_penalty(self, departure_time):
+		'''First-boarding wait for this departure: half the headway in its hour, or the flat boarding penalty.'''
+		if self.mode != 'transit' or not self.settings["headway_waits"]:
+			return None
+		import commute
+		import local_routing
+		if self._waits is None:
+			self._waits = local_routing.hourly_waits(PARENT_PATH / self.settings["gtfs_path"], self.settings)
+		return float(self._waits[int(commute.get_departure_slot(departure_time)[:2])])
+
+	def graph(self):
+		import local_routing
+		if self._graph is None:
+			if self.mode == 'transit':
+				gtfs_path = PARENT_PATH / self.settings["gtfs_path"]
+				nodes, edges = local_routing.load_gtfs_graph(gtfs_path, self.settings)
+				self._graph = local_routing.RoutingGraph(nodes, edges, self.settings, access_penalty=self.settings["boarding_penalty_min"])
+				self._graph_key = local_routing.file_signature(
+					[gtfs_path / name for name in ["stops.txt", "stop_times.txt", "transfers.txt"]], params=self.settings)
+			elif self.mode == 'drive':
+				nodes, edges = local_routing.load_edge_list_graph(PARENT_PATH / self.settings["road_nodes"], PARENT_PATH / self.settings["road_edges"])
+				self._graph = local_routing.RoutingGraph(nodes, edges, self.settings)
+			else:
+				raise ValueError(f"Local mode '{self.mode}' has no graph (expected 'transit' or 'drive').")
+		return self._graph
+
+	def get_times(self, lats, lons, destination, departure_time=True):
+		import local_routing
+		dest_lat, dest_lon = resolve_destination(destination)
+		if self.mode == 'walk':
+			meters = np.linalg.norm(local_routing.to_xy(lats, lons) - local_routing.to_xy([dest_lat], [dest_lon])[0], axis=1)
+			return np.round(local_routing.walk_minutes(meters, self.settings), 2)
+		graph = self.graph()
+		if self.settings["routing"] == 'isochrone':
+			## one reverse search per destination, reused for every origin we're ever asked about
+			if (dest_lat, dest_lon) not in self._isochrones:
+				self._isochrones[(dest_lat, dest_lon)] = graph.times_to(dest_lat, dest_lon)
+			return np.round(graph.isochrone_times(lats, lons, dest_lat, dest_lon, node_times=self._isochrones[(dest_lat, dest_lon)],
+				access_penalty=self.access_penalty(departure_time)), 2)
+		## 'all_pairs': transit graphs are small enough to precompute; road graphs search from the needed nodes only
+		return np.round(graph.route_times(lats, lons, dest_lat, dest_lon, cache_key=self._graph_key, access_penalty=self.access_penalty(departure_time)), 2)
+
+	def get_time(self, origin_lat, origin_lon, destination, departure_time=True):
+		return float(self.get_times([origin_lat], [origin_lon], destination, departure_time)[0])
+
+def resolve_destination(destination):
+	'''(lat, lon) tuples pass straight through; addresses must be listed in commute_config.DESTINATION_COORDS.'''
+	if isinstance(destination, (tuple, list)) and len(destination) == 2:
+		return float(destination[0]), float(destination[1])
+	if destination in commute_config.DESTINATION_COORDS:
+		return commute_config.DESTINATION_COORDS[destination]
+	raise ValueError(f"No coordinates for destination '{destination}'. Add it to config/commute_config.py DESTINATION_COORDS.")
+
+PROVIDERS = {'google': GoogleProvider, 'local': LocalProvider}
+_ACTIVE = {}
+
+def get_provider(name=None):
+	'''Returns the (cached) provider instance named in commute_config.PROVIDER.'''
+	name = name or commute_config.PROVIDER
+	if name not in PROVIDERS:
+		raise ValueError(f"Unknown commute provider '{name}' (expected one of {list(PROVIDERS)}).")
+	if name not in _ACTIVE:
+		_ACTIVE[name] = PROVIDERS[name]()
+	return _ACTIVE[name]
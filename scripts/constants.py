@@ -16,6 +16,8 @@ COMMUTE_KEY = 'commute_minutes'
 SCORE_KEY = 'score'
 GRAVIKEY = 'gravity'
 ANTIGRAV_KEY = 'antigravity'
+ESTIMATED_KEY = 'commute_estimated' # True where COMMUTE_KEY was interpolated from neighbours
+MERGED_FILENAME = 'nyc-ScorePerZCTA.parquet' # final merged GeoParquet, in outputs/ - one name for every script that reads it back
 
 NYC_COUNTIES = [i+' County' for i in 'Bronx,Kings,New York,Queens,Richmond'.split(',')]
 NYC_ZIPS = ['10001', '10002', '10003', '10004', '10005', '10006', '10007', '10009', '10010',
@@ -0,0 +1,132 @@
+## Concurrent commute fetching
+## Runs retry_logic.call_api_with_limits over the deduplicated origins with a bounded
+## thread pool; a token bucket keeps us under the provider's requests-per-second limit.
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pandas as pd
+import retry_logic
+import commute_cache
+import commute
+import commute_providers
+import telemetry
+from constants import COMMUTE_KEY
+
+MAX_WORKERS = 8
+REQUESTS_PER_SECOND = 10 ## Directions API allows far more, but we don't need to push it
+BURST_SIZE = 10
+VERBOSE = True
+
+class TokenBucket:
+	'''Thread-safe token bucket - acquire() blocks until a token is free.'''
+	def __init__(self, rate=REQUESTS_PER_SECOND, capacity=BURST_SIZE):
+		self.rate = float(rate)
+		self.capacity = float(capacity)
+		self.tokens = float(capacity)
+		self.updated = time.monotonic()
+		self.lock = threading.Lock()
+
+	def acquire(self):
+		while True:
+			with self.lock:
+				now = time.monotonic()
+				self.tokens = min(self.capacity, self.tokens + (now - self.updated)*self.rate)
+				self.updated = now
+				if self.tokens >= 1:
+					self.tokens -= 1
+					return True
+				wait_time = (1 - self.tokens) / self.rate
+			time.sleep(wait_time)
+
+def run_in_pool(fn, calls, max_workers=MAX_WORKERS, requests_per_second=REQUESTS_PER_SECOND):
+	'''Runs fn(*args) for every args tuple in calls on a thread pool, throttled by a shared TokenBucket.
+	Yields (args, result) as calls finish.'''
+	previous_limiter = retry_logic.RATE_LIMITER
+	retry_logic.RATE_LIMITER = TokenBucket(rate=requests_per_second, capacity=max(1, min(BURST_SIZE, max_workers)))
+	try:
+		with ThreadPoolExecutor(max_workers=max_workers) as pool:
+			futures = {pool.submit(fn, *args): args for args in calls}
+			try:
+				for future in as_completed(futures):
+					yield futures[future], future.result()
+			except BaseException:
+				## REQUEST_DENIED (or Ctrl-C) - don't keep burning quota on the queued calls
+				for future in futures:
+					future.cancel()
+				raise
+	finally:
+		retry_logic.RATE_LIMITER = previous_limiter
+
+def unique_origins(dataframe, lat_col='lat', lon_col='lon'):
+	return dataframe[[lat_col, lon_col]].dropna().drop_duplicates()
+
+def fetch_commute_times(dataframe, lat_col='lat', lon_col='lon', fetch_fn=None, destination=None, departure_time=True,
+		max_workers=MAX_WORKERS, requests_per_second=REQUESTS_PER_SECOND):
+	'''Returns a Series (aligned to dataframe.index) of commute minutes, calling fetch_fn once per unique origin.
+	destination/departure_time pick the trip (default: commute.DEFAULT_DESTINATION at CHOSEN_DEPARTURE).'''
+	origins = unique_origins(dataframe, lat_col=lat_col, lon_col=lon_col)
+	destination = commute.DEFAULT_DESTINATION if destination is None else destination
+	provider = commute_providers.get_provider()
+	if fetch_fn is None and not provider.uses_quota:
+		## offline provider - every origin in one vectorized pass, no pool needed
+		if VERBOSE: print(f"Computing {len(origins)} unique origins locally ({provider.cache_mode})...")
+		minutes = provider.get_times(origins[lat_col].values, origins[lon_col].values, destination, departure_time)
+		return map_to_rows(dataframe, dict(zip(origins.itertuples(index=False, name=None), minutes)), lat_col, lon_col)
+	if fetch_fn is None:
+		fetch_fn = retry_logic.call_api_with_limits
+	if VERBOSE:
+		print(f"Fetching {len(origins)} unique origins ({len(dataframe)} rows) with {max_workers} workers @ {requests_per_second} req/s...")
+
+	calls = [({'lat': lat, 'lon': lon, 'destination': destination, 'departure': departure_time},) for lat, lon in origins.itertuples(index=False, name=None)]
+	results = {}
+	for (row,), output_time in run_in_pool(fetch_fn, calls, max_workers=max_workers, requests_per_second=requests_per_second):
+		results[(row['lat'], row['lon'])] = output_time
+
+	return map_to_rows(dataframe, results, lat_col, lon_col)
+
+def map_to_rows(dataframe, results, lat_col='lat', lon_col='lon'):
+	'''Maps {(lat, lon): minutes} back onto every row of dataframe.'''
+	lookup = pd.Series(list(results.values()), index=pd.MultiIndex.from_tuples(list(results.keys())), dtype=float) \
+		if results else pd.Series(dtype=float)
+	row_keys = pd.MultiIndex.from_frame(dataframe[[lat_col, lon_col]])
+	return pd.Series(lookup.reindex(row_keys).values, index=dataframe.index, dtype=float)
+
+def fetch_commute_matrix(dataframe, destinations, lat_col='lat', lon_col='lon', dest_col='destination', departure_time=True,
+		max_workers=MAX_WORKERS, requests_per_second=REQUESTS_PER_SECOND):
+	'''N origins x M destinations in batched Distance Matrix calls.
+	Returns a long table: one row per (lat, lon, destination), with COMMUTE_KEY minutes.'''
+	origins = list(unique_origins(dataframe, lat_col=lat_col, lon_col=lon_col).itertuples(index=False, name=None))
+	destinations = list(dict.fromkeys(destinations)) # dedupe, keep order
+	provider = commute_providers.get_provider()
+	if not provider.uses_quota:
+		results = provider.get_matrix(origins, destinations, departure_time)
+		return pd.DataFrame([(lat, lon, dest, minutes) for (lat, lon, dest), minutes in results.items()],
+			columns=[lat_col, lon_col, dest_col, COMMUTE_KEY])
+	slot = commute.get_departure_slot(departure_time)
+
+	## cache first - only the missing pairs get requested
+	results = {}
+	missing = {} # origin -> destinations we still need
+	for lat, lon in origins:
+		for dest in destinations:
+			cache_hit, cached_time = commute_cache.get_cached_time(commute_cache.make_key(lat, lon, dest, slot, provider.cache_mode))
+			if cache_hit:
+				retry_logic.increment_cache_counter()
+				results[(lat, lon, dest)] = cached_time
+			else:
+				telemetry.count('cache_lookups', result='miss')
+				missing.setdefault((lat, lon), []).append(dest)
+	## origins missing the same destinations can share requests
+	groups = {}
+	for origin, dests in missing.items():
+		groups.setdefault(tuple(dests), []).append(origin)
+	chunks = [(*chunk, departure_time) for dests, group_origins in groups.items() for chunk in commute.chunk_matrix(group_origins, list(dests))]
+	if VERBOSE:
+		print(f"Fetching {len(origins)}x{len(destinations)} commute matrix: {len(results)} cached, "
+			f"{sum(len(v) for v in missing.values())} elements in {len(chunks)} batch requests...")
+
+	for _, chunk_results in run_in_pool(retry_logic.call_matrix_with_limits, chunks, max_workers=max_workers, requests_per_second=requests_per_second):
+		results.update(chunk_results)
+
+	return pd.DataFrame([(lat, lon, dest, minutes) for (lat, lon, dest), minutes in results.items()],
+		columns=[lat_col, lon_col, dest_col, COMMUTE_KEY])
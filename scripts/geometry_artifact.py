@@ -0,0 +1,105 @@
+## Precomputed geometry artifact
+## One build per ZCTA source file: equal-area centroids (correct, unlike centroids taken in lon/lat),
+## multi-level simplified shapes for rendering/export, and a spatial index: GeoParquet bbox covering
+## columns, so bbox reads skip row groups on disk and the STRtree is packed from them without decoding
+## any geometry. Rows are Hilbert-sorted so nearby shapes sit together on disk. Loads are lazy and columnar.
+import hashlib
+from pathlib import Path
+import numpy as np
+import geopandas as gpd
+import pyarrow.parquet as pq
+import shapely
+from shapely import STRtree
+import storage
+
+GEOMETRY_CACHE_PATH = Path(__file__).resolve().parent.parent / "data" / "cache" / "geometry"
+EQUAL_AREA_CRS = "EPSG:5070" ## CONUS Albers equal-area - fine for any US region
+OUTPUT_CRS = "EPSG:4326"
+SIMPLIFY_LEVELS = {'geom_10m': 10, 'geom_50m': 50, 'geom_200m': 200} ## column -> tolerance in meters
+ROW_GROUP_SIZE = 512 ## small groups, so a bbox read skips most of a large extract
+ARTIFACT_VERSION = 2 ## bump when the artifact's layout changes - older builds are rebuilt
+VERBOSE = True
+
+def source_files(geomfile):
+	geomfile = Path(geomfile)
+	if geomfile.suffix == '.shp':
+		return [geomfile.with_suffix(suffix) for suffix in ['.shp', '.shx', '.dbf', '.prj']]
+	return [geomfile]
+
+def artifact_signature(geomfile, RenameDict):
+	digest = hashlib.sha1(repr(sorted(RenameDict.items())).encode())
+	digest.update(repr(sorted(SIMPLIFY_LEVELS.items())).encode())
+	digest.update(f"v{ARTIFACT_VERSION}".encode())
+	for path in source_files(geomfile):
+		if path.exists():
+			digest.update(f"{path.name}:{path.stat().st_size}:{path.stat().st_mtime_ns};".encode())
+	return digest.hexdigest()[:16]
+
+def read_source(geomfile):
+	return storage.read_frame(geomfile) if Path(geomfile).suffix == '.parquet' else gpd.read_file(geomfile)
+
+def build_artifact(geomfile, RenameDict, outpath):
+	'''Renames, pads zips, projects once, and writes every precomputed column.'''
+	if VERBOSE: print(f"Building geometry artifact (one-time): {geomfile} -> {outpath.name}")
+	gdata = read_source(geomfile).rename(columns=RenameDict)
+	gdata = gdata[list(RenameDict.values())]
+	gdata['zcta'] = gdata['zcta'].astype(str).str.zfill(5)
+	projected = gdata.to_crs(EQUAL_AREA_CRS)
+	## Hilbert order keeps spatial neighbours adjacent (tight row-group bounds, so bbox reads prune well)
+	order = np.argsort(projected.geometry.hilbert_distance().values, kind='stable')
+	projected = projected.iloc[order].reset_index(drop=True)
+	artifact = projected.to_crs(OUTPUT_CRS)
+	artifact['centroid'] = projected.geometry.centroid.to_crs(OUTPUT_CRS).values
+	artifact['lat'] = artifact['centroid'].y
+	artifact['lon'] = artifact['centroid'].x
+	for column, tolerance in SIMPLIFY_LEVELS.items():
+		artifact[column] = projected.geometry.simplify(tolerance, preserve_topology=True).to_crs(OUTPUT_CRS).values
+	artifact = gpd.GeoDataFrame(artifact, geometry='geometry', crs=OUTPUT_CRS)
+	storage.write_frame(artifact, outpath, covering_bbox=True, row_group_size=ROW_GROUP_SIZE)
+	return outpath
+
+class GeometryArtifact:
+	'''Lazy handle - nothing is read until frame()/bounds()/sindex() is called.'''
+	def __init__(self, geomfile, RenameDict, cache_path=GEOMETRY_CACHE_PATH):
+		self.geomfile = Path(geomfile)
+		self.RenameDict = RenameDict
+		self.path = Path(cache_path) / f"{self.geomfile.stem}-{artifact_signature(geomfile, RenameDict)}.parquet"
+		self._bounds = None
+		self._sindex = None
+
+	def ensure_built(self):
+		if not self.path.exists():
+			build_artifact(self.geomfile, self.RenameDict, self.path)
+		return self.path
+
+	def frame(self, level='geometry', columns=None, bbox=None):
+		'''Rows with `level` ('geometry' for full detail, or a SIMPLIFY_LEVELS column) as the active geometry.
+		columns=None reads the attributes load_geoms always returned (plus centroid, lat, lon).
+		bbox=(minx, miny, maxx, maxy) in OUTPUT_CRS only reads rows whose full-detail bounds overlap it.'''
+		self.ensure_built()
+		if columns is None:
+			columns = [col for col in self.RenameDict.values() if col != 'geometry'] + ['centroid', 'lat', 'lon']
+		gdata = storage.read_frame(self.path, columns=columns, geometry=level, bbox=bbox)
+		if level != 'geometry':
+			## downstream code always expects 'geometry'
+			gdata = gdata.rename_geometry('geometry')
+		return gdata
+
+	def bounds(self):
+		'''(minx, miny, maxx, maxy) per row, straight from the bbox columns - no geometry decode.'''
+		if self._bounds is None:
+			self.ensure_built()
+			bbox = pq.read_table(self.path, columns=['bbox']).column('bbox').combine_chunks()
+			self._bounds = np.column_stack([bbox.field(name).to_numpy() for name in ['xmin', 'ymin', 'xmax', 'ymax']])
+		return self._bounds
+
+	def sindex(self):
+		'''STRtree over the row bounds, packed on first use - query() gives candidate row positions (bounds overlap only).'''
+		if self._sindex is None:
+			self._sindex = STRtree(shapely.box(*self.bounds().T))
+		return self._sindex
+
+	def query(self, geometry, columns=None, predicate='intersects'):
+		'''Rows whose geometry satisfies `predicate` with `geometry` (OUTPUT_CRS) - a bbox read narrows, then the exact test.'''
+		gdata = self.frame(columns=columns, bbox=tuple(shapely.bounds(geometry)))
+		return gdata[getattr(gdata.geometry, predicate)(geometry)].reset_index(drop=True)
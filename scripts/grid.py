@@ -0,0 +1,69 @@
+## Grid / hexbin tiling for high-resolution heatmaps
+## Tiles the ZCTA extent into square or hex cells (in meters), then joins each cell to the
+## ZCTA containing its centroid, so rent comes along by zip and commute is computed per cell.
+import numpy as np
+import geopandas as gpd
+import shapely
+
+GRID_CRS = "EPSG:32618" ## UTM 18N - meters, and accurate centroids around NYC
+CELL_SIZE_M = 250
+VERBOSE = True
+
+def square_cells(bounds, cell_size):
+	minx, miny, maxx, maxy = bounds
+	xs, ys = np.meshgrid(np.arange(minx, maxx, cell_size), np.arange(miny, maxy, cell_size))
+	xs, ys = xs.ravel(), ys.ravel()
+	return shapely.box(xs, ys, xs+cell_size, ys+cell_size)
+
+def hex_cells(bounds, cell_size):
+	'''Flat-topped hexes, cell_size across the flats (same spacing as a square grid of that size).'''
+	minx, miny, maxx, maxy = bounds
+	radius = cell_size / np.sqrt(3)
+	cols = np.arange(int(np.ceil((maxx-minx) / (1.5*radius))) + 1)
+	rows = np.arange(int(np.ceil((maxy-miny) / cell_size)) + 1)
+	col_index, row_index = np.meshgrid(cols, rows)
+	col_index, row_index = col_index.ravel(), row_index.ravel()
+	center_x = minx + col_index*1.5*radius
+	center_y = miny + row_index*cell_size + (col_index % 2)*cell_size/2
+	angles = np.radians(np.arange(0, 360, 60))
+	ring_x = center_x[:, None] + radius*np.cos(angles)[None, :]
+	ring_y = center_y[:, None] + radius*np.sin(angles)[None, :]
+	return shapely.polygons(np.stack([ring_x, ring_y], axis=-1))
+
+def make_cells(extent_gdf, cell_size_m=CELL_SIZE_M, shape='square'):
+	'''Cells covering extent_gdf (any CRS) - only ones touching a polygon are kept, via the spatial index.'''
+	projected = extent_gdf.to_crs(GRID_CRS)
+	if shape == 'square':
+		polygons = square_cells(projected.total_bounds, cell_size_m)
+	elif shape == 'hex':
+		polygons = hex_cells(projected.total_bounds, cell_size_m)
+	else:
+		raise ValueError(f"Unknown grid shape '{shape}' (expected 'square' or 'hex').")
+	## bulk STRtree query: (cell index, polygon index) pairs that intersect
+	cell_index, _ = projected.sindex.query(polygons, predicate='intersects')
+	cells = gpd.GeoDataFrame(geometry=polygons[np.unique(cell_index)], crs=GRID_CRS)
+	if VERBOSE: print(f"Built {len(cells)} {shape} cells ({cell_size_m}m) from {len(polygons)} candidates")
+	return cells
+
+def assign_zcta(cells, zcta_gdf, zcta_col='zcta'):
+	'''Cell -> ZCTA by centroid containment (spatial index join). Cells outside every ZCTA (water) are dropped.'''
+	zctas = zcta_gdf[[zcta_col, 'geometry']].to_crs(cells.crs)
+	centroids = gpd.GeoDataFrame(geometry=cells.geometry.centroid, crs=cells.crs)
+	joined = gpd.sjoin(centroids, zctas, how='inner', predicate='within')
+	joined = joined[~joined.index.duplicated(keep='first')]
+	cells = cells.loc[joined.index].copy()
+	cells[zcta_col] = joined[zcta_col].values
+	return cells
+
+def build_grid(zcta_gdf, cell_size_m=CELL_SIZE_M, shape='square', zcta_col='zcta'):
+	'''Full grid-mode geometry: cell_id, zcta, lat, lon, centroid & geometry, in EPSG:4326 (like load_geoms).'''
+	cells = make_cells(zcta_gdf, cell_size_m=cell_size_m, shape=shape)
+	cells = assign_zcta(cells, zcta_gdf, zcta_col=zcta_col)
+	## centroids come from the projected cells, so they're exact
+	centroids = cells.geometry.centroid.to_crs(epsg=4326)
+	cells = cells.to_crs(epsg=4326).reset_index(drop=True)
+	cells.insert(0, 'cell_id', np.arange(len(cells)))
+	cells['centroid'] = centroids.values
+	cells['lat'] = cells['centroid'].y
+	cells['lon'] = cells['centroid'].x
+	return gpd.GeoDataFrame(cells, geometry='geometry', crs="EPSG:4326")
@@ -0,0 +1,46 @@
+## Spatial interpolation of commute times
+## Fills origins we didn't (or couldn't) fetch from their fetched neighbours, with a KD-tree over
+## centroids - one vectorized query for every missing origin at once. Inverse-distance weighting,
+## or a Gaussian kernel (a kriging-style smooth falloff with distance).
+import numpy as np
+from scipy.spatial import cKDTree
+from local_routing import to_xy
+
+METHOD = 'idw' # 'idw' or 'gaussian'
+NEIGHBORS = 8
+POWER = 2 ## inverse-distance weighting exponent
+BANDWIDTH_M = 750 ## gaussian kernel length scale
+MAX_DISTANCE_M = 3000 ## holes with no known neighbour this close stay NaN (ie - across water)
+MIN_DISTANCE_M = 1.0 ## keeps a coincident neighbour from dividing by zero
+
+def estimate(known_lats, known_lons, known_values, lats, lons, method=METHOD, k=NEIGHBORS, max_distance_m=MAX_DISTANCE_M):
+	'''Weighted estimate at (lats, lons) from the k nearest known points within max_distance_m (NaN if none).'''
+	known_values = np.asarray(known_values, dtype=float)
+	if len(known_values) == 0 or len(lats) == 0:
+		return np.full(len(lats), np.nan)
+	k = min(k, len(known_values))
+	distances, index = cKDTree(to_xy(known_lats, known_lons)).query(to_xy(lats, lons), k=k, distance_upper_bound=max_distance_m)
+	distances = np.asarray(distances, dtype=float).reshape(len(lats), k)
+	index = np.asarray(index).reshape(len(lats), k)
+	found = np.isfinite(distances)
+	index[~found] = 0 # any valid point; its weight is zeroed below
+	if method == 'idw':
+		weights = np.maximum(distances, MIN_DISTANCE_M)**-POWER
+	elif method == 'gaussian':
+		weights = np.exp(-0.5*(distances/BANDWIDTH_M)**2)
+	else:
+		raise ValueError(f"Unknown interpolation method '{method}' (expected 'idw' or 'gaussian').")
+	weights[~found] = 0
+	total = weights.sum(axis=1)
+	with np.errstate(invalid='ignore', divide='ignore'):
+		return (weights * known_values[index]).sum(axis=1) / total
+
+def fill_missing(lats, lons, values, method=METHOD, **kwargs):
+	'''Fills every non-finite value from the finite ones. Returns (filled values, bool mask of what was estimated).'''
+	lats = np.asarray(lats, dtype=float)
+	lons = np.asarray(lons, dtype=float)
+	filled = np.array(values, dtype=float)
+	missing = ~np.isfinite(filled)
+	if missing.any():
+		filled[missing] = estimate(lats[~missing], lons[~missing], filled[~missing], lats[missing], lons[missing], method=method, **kwargs)
+	return filled, missing & np.isfinite(filled)
@@ -0,0 +1,117 @@
+## Append-only run journal
+## One JSON record per line. Every append is flushed to the OS, so it survives the process dying
+## (REQUEST_DENIED, Ctrl-C, a kill); fsync is batched every FSYNC_EVERY records or FSYNC_SECONDS, so
+## power loss costs at most the last batch. A line torn by a crash is skipped on replay. The writer holds
+## an exclusive lock on its journal, so another process can tell a live run's journal from an abandoned one.
+## Locking is flock on POSIX and msvcrt.locking on Windows.
+import json
+import os
+import threading
+import time
+from pathlib import Path
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+	import msvcrt
+
+FSYNC_EVERY = 64
+FSYNC_SECONDS = 2.0
+
+def _try_lock(fd):
+	'''Non-blocking exclusive lock on an open fd - False if another process holds it.'''
+	try:
+		if fcntl:
+			fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+		else:
+			os.lseek(fd, 0, os.SEEK_SET) ## msvcrt locks bytes from the current position
+			msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+		return True
+	except (BlockingIOError, PermissionError):
+		return False
+	except OSError:
+		if fcntl:
+			raise
+		return False ## msvcrt reports a held lock as a plain OSError (EDEADLOCK)
+
+def _unlock(fd):
+	if fcntl:
+		fcntl.flock(fd, fcntl.LOCK_UN)
+	else:
+		os.lseek(fd, 0, os.SEEK_SET)
+		msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+class Journal:
+	'''Thread-safe appender - append() from any worker, close() (or sync()) when a batch is done.'''
+	def __init__(self, path, fsync_every=FSYNC_EVERY, fsync_seconds=FSYNC_SECONDS):
+		self.path = Path(path)
+		self.path.parent.mkdir(parents=True, exist_ok=True)
+		self.file = open(self.path, 'a', encoding='utf-8')
+		if not _try_lock(self.file.fileno()):
+			self.file.close()
+			raise BlockingIOError(f"journal {self.path} is held by another process")
+		self.fsync_every = fsync_every
+		self.fsync_seconds = fsync_seconds
+		self.lock = threading.Lock()
+		self.pending = 0
+		self.synced = time.monotonic()
+
+	def append(self, *records):
+		lines = ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records)
+		with self.lock:
+			self.file.write(lines)
+			self.file.flush()
+			self.pending += len(records)
+			if self.pending >= self.fsync_every or time.monotonic() - self.synced >= self.fsync_seconds:
+				self._sync()
+
+	def _sync(self):
+		os.fsync(self.file.fileno())
+		self.pending = 0
+		self.synced = time.monotonic()
+
+	def sync(self):
+		with self.lock:
+			if self.pending and not self.file.closed:
+				self._sync()
+
+	def close(self):
+		with self.lock:
+			if self.file.closed:
+				return
+			if self.pending:
+				self._sync()
+			self.file.close()
+
+def replay(path):
+	'''Every intact record in the journal, in order ([] if there's no journal).'''
+	records = []
+	try:
+		with open(path, 'r', encoding='utf-8') as f:
+			for line in f:
+				try:
+					records.append(json.loads(line))
+				except json.JSONDecodeError:
+					continue ## torn write from a crash
+	except FileNotFoundError:
+		pass
+	return records
+
+def is_abandoned(path):
+	'''True if no live process holds the journal (its writer exited or died). False if it's gone -
+	never creates it, so a journal discarded between listing and probing stays discarded.'''
+	try:
+		fd = os.open(path, os.O_RDWR)
+	except FileNotFoundError:
+		return False
+	try:
+		if not _try_lock(fd):
+			return False
+		_unlock(fd)
+		return True
+	finally:
+		os.close(fd)
+
+def discard(path):
+	'''Drops a journal once its records are safely folded in elsewhere.'''
+	Path(path).unlink(missing_ok=True)
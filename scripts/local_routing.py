@@ -0,0 +1,215 @@
+## Local (offline) routing engine
+## Builds a stop graph from a GTFS feed (or a generic road edge list) and answers
+## origin -> destination travel times without any network calls.
+import hashlib
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
+
+CACHE_PATH = Path(__file__).resolve().parent.parent / "data" / "cache"
+METERS_PER_DEG_LAT = 110540
+METERS_PER_DEG_LON = 111320
+REF_LAT = 40.7 ## projection reference latitude (NYC)
+CHUNK_SIZE = 5000 ## origins per vectorized block, keeps the N x k x k arrays small
+MIN_EDGE_MINUTES = 0.01 ## sparse graphs drop zero weights, so same-time stops get a tiny weight instead
+VERBOSE = True
+
+def to_xy(lats, lons, ref_lat=REF_LAT):
+	'''Local equirectangular projection, in meters - plenty accurate inside one metro.'''
+	lats = np.asarray(lats, dtype=float)
+	lons = np.asarray(lons, dtype=float)
+	return np.column_stack([lons*METERS_PER_DEG_LON*np.cos(np.radians(ref_lat)), lats*METERS_PER_DEG_LAT])
+
+def walk_minutes(meters, settings):
+	return meters * settings["walk_circuity"] / (settings["walk_speed_kmh"]*1000/60)
+
+def parse_gtfs_time(series):
+	'''GTFS times are "HH:MM:SS" and can run past 24:00 - returns seconds.'''
+	parts = series.str.split(':', expand=True).astype(float)
+	return parts[0]*3600 + parts[1]*60 + parts[2]
+
+def file_signature(paths, params=None):
+	'''Cheap fingerprint (name, size, mtime, plus any params) used to invalidate derived artifacts.'''
+	digest = hashlib.sha1()
+	for path in paths:
+		path = Path(path)
+		if path.exists():
+			stat = path.stat()
+			digest.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+	if params:
+		digest.update(repr(sorted(params.items())).encode())
+	return digest.hexdigest()[:16]
+
+def load_gtfs_graph(gtfs_path, settings):
+	'''Returns (nodes, edges) for a GTFS feed.
+	Ride edges use the median scheduled time between consecutive stops of a trip; walking transfers
+	(transfers.txt, plus any stops within transfer_walk_m) carry the boarding penalty, since you board again.'''
+	gtfs_path = Path(gtfs_path)
+	stops = pd.read_csv(gtfs_path / "stops.txt", dtype={'stop_id': str})
+	stop_times = pd.read_csv(gtfs_path / "stop_times.txt", dtype={'trip_id': str, 'stop_id': str},
+		usecols=['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence'])
+	stop_times = stop_times.sort_values(['trip_id', 'stop_sequence'])
+	arrivals = parse_gtfs_time(stop_times['arrival_time']).values
+	departures = parse_gtfs_time(stop_times['departure_time']).values
+	trip_ids = stop_times['trip_id'].values
+	stop_ids = stop_times['stop_id'].values
+	same_trip = trip_ids[1:] == trip_ids[:-1]
+	ride_edges = pd.DataFrame({
+		'from': stop_ids[:-1][same_trip],
+		'to': stop_ids[1:][same_trip],
+		'minutes': (arrivals[1:] - departures[:-1])[same_trip] / 60,
+	}).groupby(['from', 'to'], as_index=False)['minutes'].median()
+
+	## only stops that trips actually serve (drops parent stations & entrances)
+	served = set(ride_edges['from']) | set(ride_edges['to'])
+	nodes = stops[stops['stop_id'].isin(served)].rename(columns={'stop_id': 'node_id', 'stop_lat': 'lat', 'stop_lon': 'lon'})
+	nodes = nodes[['node_id', 'lat', 'lon']].reset_index(drop=True)
+
+	transfer_edges = [walking_edges(nodes, settings)]
+	if (gtfs_path / "transfers.txt").exists():
+		transfers = pd.read_csv(gtfs_path / "transfers.txt", dtype={'from_stop_id': str, 'to_stop_id': str})
+		transfers = transfers[transfers['from_stop_id'].isin(served) & transfers['to_stop_id'].isin(served)]
+		transfer_edges.append(pd.DataFrame({
+			'from': transfers['from_stop_id'],
+			'to': transfers['to_stop_id'],
+			'minutes': transfers.get('min_transfer_time', pd.Series(0, index=transfers.index)).fillna(0)/60 + settings["boarding_penalty_min"],
+		}))
+	edges = pd.concat([ride_edges] + transfer_edges, ignore_index=True)
+	edges = edges[edges['from'] != edges['to']]
+	return nodes, edges
+
+def hourly_waits(gtfs_path, settings):
+	'''Expected boarding wait (half the headway) for each hour of the day, as a 24-array of minutes.
+	Median over served stops; hours without service get max_wait_min. Cached per feed signature.'''
+	gtfs_path = Path(gtfs_path)
+	cache_file = CACHE_PATH / f"waits-{file_signature([gtfs_path / 'stop_times.txt'], params={'max_wait_min': settings['max_wait_min']})}.npy"
+	if cache_file.exists():
+		return np.load(cache_file)
+	stop_times = pd.read_csv(gtfs_path / "stop_times.txt", dtype={'trip_id': str, 'stop_id': str}, usecols=['trip_id', 'departure_time', 'stop_id'])
+	hours = (parse_gtfs_time(stop_times['departure_time']) // 3600 % 24).astype(int)
+	per_stop = stop_times.assign(hour=hours.values).groupby(['stop_id', 'hour'])['trip_id'].nunique()
+	waits = (30 / per_stop).groupby(level='hour').median().reindex(range(24))
+	waits = np.minimum(waits.fillna(settings["max_wait_min"]).values, settings["max_wait_min"])
+	CACHE_PATH.mkdir(parents=True, exist_ok=True)
+	np.save(cache_file, waits)
+	return waits
+
+def walking_edges(nodes, settings):
+	'''Both-direction walking edges between nodes within transfer_walk_m.'''
+	xy = to_xy(nodes['lat'], nodes['lon'])
+	pairs = cKDTree(xy).query_pairs(settings["transfer_walk_m"], output_type='ndarray')
+	if len(pairs) == 0:
+		return pd.DataFrame(columns=['from', 'to', 'minutes'])
+	meters = np.linalg.norm(xy[pairs[:, 0]] - xy[pairs[:, 1]], axis=1)
+	minutes = walk_minutes(meters, settings) + settings["boarding_penalty_min"]
+	ids = nodes['node_id'].values
+	return pd.DataFrame({
+		'from': np.concatenate([ids[pairs[:, 0]], ids[pairs[:, 1]]]),
+		'to': np.concatenate([ids[pairs[:, 1]], ids[pairs[:, 0]]]),
+		'minutes': np.concatenate([minutes, minutes]),
+	})
+
+def load_edge_list_graph(nodes_file, edges_file):
+	'''Generic (ie - road) graph: nodes.csv with node_id, lat, lon; edges.csv with from, to, minutes.'''
+	nodes = pd.read_csv(nodes_file, dtype={'node_id': str})[['node_id', 'lat', 'lon']]
+	edges = pd.read_csv(edges_file, dtype={'from': str, 'to': str})[['from', 'to', 'minutes']]
+	return nodes, edges
+
+class RoutingGraph:
+	'''Directed graph over stops/nodes, with walking access at both ends of a trip.'''
+	def __init__(self, nodes, edges, settings, access_penalty=0):
+		self.settings = settings
+		self.access_penalty = access_penalty
+		self.node_ids = nodes['node_id'].values
+		self.xy = to_xy(nodes['lat'], nodes['lon'])
+		self.tree = cKDTree(self.xy)
+		## parallel edges keep the fastest one (csr_matrix would otherwise sum them)
+		edges = edges.groupby(['from', 'to'], as_index=False)['minutes'].min()
+		position = pd.Series(np.arange(len(nodes)), index=self.node_ids)
+		u = position.reindex(edges['from']).values
+		v = position.reindex(edges['to']).values
+		keep = ~(np.isnan(u) | np.isnan(v))
+		minutes = np.maximum(edges['minutes'].values[keep], MIN_EDGE_MINUTES)
+		self.graph = csr_matrix((minutes, (u[keep].astype(int), v[keep].astype(int))), shape=(len(nodes), len(nodes)))
+		self._all_pairs = None
+
+	def all_pairs(self, cache_key=None):
+		'''Precomputed node x node travel times - cached on disk per graph signature.'''
+		if self._all_pairs is None:
+			cache_file = CACHE_PATH / f"apsp-{cache_key}.npy" if cache_key else None
+			if cache_file is not None and cache_file.exists():
+				self._all_pairs = np.load(cache_file)
+			else:
+				if VERBOSE: print(f"Precomputing all-pairs travel times over {len(self.node_ids)} nodes...")
+				self._all_pairs = dijkstra(self.graph, directed=True).astype(np.float32)
+				if cache_file is not None:
+					CACHE_PATH.mkdir(parents=True, exist_ok=True)
+					np.save(cache_file, self._all_pairs)
+		return self._all_pairs
+
+	def access(self, lats, lons):
+		'''Nearest access_nodes for each point -> (node index N x k, walk minutes N x k); inf past max_access_walk_m.'''
+		k = min(self.settings["access_nodes"], len(self.node_ids))
+		meters, index = self.tree.query(to_xy(lats, lons), k=k, distance_upper_bound=self.settings["max_access_walk_m"])
+		meters = np.asarray(meters).reshape(len(meters), k)
+		index = np.asarray(index).reshape(len(index), k)
+		missing = ~np.isfinite(meters)
+		index[missing] = 0 # any valid node; its walk time is inf
+		return index, walk_minutes(meters, self.settings)
+
+	def route_times(self, lats, lons, dest_lat, dest_lon, cache_key=None, access_penalty=None):
+		'''Door-to-door minutes from every origin to one destination (vectorized). Walking the whole way always counts.
+		access_penalty overrides the first-boarding wait (ie - by time of day).'''
+		access_penalty = self.access_penalty if access_penalty is None else access_penalty
+		lats = np.asarray(lats, dtype=float)
+		lons = np.asarray(lons, dtype=float)
+		egress_index, egress_minutes = self.access([dest_lat], [dest_lon])
+		egress_index, egress_minutes = egress_index[0], egress_minutes[0]
+		all_pairs = self.all_pairs(cache_key) if cache_key is not None else None
+		dest_xy = to_xy([dest_lat], [dest_lon])[0]
+		output = np.empty(len(lats))
+		for start in range(0, len(lats), CHUNK_SIZE):
+			chunk = slice(start, start+CHUNK_SIZE)
+			access_index, access_minutes = self.access(lats[chunk], lons[chunk])
+			if all_pairs is not None:
+				between = all_pairs[access_index[:, :, None], egress_index[None, None, :]]
+			else:
+				sources, inverse = np.unique(access_index, return_inverse=True)
+				from_sources = dijkstra(self.graph, directed=True, indices=sources)[:, egress_index]
+				between = from_sources[inverse.reshape(access_index.shape)]
+			total = access_minutes[:, :, None] + access_penalty + between + egress_minutes[None, None, :]
+			best = total.reshape(len(total), -1).min(axis=1)
+			direct = walk_minutes(np.linalg.norm(to_xy(lats[chunk], lons[chunk]) - dest_xy, axis=1), self.settings)
+			output[chunk] = np.minimum(best, direct)
+		output[~np.isfinite(output)] = np.nan
+		return output
+
+	def times_to(self, dest_lat, dest_lon):
+		'''One reverse Dijkstra from the destination -> minutes from every node to it, egress walk included.
+		The egress stops hang off a virtual node, so a single search covers all of them.'''
+		n = len(self.node_ids)
+		egress_index, egress_minutes = self.access([dest_lat], [dest_lon])
+		reachable = np.isfinite(egress_minutes[0])
+		reverse = self.graph.T.tocoo()
+		rows = np.concatenate([reverse.row, np.full(reachable.sum(), n)])
+		cols = np.concatenate([reverse.col, egress_index[0][reachable]])
+		data = np.concatenate([reverse.data, np.maximum(egress_minutes[0][reachable], MIN_EDGE_MINUTES)])
+		augmented = csr_matrix((data, (rows, cols)), shape=(n+1, n+1))
+		return dijkstra(augmented, directed=True, indices=n)[:n]
+
+	def isochrone_times(self, lats, lons, dest_lat, dest_lon, node_times=None, access_penalty=None):
+		'''Door-to-door minutes via one destination-side search: every origin (ZCTA centroid or grid cell)
+		just looks up its nearest access nodes, so more origins cost a KD-tree query, not more searches.
+		The first-boarding wait is added after the search, so other departure hours reuse node_times.'''
+		access_penalty = self.access_penalty if access_penalty is None else access_penalty
+		if node_times is None:
+			node_times = self.times_to(dest_lat, dest_lon)
+		access_index, access_minutes = self.access(lats, lons)
+		best = (access_minutes + access_penalty + node_times[access_index]).min(axis=1)
+		direct = walk_minutes(np.linalg.norm(to_xy(lats, lons) - to_xy([dest_lat], [dest_lon])[0], axis=1), self.settings)
+		output = np.minimum(best, direct)
+		output[~np.isfinite(output)] = np.nan
+		return output
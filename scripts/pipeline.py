@@ -0,0 +1,160 @@
+## Stage-level incremental pipeline
+## Each stage is keyed on a hash of its input files, its params, and its upstream stage keys.
+## Keys are known before anything runs, so a dry-run can report exactly what would recompute,
+## and a stage whose key hasn't changed is loaded from its cache file instead of rerun.
+## A content_key stage is the exception: downstream stages hash its output, not its key, so it's loaded
+## (computed if needed) as soon as something downstream is declared - keep those stages cheap.
+import hashlib
+import json
+import os
+from pathlib import Path
+import pandas as pd
+import storage
+import telemetry
+
+STAGE_CACHE_PATH = Path(__file__).resolve().parent.parent / "data" / "cache" / "stages"
+MANIFEST_FILE = "file_hashes.json" ## content hashes, memoized on (size, mtime) so big files aren't rehashed every run
+HASH_CHUNK = 1 << 20
+VERBOSE = True
+
+def _load_manifest(cache_path):
+	try:
+		with open(Path(cache_path) / MANIFEST_FILE, 'r') as f:
+			return json.load(f)
+	except (FileNotFoundError, json.JSONDecodeError):
+		return {}
+
+def _save_manifest(cache_path, manifest):
+	Path(cache_path).mkdir(parents=True, exist_ok=True)
+	tmp_file = Path(cache_path) / (MANIFEST_FILE + ".tmp")
+	with open(tmp_file, 'w') as f:
+		json.dump(manifest, f, indent=1)
+	os.replace(tmp_file, Path(cache_path) / MANIFEST_FILE)
+
+def hash_file(path, manifest):
+	'''sha1 of the file contents; reused from the manifest while size & mtime are unchanged.'''
+	path = Path(path)
+	if not path.exists():
+		return "missing"
+	stat = path.stat()
+	memo = manifest.get(str(path))
+	if memo and memo['size'] == stat.st_size and memo['mtime_ns'] == stat.st_mtime_ns:
+		return memo['sha1']
+	digest = hashlib.sha1()
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+			digest.update(chunk)
+	manifest[str(path)] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': digest.hexdigest()}
+	return digest.hexdigest()
+
+class Transient:
+	'''Wraps a stage output that must not be cached (ie - a budget-limited fetch): it's used for this run only,
+	the stage recomputes next time, and so does everything downstream of it.'''
+	def __init__(self, output):
+		self.output = output
+
+class Stage:
+	'''One cached step. fn gets the loaded outputs of its upstream stages, in order.
+	kind='frame' stages return a (Geo)DataFrame that's stored as Parquet; kind='file' stages get
+	the output path as their first argument and write it themselves (ie - a PNG).
+	content_key=True (frame stages): downstream keys hash this stage's output instead of its key, so an
+	input change that leaves the output identical doesn't invalidate anything downstream.'''
+	def __init__(self, pipeline, name, fn, upstream=(), files=(), params=None, kind='frame', suffix='.parquet', content_key=False):
+		self.pipeline = pipeline
+		self.name = name
+		self.fn = fn
+		self.upstream = list(upstream)
+		self.kind = kind
+		self.content_key = content_key
+		digest = hashlib.sha1(name.encode())
+		for path in files:
+			digest.update(f"{Path(path).name}:{hash_file(path, pipeline.manifest)};".encode())
+		digest.update(json.dumps(params or {}, sort_keys=True, default=str).encode())
+		for stage in self.upstream:
+			digest.update(stage.output_key().encode())
+		self.key = digest.hexdigest()[:16]
+		self.path = Path(pipeline.cache_path) / f"{name}-{self.key}{suffix}"
+		self._output = None
+		self._content_digest = None
+		self.transient = False
+
+	def output_key(self):
+		'''What downstream keys hash - this stage's key, or (content_key) a hash of its output.'''
+		if not self.content_key:
+			return self.key
+		if self._content_digest is None:
+			output = self.load()
+			digest = hashlib.sha1(repr(list(output.columns)).encode())
+			digest.update(pd.util.hash_pandas_object(output, index=False).values.tobytes())
+			self._content_digest = digest.hexdigest()[:16]
+		return self._content_digest
+
+	def is_cached(self):
+		return self.path.exists()
+
+	def load(self):
+		if self._output is not None:
+			return self._output
+		if self.is_cached():
+			if VERBOSE: print(f"[{self.name}] cached ({self.key})")
+			telemetry.count('stage_loads', stage=self.name, result='cached')
+			self._output = storage.read_frame(self.path) if self.kind == 'frame' else self.path
+			return self._output
+		if VERBOSE: print(f"[{self.name}] computing ({self.key})...")
+		inputs = [stage.load() for stage in self.upstream]
+		self.transient = any(stage.transient for stage in self.upstream)
+		telemetry.count('stage_loads', stage=self.name, result='computed')
+		## upstream loads stay outside the timer, so each stage only reports its own cost
+		with telemetry.stage_timer(self.name):
+			if self.kind == 'frame':
+				output = self.fn(*inputs)
+				if isinstance(output, Transient):
+					output, self.transient = output.output, True
+				self._output = output
+				if not self.transient:
+					storage.write_frame(self._output, self.path)
+			else:
+				## a transient file goes next to the cache, never under its key
+				outfile = self.path.with_name(f"{self.name}-partial{self.path.suffix}") if self.transient else self.path
+				outfile.parent.mkdir(parents=True, exist_ok=True)
+				self.fn(outfile, *inputs)
+				self._output = outfile
+		if self.transient and VERBOSE: print(f"[{self.name}] not cached - incomplete inputs, recomputed next run")
+		return self._output
+
+class Pipeline:
+	def __init__(self, cache_path=STAGE_CACHE_PATH):
+		self.cache_path = Path(cache_path)
+		self.manifest = _load_manifest(self.cache_path)
+		self.stages = []
+
+	def stage(self, name, fn, upstream=(), files=(), params=None, kind='frame', suffix='.parquet', content_key=False):
+		stage = Stage(self, name, fn, upstream=upstream, files=files, params=params, kind=kind, suffix=suffix, content_key=content_key)
+		self.stages.append(stage)
+		_save_manifest(self.cache_path, self.manifest)
+		return stage
+
+	def plan(self, target):
+		'''Stages that running `target` would recompute - cached stages stop the walk, since their upstream is never loaded.'''
+		to_run = []
+		def visit(stage):
+			if stage.is_cached() or stage in to_run:
+				return
+			for upstream in stage.upstream:
+				visit(upstream)
+			to_run.append(stage)
+		visit(target)
+		return to_run
+
+	def dry_run(self, target):
+		to_run = self.plan(target)
+		print("Dry run - stage plan:")
+		for stage in self.stages:
+			if stage in to_run:
+				status = "RECOMPUTE"
+			elif stage.is_cached():
+				status = "cached"
+			else:
+				status = "not needed"
+			print(f"\t{stage.name:<12} {stage.key}  {status}")
+		return to_run
@@ -0,0 +1,104 @@
+## Quota-aware call planner
+## Works out the smallest set of billed calls before anything is fetched: rows collapse to unique
+## origins, origins that can't produce a score (no rent) are pruned, cached (origin, trip) pairs are
+## free. If what's left is over budget, origins are picked by farthest-point sampling (good spatial
+## coverage for interpolation) and the rest are filled from their fetched neighbours.
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+import commute_cache
+import interpolate
+from local_routing import to_xy
+from constants import BAD_VAL, COMMUTE_KEY
+
+class Plan:
+	'''What to fetch, what's already free, and what gets interpolated - plus the call counts for the prompt.'''
+	def __init__(self, naive_calls, origins, fetch, cached_pairs, uncached_pairs, pruned_rows):
+		self.naive_calls = naive_calls
+		self.origins = origins ## unique (lat, lon) frame, after pruning
+		self.fetch = fetch ## bool per origin: fetch (or read from cache) vs. interpolate
+		self.cached_pairs = cached_pairs
+		self.planned_calls = int(uncached_pairs[fetch].sum())
+		self.skipped_calls = int(uncached_pairs[~fetch].sum())
+		self.pruned_rows = pruned_rows
+
+	@property
+	def fetch_origins(self):
+		return self.origins[self.fetch].reset_index(drop=True)
+
+	@property
+	def skipped_origins(self):
+		return self.origins[~self.fetch].reset_index(drop=True)
+
+	def describe(self):
+		return (f"Planned API calls: {self.planned_calls} (naive: {self.naive_calls})\n"
+			f"\t{len(self.origins)} unique origins to score" + (f" ({self.pruned_rows} rows pruned - no rent)\n" if self.pruned_rows else "\n") +
+			f"\t{self.cached_pairs} origin/trip pairs already cached\n"
+			f"\t{len(self.skipped_origins)} origins ({self.skipped_calls} calls) over budget - interpolated from neighbours\n")
+
+def farthest_points(lats, lons, seeds):
+	'''Yields non-seed points in greedy farthest-point order: each one is the point farthest from everything
+	known so far (the seeds plus earlier picks). Lazy, so callers stop as soon as the budget runs out.'''
+	xy = to_xy(lats, lons)
+	if seeds.any():
+		distance = cKDTree(xy[seeds]).query(xy)[0]
+	else:
+		distance = np.full(len(xy), np.inf)
+	distance[seeds] = -1
+	for _ in range(len(xy) - int(seeds.sum())):
+		pick = int(np.argmax(distance))
+		yield pick
+		distance = np.minimum(distance, np.linalg.norm(xy - xy[pick], axis=1))
+		distance[pick] = -1
+
+def usable_rows(dataframe, rent_col=None, lat_col='lat', lon_col='lon'):
+	'''Rows that can produce a score - located, and with rent_col (if given).'''
+	usable = dataframe[[lat_col, lon_col]].notna().all(axis=1)
+	if rent_col is not None and rent_col in dataframe.columns:
+		usable &= dataframe[rent_col].notna()
+	return usable
+
+def scored_origins(dataframe, rent_col=None, lat_col='lat', lon_col='lon'):
+	'''Unique (lat, lon) of the usable rows, sorted - the same rows give the same frame, whatever else changed.'''
+	usable = usable_rows(dataframe, rent_col, lat_col, lon_col)
+	return dataframe.loc[usable, [lat_col, lon_col]].drop_duplicates().sort_values([lat_col, lon_col]).reset_index(drop=True)
+
+def plan_calls(dataframe, trips, cache_mode, budget, rent_col=None, sample_fraction=None, lat_col='lat', lon_col='lon'):
+	'''trips: [(destination, slot), ...]. budget: billed calls we may still make (see retry_logic.remaining_budget).
+	sample_fraction (ie - 0.25) caps the calls at that share of what's uncached, even under budget - the rest is interpolated.'''
+	naive_calls = len(dataframe) * len(trips)
+	usable = usable_rows(dataframe, rent_col, lat_col, lon_col)
+	origins = dataframe.loc[usable, [lat_col, lon_col]].drop_duplicates().reset_index(drop=True)
+	uncached = np.zeros(len(origins), dtype=int)
+	for i, (lat, lon) in enumerate(origins.itertuples(index=False, name=None)):
+		for dest, slot in trips:
+			cache_hit, _ = commute_cache.get_cached_time(commute_cache.make_key(lat, lon, dest, slot, cache_mode))
+			uncached[i] += not cache_hit
+	cached_pairs = len(origins)*len(trips) - int(uncached.sum())
+	if sample_fraction is not None:
+		budget = min(budget, int(np.ceil(uncached.sum()*sample_fraction)))
+	fetch = np.ones(len(origins), dtype=bool)
+	if uncached.sum() > budget:
+		## fully cached origins are free & already known - spend the budget on whatever covers the map best
+		known = uncached == 0
+		fetch = known.copy()
+		spent = 0
+		cheapest = uncached[~known].min()
+		for pick in farthest_points(origins[lat_col].values, origins[lon_col].values, known):
+			if budget - spent < cheapest:
+				break
+			if spent + uncached[pick] <= budget:
+				fetch[pick] = True
+				spent += uncached[pick]
+	return Plan(naive_calls, origins, fetch, cached_pairs, uncached, pruned_rows=int((~usable).sum()))
+
+def fill_skipped(commute_df, skipped_origins, trips, method=interpolate.METHOD, lat_col='lat', lon_col='lon'):
+	'''Interpolated estimates (flagged estimated=True) for the skipped origins, per trip, from the fetched rows (BAD_VAL/NaN never count as neighbours).'''
+	frames = []
+	for dest, slot in trips:
+		known = commute_df[(commute_df['destination'] == dest) & (commute_df['departure'] == slot)]
+		known = known[known[COMMUTE_KEY].notna() & (known[COMMUTE_KEY] != BAD_VAL)]
+		estimate = interpolate.estimate(known[lat_col].values, known[lon_col].values, known[COMMUTE_KEY].values,
+			skipped_origins[lat_col].values, skipped_origins[lon_col].values, method=method)
+		frames.append(skipped_origins.assign(destination=dest, departure=slot, estimated=True, **{COMMUTE_KEY: np.round(estimate, 2)}))
+	return pd.concat(frames, ignore_index=True)
@@ -1,35 +1,102 @@
+## Filter the national ZCTA shapefile down to one metro
+## Streams features with fiona: the ZIP filter (OGR "where") and optional bbox are pushed down to
+## the reader, and matches are written out one at a time - peak memory tracks the output, not the
+## ~33k-polygon national file.
+import argparse
+import sys
+from pathlib import Path
+import fiona
 import geopandas as gpd
+import pandas as pd
 
-# Step 1: Load national ZCTA shapefile
-zcta_gdf = gpd.read_file("tl_2020_us_zcta510/tl_2020_us_zcta510.shp")
-
-# Step 2: Define NYC ZIP code list
-nyc_zips = [
-    '10001', '10002', '10003', '10004', '10005', '10006', '10007', '10009', '10010',
-    '10011', '10012', '10013', '10014', '10016', '10017', '10018', '10019', '10020',
-    '10021', '10022', '10023', '10024', '10025', '10026', '10027', '10028', '10029',
-    '10030', '10031', '10032', '10033', '10034', '10035', '10036', '10037', '10038',
-    '10039', '10040', '10044', '10065', '10069', '10075', '10128', '10280', '10282',
-    '10301', '10302', '10303', '10304', '10305', '10306', '10307', '10308', '10309',
-    '10310', '10312', '10314', '10451', '10452', '10453', '10454', '10455', '10456',
-    '10457', '10458', '10459', '10460', '10461', '10462', '10463', '10464', '10465',
-    '10466', '10467', '10468', '10469', '10470', '10471', '10472', '10473', '10550',
-    '11101', '11102', '11103', '11104', '11105', '11106', '11201', '11203', '11204',
-    '11205', '11206', '11207', '11208', '11209', '11210', '11211', '11212', '11213',
-    '11214', '11215', '11216', '11217', '11218', '11219', '11220', '11221', '11222',
-    '11223', '11224', '11225', '11226', '11228', '11229', '11230', '11231', '11232',
-    '11233', '11234', '11235', '11236', '11237', '11238', '11239', '11354', '11355',
-    '11356', '11357', '11358', '11360', '11361', '11362', '11363', '11364', '11365',
-    '11366', '11367', '11368', '11369', '11370', '11372', '11373', '11374', '11375',
-    '11377', '11378', '11379', '11385', '11411', '11412', '11413', '11414', '11415',
-    '11416', '11417', '11418', '11419', '11420', '11421', '11422', '11423', '11426',
-    '11427', '11428', '11429', '11430', '11432', '11433', '11434', '11435', '11436',
-    '11691', '11692', '11693', '11694', '11697'
-]
-
-# Step 3: Filter to NYC ZIPs
-nyc_zcta = zcta_gdf[zcta_gdf['ZCTA5CE10'].isin(nyc_zips)].copy()
-
-# Step 4: Save filtered ZIP shapes (Shapefile or GeoJSON)
-nyc_zcta.to_file("nyc_zcta_2020.shp")           # Save as Shapefile
-# nyc_zcta.to_file("nyc_zcta_2020.geojson", driver="GeoJSON")  # OR save as GeoJSON
+PARENT_PATH = Path(__file__).resolve().parent.parent.parent
+sys.path.append(str(PARENT_PATH / "scripts"))
+from constants import NYC_ZIPS
+
+NATIONAL_ZCTA = PARENT_PATH / "data" / "raw" / "tl_2020_us_zcta510.zip"
+OUTPUT_FILE = PARENT_PATH / "data" / "processed" / "nyc_zcta_2020.shp"
+ZIP_FIELD = 'ZCTA5CE10'
+
+def source_uri(source):
+    '''fiona reads zipped shapefiles directly - no need to unzip the national file.'''
+    source = str(source)
+    return f"zip://{source}" if source.endswith('.zip') else source
+
+def zips_for_counties(county_geoids, relationship_file):
+    '''ZCTAs overlapping the given 5-digit county GEOIDs (ie - 36061 for New York County),
+    from the Census ZCTA-to-county relationship file (zcta_county_rel_10.txt).'''
+    rel = pd.read_csv(relationship_file, dtype=str, usecols=['ZCTA5', 'GEOID'])
+    return sorted(set(rel.loc[rel['GEOID'].isin(county_geoids), 'ZCTA5']))
+
+def where_clause(zips, zip_field=ZIP_FIELD):
+    quoted = ",".join(f"'{str(zip_code).zfill(5)}'" for zip_code in zips)
+    return f"{zip_field} IN ({quoted})"
+
+def iter_filtered(src, zips=None, bbox=None, zip_field=ZIP_FIELD):
+    '''Yields matching features from an open fiona collection.
+    bbox is (minx, miny, maxx, maxy) in the source CRS and goes to OGR's spatial filter.'''
+    if zips is not None and len(zips) == 0:
+        return
+    kwargs = {}
+    if bbox is not None:
+        kwargs['bbox'] = tuple(bbox)
+    if zips is not None:
+        kwargs['where'] = where_clause(zips, zip_field)
+    wanted = None if zips is None else set(str(zip_code).zfill(5) for zip_code in zips)
+    for feature in src.filter(**kwargs):
+        ## cheap double-check, in case a driver ignores the where clause
+        if wanted is None or feature['properties'][zip_field] in wanted:
+            yield feature
+
+def filter_zctas(source=NATIONAL_ZCTA, zips=None, bbox=None, zip_field=ZIP_FIELD):
+    '''Filtered extract as a GeoDataFrame - only matching features are materialized.'''
+    with fiona.open(source_uri(source)) as src:
+        crs = src.crs
+        features = list(iter_filtered(src, zips=zips, bbox=bbox, zip_field=zip_field))
+    return gpd.GeoDataFrame.from_features(features, crs=crs)
+
+def write_filtered(outpath, source=NATIONAL_ZCTA, zips=None, bbox=None, zip_field=ZIP_FIELD, driver=None):
+    '''Streams matches straight from source to outpath, one feature in memory at a time.'''
+    count = 0
+    with fiona.open(source_uri(source)) as src:
+        meta = src.meta
+        if driver is not None:
+            meta['driver'] = driver
+        Path(outpath).parent.mkdir(parents=True, exist_ok=True)
+        with fiona.open(str(outpath), 'w', **meta) as sink:
+            for feature in iter_filtered(src, zips=zips, bbox=bbox, zip_field=zip_field):
+                sink.write(feature)
+                count += 1
+    print(f"Wrote {count} ZCTAs to {outpath}")
+    return count
+
+def read_zip_list(value):
+    '''Comma-separated ZIPs, or a path to a file with one ZIP per line.'''
+    if Path(value).exists():
+        with open(value, 'r') as f:
+            return [line.strip() for line in f if line.strip()]
+    return [zip_code.strip() for zip_code in value.split(',') if zip_code.strip()]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Filter the national ZCTA file to a metro (defaults to NYC).")
+    parser.add_argument('--source', default=str(NATIONAL_ZCTA), help="national ZCTA .shp or .zip")
+    parser.add_argument('--out', default=str(OUTPUT_FILE))
+    parser.add_argument('--zips', help="comma-separated ZIPs, or a file with one per line")
+    parser.add_argument('--counties', help="comma-separated 5-digit county GEOIDs (needs --relationship-file)")
+    parser.add_argument('--relationship-file', help="Census zcta_county_rel_10.txt")
+    parser.add_argument('--bbox', help="minx,miny,maxx,maxy prefilter, in the source CRS")
+    args = parser.parse_args()
+
+    # Step 1: Decide which ZIPs we want
+    if args.zips:
+        zips = read_zip_list(args.zips)
+    elif args.counties:
+        if not args.relationship_file:
+            parser.error("--counties needs --relationship-file")
+        zips = zips_for_counties(args.counties.split(','), args.relationship_file)
+    else:
+        zips = NYC_ZIPS
+    bbox = [float(value) for value in args.bbox.split(',')] if args.bbox else None
+
+    # Step 2: Stream the national file, keeping only matches
+    write_filtered(args.out, source=args.source, zips=zips, bbox=bbox)
@@ -0,0 +1,212 @@
+## Local scoring query service
+## Loads the merged frame once, precomputes every metric for every bedroom column (scoring.py),
+## and answers ranking/filter queries from sorted column indexes - a range filter is two
+## searchsorted calls, and top-k is an argpartition over the surviving rows. Responses are kept in
+## an LRU cache, so repeated dashboard queries are a dict lookup.
+##   python scripts/query_service.py
+##   curl "http://127.0.0.1:8050/query?br=1&sort=score&limit=20&max_rent=3000&max_commute=40"
+import argparse
+import json
+import sys
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+## scoring reads config/plot_config.py, so make the project root importable (like regions.py)
+PARENT_PATH = Path(__file__).resolve().parent.parent
+sys.path.append(str(PARENT_PATH))
+import storage
+import scoring
+from constants import COMMUTE_KEY, MERGED_FILENAME
+
+MERGED_FILE = PARENT_PATH / "outputs" / MERGED_FILENAME
+PORT = 8050
+CACHE_SIZE = 1024
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 1000
+ID_COLUMNS = ['zcta', 'cell_id', 'lat', 'lon']
+VERBOSE = True
+
+class QueryError(ValueError):
+	pass
+
+class ResponseCache:
+	'''Thread-safe LRU of encoded responses.'''
+	def __init__(self, max_entries=CACHE_SIZE):
+		self.max_entries = max_entries
+		self.entries = OrderedDict()
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key):
+		with self.lock:
+			if key in self.entries:
+				self.entries.move_to_end(key)
+				self.hits += 1
+				return self.entries[key]
+			self.misses += 1
+			return None
+
+	def put(self, key, value):
+		with self.lock:
+			self.entries[key] = value
+			self.entries.move_to_end(key)
+			while len(self.entries) > self.max_entries:
+				self.entries.popitem(last=False)
+
+class ScoreIndex:
+	'''Column arrays + one ascending sort order per numeric column (NaNs sorted to the end and excluded).'''
+	def __init__(self, dataframe):
+		dataframe = dataframe.reset_index(drop=True)
+		## the score stage already writes every {metric}_{n}BR column - only fill in what an older file is missing
+		scores = scoring.score_all(dataframe)
+		dataframe = dataframe.join(scores[scores.columns.difference(dataframe.columns)])
+		self.ids = {col: dataframe[col].to_numpy() for col in ID_COLUMNS if col in dataframe.columns}
+		self.columns = {}
+		self.order = {}
+		self.sorted_values = {}
+		for col in dataframe.columns:
+			if col in self.ids or not np.issubdtype(dataframe[col].dtype, np.number):
+				continue
+			values = dataframe[col].to_numpy(dtype=float)
+			order = np.argsort(values, kind='stable') ## NaN sorts last
+			finite = np.count_nonzero(np.isfinite(values))
+			self.columns[col] = values
+			self.order[col] = order[:finite]
+			self.sorted_values[col] = values[order[:finite]]
+		self.size = len(dataframe)
+
+	def resolve(self, name, br_count):
+		'''Query names -> columns: "rent"/"commute" and bare metric names follow the requested BR count.'''
+		if name == 'rent':
+			name = scoring.rent_key(br_count)
+		elif name == 'commute':
+			name = COMMUTE_KEY
+		elif name in scoring.METRICS:
+			name = scoring.metric_key(name, br_count)
+		if name not in self.columns:
+			raise QueryError(f"Unknown column '{name}' (known: {sorted(self.columns)})")
+		return name
+
+	def range_rows(self, column, low, high):
+		sorted_values = self.sorted_values[column]
+		start = 0 if low is None else np.searchsorted(sorted_values, low, side='left')
+		stop = len(sorted_values) if high is None else np.searchsorted(sorted_values, high, side='right')
+		return self.order[column][start:stop]
+
+	def query(self, sort='score', br=1, order='desc', limit=DEFAULT_LIMIT, ranges=()):
+		'''ranges: [(column, low, high)] with None for an open end. Returns the matching rows, ranked.'''
+		sort_col = self.resolve(sort, br)
+		ranges = [(self.resolve(name, br), low, high) for name, low, high in ranges]
+		## start from the narrowest range (or everything that has a sort value), then check the rest on those rows only
+		candidates = [self.range_rows(col, low, high) for col, low, high in ranges]
+		candidates.append(self.order[sort_col])
+		rows = min(candidates, key=len)
+		for col, low, high in ranges:
+			values = self.columns[col][rows]
+			keep = np.isfinite(values)
+			if low is not None:
+				keep &= values >= low
+			if high is not None:
+				keep &= values <= high
+			rows = rows[keep]
+		sort_values = self.columns[sort_col][rows]
+		rows, sort_values = rows[np.isfinite(sort_values)], sort_values[np.isfinite(sort_values)]
+		keys = -sort_values if order == 'desc' else sort_values
+		matches = len(rows)
+		if limit < len(rows):
+			top = np.argpartition(keys, limit)[:limit]
+			rows, keys = rows[top], keys[top]
+		rows = rows[np.argsort(keys, kind='stable')]
+		return {'count': matches, 'sort': sort_col, 'rows': self.records(rows, sort_col, [col for col, _, _ in ranges])}
+
+	def records(self, rows, sort_col, filter_cols):
+		columns = list(dict.fromkeys([sort_col] + filter_cols))
+		records = []
+		for row in rows:
+			record = {col: values[row].item() if hasattr(values[row], 'item') else values[row] for col, values in self.ids.items()}
+			for col in columns:
+				value = self.columns[col][row]
+				record[col] = None if not np.isfinite(value) else round(float(value), 4)
+			records.append(record)
+		return records
+
+def parse_query(params):
+	'''Query string -> ScoreIndex.query kwargs. min_<name>/max_<name> become range filters.'''
+	single = {key: values[-1] for key, values in params.items()}
+	try:
+		kwargs = {
+			'sort': single.pop('sort', 'score'),
+			'br': int(single.pop('br', 1)),
+			'order': single.pop('order', 'desc'),
+			'limit': min(int(single.pop('limit', DEFAULT_LIMIT)), MAX_LIMIT),
+		}
+		bounds = {}
+		for key, value in single.items():
+			side, _, name = key.partition('_')
+			if side not in ['min', 'max'] or not name:
+				raise QueryError(f"Unknown parameter '{key}'")
+			bounds.setdefault(name, [None, None])[0 if side == 'min' else 1] = float(value)
+	except ValueError as error:
+		raise QueryError(str(error))
+	if kwargs['order'] not in ['asc', 'desc']:
+		raise QueryError("order must be 'asc' or 'desc'")
+	if kwargs['limit'] < 1:
+		raise QueryError("limit must be at least 1")
+	if kwargs['br'] not in scoring.BR_COUNTS:
+		raise QueryError(f"br must be one of {scoring.BR_COUNTS}")
+	kwargs['ranges'] = tuple(sorted((name, low, high) for name, (low, high) in bounds.items()))
+	return kwargs
+
+def make_handler(index, cache):
+	class QueryHandler(BaseHTTPRequestHandler):
+		def send_json(self, status, body):
+			self.send_response(status)
+			self.send_header('Content-Type', 'application/json')
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def do_GET(self):
+			url = urlparse(self.path)
+			if url.path == '/health':
+				return self.send_json(200, json.dumps({'rows': index.size, 'cache_hits': cache.hits, 'cache_misses': cache.misses}).encode())
+			if url.path == '/columns':
+				return self.send_json(200, json.dumps(sorted(index.columns)).encode())
+			if url.path != '/query':
+				return self.send_json(404, b'{"error": "not found"}')
+			try:
+				kwargs = parse_query(parse_qs(url.query))
+				key = tuple(sorted((name, value) for name, value in kwargs.items()))
+				body = cache.get(key)
+				if body is None:
+					body = json.dumps(index.query(**kwargs)).encode()
+					cache.put(key, body)
+			except QueryError as error:
+				return self.send_json(400, json.dumps({'error': str(error)}).encode())
+			self.send_json(200, body)
+
+		def log_message(self, format, *args):
+			if VERBOSE: super().log_message(format, *args)
+	return QueryHandler
+
+def serve(infile=MERGED_FILE, port=PORT):
+	index = ScoreIndex(storage.read_frame(infile, geometry=False))
+	server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(index, ResponseCache()))
+	print(f"Loaded {index.size} rows from {infile} - serving on http://127.0.0.1:{port}/query (Ctrl-C to stop)")
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Serve ranking/filter queries over the merged rent + commute data.")
+	parser.add_argument('--in', dest='infile', default=str(MERGED_FILE), help="merged GeoParquet (MERGED_FILE)")
+	parser.add_argument('--port', type=int, default=PORT)
+	args = parser.parse_args()
+	serve(args.infile, port=args.port)
@@ -0,0 +1,160 @@
+## Quota ledger
+## Billed API calls per (month, key) in SQLite, shared safely by concurrent pipeline processes: every
+## change is one short IMMEDIATE transaction, reads are a primary-key lookup, and a batch can reserve
+## its calls up front so parallel runs never oversubscribe the month. Months roll over on their own.
+## Journaled calls (see retry_logic.checkpoint) are applied with a per-run high-water mark, so replaying
+## a journal twice never counts a call twice.
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+LEDGER_FILE = Path(__file__).resolve().parent.parent / "data" / "cache" / "quota_ledger.sqlite"
+RESERVATION_TTL_HOURS = 12 ## a reservation nobody released (ie - a killed run with no journal left) frees up after this
+BUSY_TIMEOUT_S = 30
+
+SCHEMA = [
+	"CREATE TABLE IF NOT EXISTS usage (month TEXT NOT NULL, key_id TEXT NOT NULL,"
+	" calls INTEGER NOT NULL DEFAULT 0, reserved INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (month, key_id))",
+	"CREATE TABLE IF NOT EXISTS reservations (id INTEGER PRIMARY KEY AUTOINCREMENT, month TEXT NOT NULL, key_id TEXT NOT NULL,"
+	" run_id TEXT NOT NULL, remaining INTEGER NOT NULL, expires_at REAL NOT NULL)",
+	"CREATE INDEX IF NOT EXISTS idx_reservations_run ON reservations (run_id)",
+	"CREATE INDEX IF NOT EXISTS idx_reservations_expiry ON reservations (expires_at)",
+	"CREATE TABLE IF NOT EXISTS applied (run_id TEXT PRIMARY KEY, seq INTEGER NOT NULL)",
+	"CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)",
+]
+
+def month_key(when=None):
+	return (when or datetime.now()).strftime('%Y-%m')
+
+def key_id(api_key):
+	'''Buckets are per key, but the key itself never lands on disk.'''
+	return hashlib.sha256((api_key or '').encode()).hexdigest()[:12] if api_key else 'default'
+
+class QuotaLedger:
+	'''One process's handle on the shared ledger file - thread-safe, and safe across processes.'''
+	def __init__(self, path=LEDGER_FILE, api_key=None):
+		self.path = Path(path)
+		self.path.parent.mkdir(parents=True, exist_ok=True)
+		self.key_id = key_id(api_key)
+		self.lock = threading.Lock()
+		self.conn = sqlite3.connect(str(self.path), timeout=BUSY_TIMEOUT_S, isolation_level=None, check_same_thread=False)
+		self.conn.execute("PRAGMA journal_mode=WAL") ## readers never block the writer
+		with self.transaction() as conn:
+			for statement in SCHEMA:
+				conn.execute(statement)
+
+	@contextmanager
+	def transaction(self):
+		'''BEGIN IMMEDIATE takes the write lock up front, so read-check-write can't interleave between processes.'''
+		with self.lock:
+			self.conn.execute("BEGIN IMMEDIATE")
+			try:
+				yield self.conn
+			except BaseException:
+				self.conn.execute("ROLLBACK")
+				raise
+			self.conn.execute("COMMIT")
+
+	def _row(self, conn, month):
+		conn.execute("INSERT OR IGNORE INTO usage (month, key_id) VALUES (?, ?)", (month, self.key_id))
+		return conn.execute("SELECT calls, reserved FROM usage WHERE month=? AND key_id=?", (month, self.key_id)).fetchone()
+
+	def usage(self, month=None):
+		'''(calls made, calls reserved but not made yet) for the month.'''
+		with self.lock:
+			row = self.conn.execute("SELECT calls, reserved FROM usage WHERE month=? AND key_id=?", (month or month_key(), self.key_id)).fetchone()
+		return tuple(row) if row else (0, 0)
+
+	def used(self, month=None):
+		return self.usage(month)[0]
+
+	def claimed(self, month=None):
+		'''Calls made plus calls reserved - what's no longer available to anyone.'''
+		return sum(self.usage(month))
+
+	def _expire(self, conn):
+		for reservation_id, month, key, remaining in conn.execute(
+				"SELECT id, month, key_id, remaining FROM reservations WHERE expires_at < ?", (time.time(),)).fetchall():
+			conn.execute("UPDATE usage SET reserved = MAX(0, reserved - ?) WHERE month=? AND key_id=?", (remaining, month, key))
+			conn.execute("DELETE FROM reservations WHERE id=?", (reservation_id,))
+
+	def reserve(self, calls, limit, run_id, partial=False, ttl_hours=RESERVATION_TTL_HOURS):
+		'''Claims `calls` of this month's `limit`. Returns (reservation id, calls granted) - (None, 0) if it doesn't fit.
+		partial=True grants whatever is left instead of nothing (a batch can still make progress).'''
+		month = month_key()
+		with self.transaction() as conn:
+			self._expire(conn)
+			used, reserved = self._row(conn, month)
+			available = max(0, limit - used - reserved)
+			granted = min(calls, available) if partial else (calls if calls <= available else 0)
+			if granted <= 0:
+				return None, 0
+			conn.execute("UPDATE usage SET reserved = reserved + ? WHERE month=? AND key_id=?", (granted, month, self.key_id))
+			cursor = conn.execute("INSERT INTO reservations (month, key_id, run_id, remaining, expires_at) VALUES (?,?,?,?,?)",
+				(month, self.key_id, run_id, granted, time.time() + ttl_hours*3600))
+			return cursor.lastrowid, granted
+
+	def apply(self, run_id, records):
+		'''Applies journaled {'seq', 'calls', 'reservation'} records past this run's high-water mark, in one transaction.
+		Calls move from the reservation (and reserved) to calls. Returns the number of calls newly counted.'''
+		counted = 0
+		with self.transaction() as conn:
+			row = conn.execute("SELECT seq FROM applied WHERE run_id=?", (run_id,)).fetchone()
+			high_water = row[0] if row else 0
+			for record in records:
+				if record['seq'] <= high_water:
+					continue
+				reservation = conn.execute("SELECT month, remaining FROM reservations WHERE id=?", (record.get('reservation'),)).fetchone()
+				if reservation:
+					month, remaining = reservation
+					released = min(remaining, record['calls'])
+					conn.execute("UPDATE reservations SET remaining = remaining - ? WHERE id=?", (released, record['reservation']))
+					conn.execute("UPDATE usage SET reserved = MAX(0, reserved - ?) WHERE month=? AND key_id=?", (released, month, self.key_id))
+				else:
+					month = record.get('month') or month_key() ## reservation expired - the call still happened
+				self._row(conn, month)
+				conn.execute("UPDATE usage SET calls = calls + ? WHERE month=? AND key_id=?", (record['calls'], month, self.key_id))
+				high_water = record['seq']
+				counted += record['calls']
+			conn.execute("INSERT OR REPLACE INTO applied (run_id, seq) VALUES (?, ?)", (run_id, high_water))
+		return counted
+
+	def release(self, run_id):
+		'''Gives back whatever a run reserved but didn't use (call after its journal is applied).'''
+		with self.transaction() as conn:
+			for reservation_id, month, key, remaining in conn.execute(
+					"SELECT id, month, key_id, remaining FROM reservations WHERE run_id=?", (run_id,)).fetchall():
+				conn.execute("UPDATE usage SET reserved = MAX(0, reserved - ?) WHERE month=? AND key_id=?", (remaining, month, key))
+				conn.execute("DELETE FROM reservations WHERE id=?", (reservation_id,))
+
+	def migrate_legacy(self, counter_file):
+		'''One-time import of monthly_api_counter.log. Its lines are "timestamp: running total" and the total never reset,
+		so this month's calls are the last total minus the last total logged before the month began.'''
+		with self.transaction() as conn:
+			if conn.execute("SELECT 1 FROM meta WHERE name='legacy_migrated'").fetchone():
+				return 0
+			totals = []
+			try:
+				with open(counter_file, 'r') as f:
+					for line in f:
+						stamp, _, total = line.strip().rpartition(': ')
+						try:
+							totals.append((datetime.fromisoformat(stamp), int(total)))
+						except ValueError:
+							continue
+			except FileNotFoundError:
+				pass
+			month = month_key()
+			this_month = 0
+			if totals:
+				before = [total for stamp, total in totals if month_key(stamp) < month]
+				this_month = max(0, totals[-1][1] - (before[-1] if before else 0)) if month_key(totals[-1][0]) == month else 0
+				self._row(conn, month)
+				conn.execute("UPDATE usage SET calls = MAX(calls, ?) WHERE month=? AND key_id=?", (this_month, month, self.key_id))
+			conn.execute("INSERT INTO meta (name, value) VALUES ('legacy_migrated', ?)", (f"{os.fspath(counter_file)}: {this_month}",))
+		return this_month
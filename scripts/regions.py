@@ -0,0 +1,116 @@
+## Region (metro) selection
+## Builds per-region ZCTA extracts from the national file - loaded once per batch, with an STRtree
+## over every ZCTA so each region is one index query - and caches them as GeoParquet.
+import argparse
+import hashlib
+import json
+import sys
+from pathlib import Path
+import geopandas as gpd
+import shapely
+from shapely import STRtree
+## batch jobs run this file directly, so make the project root importable (like NYCRentHeatmap.py)
+PARENT_PATH = Path(__file__).resolve().parent.parent
+sys.path.append(str(PARENT_PATH))
+import config.regions as region_config
+import storage
+
+NATIONAL_ZCTA = PARENT_PATH / "data" / "raw" / "tl_2020_us_zcta510.zip"
+NATIONAL_COUNTIES = PARENT_PATH / "data" / "raw" / "tl_2020_us_county.zip" # needed for county-defined regions
+REGION_PATH = PARENT_PATH / "data" / "processed" / "regions"
+ZIP_FIELD = 'ZCTA5CE10'
+COUNTY_FIELD = 'GEOID'
+VERBOSE = True
+
+def get_region(name):
+	if name not in region_config.REGIONS:
+		raise ValueError(f"Unknown region '{name}' - add it to config/regions.py (known: {sorted(region_config.REGIONS)}).")
+	return region_config.REGIONS[name]
+
+def region_signature(name):
+	'''Hash of the region definition + national file sizes/mtimes - a change rebuilds that region's artifact.'''
+	digest = hashlib.sha1(json.dumps(get_region(name), sort_keys=True).encode())
+	for path in [NATIONAL_ZCTA, NATIONAL_COUNTIES]:
+		if path.exists():
+			digest.update(f"{path.name}:{path.stat().st_size}:{path.stat().st_mtime_ns}".encode())
+	return digest.hexdigest()[:16]
+
+def region_artifact(name):
+	return REGION_PATH / f"{name}_zcta_2020-{region_signature(name)}.parquet"
+
+def region_file(name):
+	'''Where load_geoms should read this region from: a prebuilt zcta_file, or the cached extract.'''
+	definition = get_region(name)
+	if definition.get("zcta_file"):
+		return PARENT_PATH / definition["zcta_file"]
+	return region_artifact(name)
+
+def read_national(path):
+	path = str(path)
+	return gpd.read_file(f"zip://{path}" if path.endswith('.zip') else path)
+
+def region_boundary(definition, counties_gdf, crs):
+	'''Single (multi)polygon for a county/bbox/boundary region, in `crs`.'''
+	parts = []
+	if definition.get("counties"):
+		selected = counties_gdf[counties_gdf[COUNTY_FIELD].isin(definition["counties"])]
+		parts.append(selected.to_crs(crs).union_all())
+	if definition.get("bbox"):
+		parts.append(gpd.GeoSeries([shapely.box(*definition["bbox"])], crs="EPSG:4326").to_crs(crs).iloc[0])
+	if definition.get("boundary"):
+		parts.append(gpd.read_file(PARENT_PATH / definition["boundary"]).to_crs(crs).union_all())
+	if not parts:
+		raise ValueError("Region needs one of: zips, counties, bbox, boundary.")
+	return shapely.union_all(parts)
+
+def select_zctas(zcta_gdf, tree, representative_points, boundary):
+	'''Index query for candidates, then keep ZCTAs whose representative point is inside (so edge-touchers drop).'''
+	candidates = tree.query(boundary, predicate='intersects')
+	inside = shapely.within(representative_points[candidates], boundary)
+	return zcta_gdf.iloc[candidates[inside]]
+
+def build_regions(names=None, force=False):
+	'''Builds every missing/stale region extract in one pass over the national file. Returns {name: path}.'''
+	names = names or list(region_config.REGIONS)
+	paths = {name: region_file(name) for name in names}
+	to_build = [name for name in names if force or not paths[name].exists()]
+	if not to_build:
+		return paths
+	if VERBOSE: print(f"Building {len(to_build)} region extracts from {NATIONAL_ZCTA.name}: {to_build}")
+	national = read_national(NATIONAL_ZCTA)
+	tree = STRtree(national.geometry.values)
+	representative_points = national.geometry.representative_point().values
+	needs_counties = any(get_region(name).get("counties") and not get_region(name).get("zips") for name in to_build)
+	counties = read_national(NATIONAL_COUNTIES) if needs_counties else None
+	for name in to_build:
+		definition = get_region(name)
+		if definition.get("zips"):
+			extract = national[national[ZIP_FIELD].isin(definition["zips"])]
+		else:
+			boundary = region_boundary(definition, counties, national.crs)
+			extract = select_zctas(national, tree, representative_points, boundary)
+		## prebuilt zcta_file regions get rebuilt into the cache, not over their source file
+		paths[name] = region_artifact(name)
+		storage.write_frame(extract, paths[name])
+		if VERBOSE: print(f"\t{name}: {len(extract)} ZCTAs -> {paths[name].name}")
+	return paths
+
+def region_zips(name):
+	'''The region's ZIPs, read from its extract (attributes only) - this replaces hand-kept lists like NYC_ZIPS.'''
+	definition = get_region(name)
+	if definition.get("zips"):
+		return sorted(definition["zips"])
+	path = build_regions([name])[name]
+	if path.suffix == '.parquet':
+		zips = storage.read_frame(path, columns=[ZIP_FIELD], geometry=False)[ZIP_FIELD]
+	else:
+		zips = gpd.read_file(path, ignore_geometry=True)[ZIP_FIELD]
+	return sorted(zips.astype(str).str.zfill(5).unique())
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Build per-region ZCTA extracts (one national load for the whole batch).")
+	parser.add_argument('regions', nargs='*', help="region names from config/regions.py (default: all)")
+	parser.add_argument('--force', action='store_true', help="rebuild even if a cached extract exists")
+	args = parser.parse_args()
+	for name, path in build_regions(args.regions or None, force=args.force).items():
+		print(f"{name}:\t{path}")
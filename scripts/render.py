@@ -0,0 +1,117 @@
+## Headless batch rendering
+## Builds the polygon collection once (ideally from simplified geometry) and only re-colors it per
+## metric, writing PNGs straight through the Agg canvas - no pyplot, no plt.show(), no re-rasterizing
+## shapes per map. Metrics can be split across worker processes.
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+from matplotlib import colormaps
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.cm import ScalarMappable
+from matplotlib.collections import PathCollection
+from matplotlib.colors import Normalize, to_rgba
+from matplotlib.figure import Figure
+from matplotlib.path import Path as MplPath
+import config.plot_config as plot_config
+
+MISSING_COLOR = 'lightgrey'
+FIGSIZE = (8, 8)
+DPI = 150
+VERBOSE = True
+
+def style_for(column):
+	'''Interprets plot_config.SETTINGS for a column - shared by plot() and the batch renderer.'''
+	settings = plot_config.SETTINGS.get(column, {})
+	cmap = settings.get("colorscale", "viridis")
+	if settings.get("reverse_color", False):
+		cmap += '_r'
+	label = settings.get("label", column)
+	units = settings.get("units", "")
+	return {
+		'cmap': cmap,
+		'alpha': settings.get("alpha", 1),
+		'vmin': settings.get("vmin", None),
+		'vmax': settings.get("vmax", None),
+		'edge_color': settings.get("edge_color", settings.get("edgecolor", "black")),
+		'edge_width': settings.get("edge_width", 0.1),
+		# Title: (example) "Rent per Commute Minute ($/min)"
+		'title': f"{label} ({units})" if units else label,
+	}
+
+def ring_path(ring):
+	coords = np.asarray(ring.coords)[:, :2]
+	codes = np.full(len(coords), MplPath.LINETO, dtype=MplPath.code_type)
+	codes[0] = MplPath.MOVETO
+	codes[-1] = MplPath.CLOSEPOLY
+	return coords, codes
+
+def polygon_path(polygon):
+	'''One compound path per polygon, so holes stay holes.'''
+	parts = [ring_path(polygon.exterior)] + [ring_path(ring) for ring in polygon.interiors]
+	return MplPath(np.concatenate([coords for coords, _ in parts]), np.concatenate([codes for _, codes in parts]))
+
+class MapRenderer:
+	'''Polygons are turned into matplotlib paths once; render() only swaps face colors & the colorbar.'''
+	def __init__(self, gdf, figsize=FIGSIZE, dpi=DPI):
+		paths, rows = [], []
+		for row, geom in enumerate(gdf.geometry.values):
+			if geom is None or geom.is_empty:
+				continue
+			for polygon in getattr(geom, 'geoms', [geom]):
+				paths.append(polygon_path(polygon))
+				rows.append(row)
+		self.part_rows = np.asarray(rows, dtype=int)
+		self.dpi = dpi
+		self.figure = Figure(figsize=figsize)
+		self.canvas = FigureCanvasAgg(self.figure)
+		self.ax = self.figure.add_subplot(111)
+		self.collection = PathCollection(paths)
+		self.ax.add_collection(self.collection)
+		minx, miny, maxx, maxy = gdf.total_bounds
+		self.ax.set_xlim(minx, maxx)
+		self.ax.set_ylim(miny, maxy)
+		self.ax.set_aspect(1 / np.cos(np.radians((miny+maxy)/2))) ## lon/lat, like GeoDataFrame.plot
+		self.colorbar = None
+
+	def render(self, values, column, outfile):
+		style = style_for(column)
+		values = np.asarray(values, dtype=float)
+		finite = values[np.isfinite(values)]
+		vmin = style['vmin'] if style['vmin'] is not None else (finite.min() if len(finite) else 0)
+		vmax = style['vmax'] if style['vmax'] is not None else (finite.max() if len(finite) else 1)
+		norm = Normalize(vmin=vmin, vmax=vmax)
+		cmap = colormaps[style['cmap']]
+		colors = cmap(norm(values))
+		colors[:, 3] = style['alpha']
+		colors[~np.isfinite(values)] = to_rgba(MISSING_COLOR)
+		self.collection.set_facecolor(colors[self.part_rows])
+		self.collection.set_edgecolor(style['edge_color'])
+		self.collection.set_linewidth(style['edge_width'])
+		if self.colorbar is not None:
+			self.colorbar.remove()
+		self.colorbar = self.figure.colorbar(ScalarMappable(norm=norm, cmap=cmap), ax=self.ax)
+		self.ax.set_title(style['title'])
+		self.figure.savefig(outfile, dpi=self.dpi, bbox_inches='tight')
+		return outfile
+
+def _render_chunk(gdf, columns, outdir, prefix):
+	renderer = MapRenderer(gdf)
+	return [renderer.render(gdf[column].values, column, Path(outdir) / f"{prefix}{column}.png") for column in columns]
+
+def render_metrics(gdf, columns=None, outdir='.', prefix='', processes=1):
+	'''Writes one PNG per metric. columns defaults to every plot_config.SETTINGS key present in gdf.
+	processes>1 splits the metrics across worker processes (each builds its own collection once).'''
+	if columns is None:
+		columns = [column for column in plot_config.SETTINGS if column in gdf.columns]
+	Path(outdir).mkdir(parents=True, exist_ok=True)
+	## only ship what the workers need
+	gdf = gdf[list(columns) + [gdf.geometry.name]]
+	if processes <= 1 or len(columns) <= 1:
+		outfiles = _render_chunk(gdf, columns, outdir, prefix)
+	else:
+		chunks = [list(columns[i::processes]) for i in range(processes) if columns[i::processes]]
+		with ProcessPoolExecutor(max_workers=len(chunks)) as pool:
+			outfiles = [outfile for result in pool.map(_render_chunk, [gdf]*len(chunks), chunks, [outdir]*len(chunks), [prefix]*len(chunks))
+				for outfile in result]
+	if VERBOSE: print(f"Rendered {len(outfiles)} maps to {outdir}")
+	return outfiles
@@ -0,0 +1,65 @@
+## Fast HUD rent loading
+## The national Small Area FMR .xls is parsed once into a compact, zip-sorted Parquet artifact
+## (just the RENT_COLUMN_RENAMES columns). Later loads are a filtered columnar read.
+import hashlib
+import os
+from pathlib import Path
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+RENT_CACHE_PATH = Path(__file__).resolve().parent.parent / "data" / "cache" / "rent"
+SOURCE_META_KEY = b'rent_source' ## parquet metadata: "<name>:<size>:<mtime_ns>" of the .xls it came from
+ZIP_COL = 'rent_zip'
+VERBOSE = True
+
+def source_signature(rentfile):
+	stat = os.stat(rentfile)
+	return f"{Path(rentfile).name}:{stat.st_size}:{stat.st_mtime_ns}"
+
+def artifact_path(rentfile, RenameDict, outdir=RENT_CACHE_PATH):
+	'''One artifact per (source, renames) - it only holds the renamed columns, so new renames need a new one.'''
+	renames = hashlib.sha1(repr(sorted(RenameDict.items())).encode()).hexdigest()[:8]
+	return Path(outdir) / f"{Path(rentfile).stem}-{renames}.parquet"
+
+def is_fresh(rentfile, artifact):
+	if not Path(artifact).exists():
+		return False
+	metadata = pq.read_schema(artifact).metadata or {}
+	return metadata.get(SOURCE_META_KEY, b'').decode() == source_signature(rentfile)
+
+def convert_rent_file(rentfile, RenameDict, artifact=None):
+	'''One-time .xls -> Parquet conversion. Stamped with the source size & mtime, so edits invalidate it.'''
+	artifact = artifact or artifact_path(rentfile, RenameDict)
+	if VERBOSE: print(f"Converting rent file (one-time): {rentfile} -> {artifact}")
+	rdata = pd.read_excel(rentfile, usecols=lambda col: col in RenameDict)
+	rdata = rdata.rename(columns=RenameDict)[list(RenameDict.values())]
+	rdata[ZIP_COL] = rdata[ZIP_COL].astype(str).str.zfill(5)
+	rdata = rdata.sort_values(ZIP_COL).reset_index(drop=True)
+	table = pa.Table.from_pandas(rdata, preserve_index=False)
+	table = table.replace_schema_metadata({**(table.schema.metadata or {}), SOURCE_META_KEY: source_signature(rentfile).encode()})
+	Path(artifact).parent.mkdir(parents=True, exist_ok=True)
+	## small row groups + sorted zips mean the zip filter can skip most of the file
+	pq.write_table(table, artifact, compression='zstd', row_group_size=4096)
+	return artifact
+
+def read_rent(rentfile, RenameDict, zips=None, columns=None):
+	'''Keyed read of the converted artifact (converting first if it's missing or stale).'''
+	artifact = artifact_path(rentfile, RenameDict)
+	if not is_fresh(rentfile, artifact):
+		convert_rent_file(rentfile, RenameDict, artifact=artifact)
+	filters = [(ZIP_COL, 'in', list(zips))] if zips is not None else None
+	return pq.read_table(artifact, columns=columns, filters=filters).to_pandas()
+
+def read_rent_years(rentfiles, RenameDict, zips=None, columns=None):
+	'''Several fiscal years side by side - rentfiles is {label: path}, ie - {'FY2024': ..., 'FY2025': ...}.
+	Rent columns get a _<label> suffix; rows are joined on ZIP_COL.'''
+	combined = None
+	for label, rentfile in rentfiles.items():
+		year_df = read_rent(rentfile, RenameDict, zips=zips, columns=columns)
+		deduped = year_df.drop_duplicates(subset=[ZIP_COL])
+		if VERBOSE and len(deduped) < len(year_df):
+			print(f"Rent {label}: dropped {len(year_df) - len(deduped)} duplicate {ZIP_COL} rows (kept the first of each)")
+		year_df = deduped.set_index(ZIP_COL).add_suffix(f"_{label}")
+		combined = year_df if combined is None else combined.join(year_df, how='outer')
+	return combined.reset_index()
@@ -1,9 +1,17 @@
 # File for API Retries
 import time
 import random
+import threading
+import atexit
+import os
+import uuid
 from datetime import datetime
 from constants import BAD_VAL
 from lib import utils
+import commute_cache
+import telemetry
+import journal
+import quota_ledger
 
 ## moving old vars - will remove soon
 MAX_RETRIES_PER_ENTRY = 3
@@ -20,53 +28,172 @@ Google Maps API has a free-usage quota of 200$ per month, at $0.005 per API call
 ## API retries (new vars)
 MAX_API_CALLS_PER_RUN = 500
 MAX_API_CALLS_PER_MONTH = 10000
-API_MONTHLY_COUNTER_FILE = "monthly_api_counter.log"
+API_MONTHLY_COUNTER_FILE = "monthly_api_counter.log" ## legacy - imported into the ledger once, then unused
+LEDGER_FILE = quota_ledger.LEDGER_FILE ## per-month, per-key call counts shared by every run (see quota_ledger.py)
 CALLS_PER_STATUS_MSG = 250
 VERBOSE = True
 
 ERROR_LOG_FILE = 'retry_errors.log'
+## fetched times & billed calls are journaled as they happen, and folded into the cache & ledger at
+## each checkpoint - so a run that dies mid-fetch loses nothing, and the next run resumes from the cache.
+## One journal per run, so concurrent runs never write to (or fold) each other's.
+RUN_ID = uuid.uuid4().hex
+JOURNAL_PATH = commute_cache.CACHE_FILE.parent / "journal"
+JOURNAL_FILE = JOURNAL_PATH / f"{RUN_ID}.jsonl"
+JOURNAL_ENABLED = True ## False: nothing is journaled & the ledger is never touched (counts stay in memory)
 
-API_RUN_COUNTER = 0 ## just to initialize; this gets reset in main
+API_RUN_COUNTER = 0 ## billed calls made by this process
+CACHE_HIT_COUNTER = 0 ## cache hits cost no quota, so they're tracked apart from PERSISTED_COUNTER
 SHOW_DECLINE_MSG = False ## will update to True, so that we only see the decline message ONCE
 
+## shared by worker threads (see fetch_engine.py) - counters are only touched under this lock
+COUNTER_LOCK = threading.Lock()
+RATE_LIMITER = None ## set to a fetch_engine.TokenBucket to throttle every network attempt
+_JOURNAL = None ## opened on the first journaled call, closed at each checkpoint
+_SEQ = 0 ## journal sequence number for this run's calls - the ledger's high-water mark
+_RESERVATION = None ## {'id', 'remaining'} - monthly budget this batch claimed up front (see reserve_budget)
+_LEDGER = None
+LEDGER_LOCK = threading.Lock()
+
 def wait(retry_counter, delay_time=RETRY_DELAY):
 	print(f"Retrying Attempt #{retry_counter+1} in {delay_time}s...")
 	time.sleep(delay_time)
 
-def read_counter(filename=API_MONTHLY_COUNTER_FILE):
-	try:
-		with open(filename, 'r') as f:
-			lines = f.readlines()
-	except FileNotFoundError:
-		return 0
-	
-	for line in reversed(lines):
-		if line.strip():  # Skip blank lines
-			try:
-				return int(line.split(':')[-1].strip())
-			except (IndexError, ValueError):
-				return 0  # Malformed line
-	return 0  # File had no valid lines
-
-def write_counter(filename=API_MONTHLY_COUNTER_FILE):
-	counter_msg = f"{datetime.now()}: {PERSISTED_COUNTER}\n"
-	with open(filename, 'a') as f:
-		f.write(counter_msg)
-	pass
+def get_ledger():
+	global _LEDGER
+	with LEDGER_LOCK:
+		if _LEDGER is None:
+			_LEDGER = quota_ledger.QuotaLedger(LEDGER_FILE, api_key=os.getenv("GOOGLE_MAPS_API_KEY"))
+			migrated = _LEDGER.migrate_legacy(API_MONTHLY_COUNTER_FILE)
+			if VERBOSE and migrated:
+				print(f"Imported {migrated} calls for this month from {API_MONTHLY_COUNTER_FILE} into {LEDGER_FILE}")
+	return _LEDGER
+
+def get_journal():
+	global _JOURNAL
+	if _JOURNAL is None:
+		_JOURNAL = journal.Journal(JOURNAL_FILE)
+	return _JOURNAL
+
+def journal_results(items):
+	'''items: [(cache_key, minutes), ...] - real answers only, never BAD_VAL.'''
+	if not JOURNAL_ENABLED:
+		commute_cache.store_times(items)
+		return
+	get_journal().append(*({'key': list(key), 'minutes': minutes} for key, minutes in items))
+
+def journal_calls(number_of_calls, reservation_id):
+	'''Call with COUNTER_LOCK held - seq must follow the order calls were claimed in.'''
+	global _SEQ
+	_SEQ += 1
+	get_journal().append({'seq': _SEQ, 'calls': number_of_calls, 'reservation': reservation_id, 'month': quota_ledger.month_key()})
+
+def checkpoint():
+	'''Folds journals into the cache (one transaction each) & the ledger, releases unused reservations, and drops them.
+	Covers this run's journal plus any left by runs that died - live runs' journals are left alone. Ledger updates are
+	applied past a per-run high-water mark, so this is safe at the end of every fetch, at exit, and after a crash.
+	Returns (results recovered, calls recovered) from other (dead) runs.'''
+	global _JOURNAL, _RESERVATION, PERSISTED_COUNTER
+	if not JOURNAL_ENABLED:
+		return 0, 0
+	if _LEDGER is None and _JOURNAL is None and not any(JOURNAL_PATH.glob("*.jsonl")):
+		return 0, 0 ## nothing journaled & nothing reserved - don't create a ledger just to exit
+	recovered_results = recovered_calls = 0
+	with COUNTER_LOCK:
+		if _JOURNAL is not None:
+			_JOURNAL.close()
+			_JOURNAL = None
+		_RESERVATION = None
+		ledger = get_ledger()
+		for path in sorted(JOURNAL_PATH.glob("*.jsonl")):
+			own = path == JOURNAL_FILE
+			if not own and not journal.is_abandoned(path):
+				continue
+			records = journal.replay(path)
+			results = [(tuple(record['key']), record['minutes']) for record in records if 'key' in record]
+			commute_cache.store_times(results)
+			counted = ledger.apply(path.stem, [record for record in records if 'calls' in record])
+			journal.discard(path)
+			if not own:
+				recovered_results += len(results)
+				recovered_calls += counted
+			ledger.release(path.stem)
+		ledger.release(RUN_ID) ## reservations we never used
+		PERSISTED_COUNTER = ledger.used()
+	return recovered_results, recovered_calls
 
 def get_counter():
-	return PERSISTED_COUNTER
+	'''Calls made or reserved this month, by every run sharing the ledger.'''
+	return get_ledger().claimed() if JOURNAL_ENABLED else PERSISTED_COUNTER
+
+def reserve_budget(number_of_calls):
+	'''Claims a batch's calls from the monthly budget before it starts, so concurrent runs can't oversubscribe it.
+	Grants what's left if that's less. Returns the number of calls granted.'''
+	global _RESERVATION
+	if not JOURNAL_ENABLED or number_of_calls <= 0:
+		return number_of_calls
+	reservation_id, granted = get_ledger().reserve(number_of_calls, MAX_API_CALLS_PER_MONTH, RUN_ID, partial=True)
+	with COUNTER_LOCK:
+		_RESERVATION = {'id': reservation_id, 'remaining': granted} if reservation_id else None
+	return granted
+
+def _claim(number_of_calls):
+	'''Monthly budget for one call (or matrix batch) - from the batch reservation if it covers it, else straight
+	from the ledger. Call with COUNTER_LOCK held. Returns (allowed, reservation id).'''
+	if not JOURNAL_ENABLED:
+		return PERSISTED_COUNTER+number_of_calls <= MAX_API_CALLS_PER_MONTH, None
+	if _RESERVATION and _RESERVATION['remaining'] >= number_of_calls:
+		_RESERVATION['remaining'] -= number_of_calls
+		return True, _RESERVATION['id']
+	reservation_id, _ = get_ledger().reserve(number_of_calls, MAX_API_CALLS_PER_MONTH, RUN_ID)
+	return reservation_id is not None, reservation_id
 
 def increment_counters():
 	'''This increments BOTH counters.'''
 	global API_RUN_COUNTER, PERSISTED_COUNTER
-	API_RUN_COUNTER += 1
-	PERSISTED_COUNTER += 1
+	with COUNTER_LOCK:
+		API_RUN_COUNTER += 1
+		PERSISTED_COUNTER += 1
+		if JOURNAL_ENABLED:
+			journal_calls(1, None)
+	pass
+
+def reserve_api_call(number_of_calls=1):
+	'''Checks our limits & increments both counters in one step, so concurrent workers can't overshoot.
+	Distance Matrix bills per element, so a batch reserves all of its elements at once.'''
+	global API_RUN_COUNTER, PERSISTED_COUNTER
+	with COUNTER_LOCK:
+		allowed, reservation_id = (False, None) if API_RUN_COUNTER+number_of_calls>MAX_API_CALLS_PER_RUN else _claim(number_of_calls)
+		if not allowed:
+			telemetry.count('declined_calls', number_of_calls)
+			return False
+		API_RUN_COUNTER += number_of_calls
+		PERSISTED_COUNTER += number_of_calls
+		call_number = API_RUN_COUNTER
+		## journaled before the request goes out - a billed call is never lost, even if we die waiting on it
+		if JOURNAL_ENABLED:
+			journal_calls(number_of_calls, reservation_id)
+	telemetry.count('api_calls', number_of_calls)
+	return call_number
+
+def remaining_budget():
+	'''Calls we can still make before either limit - what the planner has to work with.'''
+	monthly_left = MAX_API_CALLS_PER_MONTH - get_counter()
+	with COUNTER_LOCK:
+		if _RESERVATION:
+			monthly_left += _RESERVATION['remaining'] ## already ours
+		return max(0, min(MAX_API_CALLS_PER_RUN-API_RUN_COUNTER, monthly_left))
+
+def increment_cache_counter():
+	global CACHE_HIT_COUNTER
+	with COUNTER_LOCK:
+		CACHE_HIT_COUNTER += 1
+	telemetry.count('cache_lookups', result='hit')
 	pass
 
-def reset_run_counter():
-	global API_RUN_COUNTER
-	API_RUN_COUNTER = 0
+def throttle():
+	if RATE_LIMITER is not None:
+		RATE_LIMITER.acquire()
 	pass
 
 def print_decline_msg(update_status=True):
@@ -80,18 +207,24 @@ def print_decline_msg(update_status=True):
 		SHOW_DECLINE_MSG = False
 	pass
 
-def run_with_retries(fn, log_label='', retry_statuses=None, extract_status_fn=None):
+def run_with_retries(fn, log_label='', retry_statuses=None, extract_status_fn=None, endpoint='api'):
+	'''endpoint labels this call's latency, status & retry counts in telemetry.'''
 	for attempt in range(MAX_RETRIES_PER_ENTRY):
 		try:
-			result = fn()
+			throttle()
+			with telemetry.timed('request_seconds', endpoint=endpoint):
+				result = fn()
 			## going to check through a set list of statuses - unless they are not there
 			if retry_statuses and extract_status_fn:
 				current_status = extract_status_fn(result)
+				telemetry.count('responses', endpoint=endpoint, status=current_status)
 				if current_status in retry_statuses:
 					## create wait_time, print, log, and wait
 					wait_time = RETRY_BACKOFF[attempt] + random.uniform(0, 0.5)
-					print(f"[Retryable status condition] {status} - Retrying... (Attempt {attempt+1})")
-					retry_log = f"[{datetime.now()}] Retrying API Call - {status} - {log_label} (Attempt {attempt+1})"
+					telemetry.count('retries', endpoint=endpoint, status=current_status)
+					telemetry.count('backoff_seconds', wait_time, endpoint=endpoint)
+					print(f"[Retryable status condition] {current_status} - Retrying... (Attempt {attempt+1})")
+					retry_log = f"[{datetime.now()}] Retrying API Call - {current_status} - {log_label} (Attempt {attempt+1})"
 					utils.log_error(retry_log, timestamp=False)
 					time.sleep(wait_time)
 					continue # try again 
@@ -99,33 +232,75 @@ def run_with_retries(fn, log_label='', retry_statuses=None, extract_status_fn=No
 
 		except Exception as e:
 			wait_time = RETRY_BACKOFF[attempt] + random.uniform(0, 0.5)
+			telemetry.count('retries', endpoint=endpoint, status=type(e).__name__)
+			telemetry.count('backoff_seconds', wait_time, endpoint=endpoint)
 			error_entry = f"[{datetime.now()}] {log_label} - Retry {attempt+1}/{MAX_RETRIES_PER_ENTRY} failed: {e}. Waiting {wait_time:.1f}s..."
 			print(error_entry)
 			utils.log_error(error_entry, timestamp=False)
 			time.sleep(wait_time)
 
+	telemetry.count('retries_exhausted', endpoint=endpoint)
 	retry_failure_msg = f"{log_label} Exceeded max number of retries ({MAX_RETRIES_PER_ENTRY}). Aborting to prevent billing."
 	print(retry_failure_msg)
 	utils.log_error(retry_failure_msg, timestamp=True)
 	return BAD_VAL
 
-PERSISTED_COUNTER = read_counter()
+PERSISTED_COUNTER = 0 ## this month's calls, as of the last checkpoint (plus ours since) - see get_counter
+atexit.register(checkpoint) ## clean exits, sys.exit, Ctrl-C & uncaught errors - a hard kill is recovered next run
 
 def call_api_with_limits(df_row):
-	from commute import get_google_time
-	'''This just wraps our google time API with a function that watches for our API Limits (mostly to keep us in free-tier)'''
+	from commute import get_departure_slot, DEFAULT_DESTINATION
+	from commute_providers import get_provider
+	'''This just wraps our commute provider with a function that watches for our API Limits (mostly to keep us in free-tier)'''
 	## quick decline function
 	def decline_api_call():
 		if SHOW_DECLINE_MSG:
 			print_decline_msg(update_status=True)
 		return BAD_VAL
 
-	## check if limits are hit, & continue
-	if API_RUN_COUNTER>MAX_API_CALLS_PER_RUN or PERSISTED_COUNTER>MAX_API_CALLS_PER_MONTH:
-		decline_api_call()
-	output_time = get_google_time(df_row['lat'], df_row['lon'])
-	## if everything worked, increment our counters
-	increment_counters()
-	if VERBOSE and API_RUN_COUNTER%CALLS_PER_STATUS_MSG==0:
-		print(f"\tFinished {API_RUN_COUNTER} API calls...")
+	## rows may carry their own trip (see fetch_engine.fetch_commute_times) - otherwise it's the default one
+	destination = df_row.get('destination', DEFAULT_DESTINATION)
+	departure_time = df_row.get('departure', True)
+	provider = get_provider()
+	if not provider.uses_quota:
+		## local routing is free - no cache, no counters
+		return provider.get_time(df_row['lat'], df_row['lon'], destination, departure_time)
+
+	## the cache goes first - a hit costs nothing, so it shouldn't count against our limits
+	cache_key = commute_cache.make_key(df_row['lat'], df_row['lon'], destination, get_departure_slot(departure_time), provider.cache_mode)
+	cache_hit, cached_time = commute_cache.get_cached_time(cache_key)
+	if cache_hit:
+		increment_cache_counter()
+		return cached_time
+
+	## check if limits are hit & claim a call - counters are incremented up front so threads can't race past the max
+	telemetry.count('cache_lookups', result='miss')
+	call_number = reserve_api_call()
+	if not call_number:
+		return decline_api_call()
+	output_time = provider.get_time(df_row['lat'], df_row['lon'], destination, departure_time)
+	if output_time != BAD_VAL:
+		journal_results([(cache_key, output_time)])
+	if VERBOSE and call_number%CALLS_PER_STATUS_MSG==0:
+		print(f"\tFinished {call_number} API calls...")
 	return output_time
+
+def call_matrix_with_limits(origins, destinations, departure_time=True):
+	'''Same idea as call_api_with_limits, for one chunk of a Distance Matrix request.
+	Returns {(lat, lon, destination): minutes}.'''
+	from commute import get_departure_slot
+	from commute_providers import get_provider
+	provider = get_provider()
+	number_of_elements = len(origins)*len(destinations)
+	call_number = reserve_api_call(number_of_elements)
+	if not call_number:
+		if SHOW_DECLINE_MSG:
+			print_decline_msg(update_status=True)
+		return {(lat, lon, dest): BAD_VAL for lat, lon in origins for dest in destinations}
+	results = provider.get_matrix(origins, destinations, departure_time)
+	slot = get_departure_slot(departure_time)
+	journal_results([(commute_cache.make_key(lat, lon, dest, slot, provider.cache_mode), minutes)
+		for (lat, lon, dest), minutes in results.items() if minutes != BAD_VAL])
+	if VERBOSE and (call_number // CALLS_PER_STATUS_MSG) != ((call_number-number_of_elements) // CALLS_PER_STATUS_MSG):
+		print(f"\tFinished {call_number} API elements...")
+	return results
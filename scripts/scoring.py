@@ -0,0 +1,95 @@
+## Score metrics
+## Metrics are declared as expressions in config/plot_config.METRICS, checked against a small
+## whitelist, and compiled once. Evaluation broadcasts rent (rows x BR counts) against commute
+## (rows x destinations), so every metric for every BR count & destination is one numpy pass.
+import ast
+import numpy as np
+import pandas as pd
+import config.plot_config as plot_config
+from constants import COMMUTE_KEY
+
+BR_COUNTS = [0, 1, 2, 3, 4]
+FUNCTIONS = {name: getattr(np, name) for name in ['log', 'log1p', 'sqrt', 'exp', 'abs', 'minimum', 'maximum', 'clip', 'where']}
+VARIABLES = ['rent', 'commute']
+ALLOWED_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Name, ast.Load, ast.Call, ast.Compare,
+	ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.USub, ast.UAdd,
+	ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Eq, ast.NotEq)
+
+def rent_key(br_count):
+	return f"rent_{br_count}BR"
+
+def metric_key(metric, br_count):
+	return f"{metric}_{br_count}BR"
+
+class Metric:
+	'''One compiled metric expression - call it with numpy arrays (broadcasting applies).'''
+	def __init__(self, name, expression, variables=VARIABLES):
+		self.name = name
+		self.expression = expression
+		tree = ast.parse(expression, mode='eval')
+		for node in ast.walk(tree):
+			if not isinstance(node, ALLOWED_NODES):
+				raise ValueError(f"Metric '{name}': {type(node).__name__} isn't allowed in '{expression}'")
+			if isinstance(node, ast.Name) and node.id not in variables and node.id not in FUNCTIONS:
+				raise ValueError(f"Metric '{name}': unknown name '{node.id}' (allowed: {variables + sorted(FUNCTIONS)})")
+			if isinstance(node, ast.Call) and not (isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS):
+				raise ValueError(f"Metric '{name}': only {sorted(FUNCTIONS)} can be called")
+			if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+				raise ValueError(f"Metric '{name}': only numeric constants are allowed")
+		self.code = compile(tree, f"<metric {name}>", 'eval')
+
+	def __call__(self, rent, commute):
+		with np.errstate(divide='ignore', invalid='ignore'):
+			return eval(self.code, {'__builtins__': {}, **FUNCTIONS}, {'rent': rent, 'commute': commute})
+
+def compile_metrics(expressions=None):
+	expressions = plot_config.METRICS if expressions is None else expressions
+	return {name: Metric(name, expression) for name, expression in expressions.items()}
+
+METRICS = compile_metrics()
+
+def score_tensor(rent, commute, metrics=None):
+	'''rent: (rows, BR counts), commute: (rows, destinations) -> {metric: (rows, destinations, BR counts)}.
+	BAD_VAL/NaN commutes should already be NaN - they stay NaN through every metric.'''
+	metrics = METRICS if metrics is None else metrics
+	rent = np.asarray(rent, dtype=float)[:, None, :]
+	commute = np.asarray(commute, dtype=float)[:, :, None]
+	return {name: metric(rent, commute) for name, metric in metrics.items()}
+
+def rent_matrix(dataframe, br_counts=BR_COUNTS):
+	'''(rows, BR counts) rent array, and the BR counts actually present.'''
+	present = [br_count for br_count in br_counts if rent_key(br_count) in dataframe.columns]
+	return dataframe[[rent_key(br_count) for br_count in present]].to_numpy(dtype=float), present
+
+def score_all(dataframe, commute_col=COMMUTE_KEY, br_counts=BR_COUNTS, metrics=None):
+	'''{metric}_{n}BR columns for every metric x bedroom column present (same index as dataframe).'''
+	rent, present = rent_matrix(dataframe, br_counts)
+	tensor = score_tensor(rent, dataframe[[commute_col]].to_numpy(dtype=float), metrics)
+	columns = {metric_key(name, br_count): values[:, 0, i] for name, values in tensor.items() for i, br_count in enumerate(present)}
+	return pd.DataFrame(columns, index=dataframe.index)
+
+def weighted_percentile(values, weights, percentile):
+	'''Row-wise weighted percentile of (rows, trips) values - the first value whose cumulative weight reaches it.'''
+	order = np.argsort(values, axis=1)
+	sorted_values = np.take_along_axis(values, order, axis=1)
+	cumulative = np.cumsum(weights[order], axis=1)
+	position = np.argmax(cumulative >= cumulative[:, -1:]*percentile/100, axis=1)
+	return sorted_values[np.arange(len(values)), position]
+
+def aggregate_commute(commute, weights, how='mean'):
+	'''Reduces (rows, trips) commute minutes to one per row: 'mean' (weighted), 'max', or 'p<NN>' (weighted percentile).
+	A row with any NaN trip stays NaN - a household can't skip one of its commutes.'''
+	commute = np.asarray(commute, dtype=float)
+	weights = np.asarray(weights, dtype=float)
+	if commute.shape[1] == 1:
+		return commute[:, 0]
+	if how == 'mean':
+		reduced = commute @ (weights / weights.sum())
+	elif how == 'max':
+		reduced = commute[:, weights > 0].max(axis=1)
+	elif how.startswith('p') and how[1:].replace('.', '', 1).isdigit():
+		reduced = weighted_percentile(commute, weights, float(how[1:]))
+	else:
+		raise ValueError(f"Unknown commute aggregate '{how}' (expected 'mean', 'max', or 'p<NN>').")
+	reduced[np.isnan(commute).any(axis=1)] = np.nan
+	return reduced
@@ -0,0 +1,55 @@
+## Columnar storage for pipeline caches
+## GeoParquet (WKB geometry, typed columns) for everything we read back; GeoJSON only as an explicit export.
+import json
+from pathlib import Path
+import pandas as pd
+import geopandas as gpd
+import pyarrow.parquet as pq
+
+def geo_metadata(path):
+	'''The GeoParquet "geo" metadata block, or None for a plain Parquet file.'''
+	metadata = pq.read_schema(path).metadata or {}
+	if b'geo' not in metadata:
+		return None
+	return json.loads(metadata[b'geo'])
+
+def write_frame(dataframe, outpath, compression='zstd', covering_bbox=False, row_group_size=None):
+	'''GeoDataFrames become GeoParquet (every geometry column WKB-encoded); plain DataFrames become Parquet.
+	covering_bbox=True also writes GeoParquet 1.1 bbox columns, so read_frame(bbox=...) can skip row groups on disk.'''
+	outpath = Path(outpath)
+	outpath.parent.mkdir(parents=True, exist_ok=True)
+	extra = {'write_covering_bbox': True} if covering_bbox else {}
+	if row_group_size:
+		extra['row_group_size'] = row_group_size
+	dataframe.to_parquet(outpath, index=False, compression=compression, **extra)
+	return outpath
+
+def covering_columns(geo):
+	'''The bbox covering columns declared in a "geo" metadata block (GeoParquet 1.1).'''
+	return {paths[0] for column in geo['columns'].values() for paths in column.get('covering', {}).get('bbox', {}).values()}
+
+def read_frame(inpath, columns=None, geometry=True, bbox=None):
+	'''Columnar read - only `columns` are touched on disk.
+	geometry=True adds the primary geometry column to `columns`; a column name reads that geometry
+	column instead (as the active one); geometry=False skips geometry entirely.
+	bbox=(minx, miny, maxx, maxy) keeps rows whose bounds overlap it (pushed down if the file has bbox columns).'''
+	geo = geo_metadata(inpath)
+	if geo is None or geometry == False:
+		if geo is not None and columns is None:
+			## drop the WKB & bbox columns rather than hand back raw bytes
+			skip = set(geo['columns']) | covering_columns(geo)
+			columns = [name for name in pq.read_schema(inpath).names if name not in skip]
+		return pd.read_parquet(inpath, columns=columns)
+	active = geo['primary_column'] if geometry == True else geometry
+	if columns is not None:
+		columns = list(dict.fromkeys(list(columns) + [active]))
+	gdata = gpd.read_parquet(inpath, columns=columns, bbox=bbox)
+	if gdata.geometry.name != active:
+		gdata = gdata.set_geometry(active)
+	return gdata
+
+def export_geojson(dataframe, outpath, drop_columns=('centroid',)):
+	'''Explicit GeoJSON export (ie - for sharing) - GeoJSON only holds one geometry, so extras are dropped.'''
+	outdf = dataframe.drop(columns=[col for col in drop_columns if col in dataframe.columns])
+	outdf.to_file(outpath, driver="GeoJSON")
+	return outpath
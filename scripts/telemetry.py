@@ -0,0 +1,205 @@
+## Run telemetry
+## Process-wide counters, latency histograms & per-stage timers, collected with almost no overhead and
+## written out once at the end of a run: a JSON report, plus an optional Prometheus text file (for a
+## node_exporter textfile collector or just diffing runs). Peak memory per stage uses tracemalloc, which
+## slows allocation down - so it's only on when TRACE_MEMORY is set (ie - by --profile).
+import bisect
+import cProfile
+import io
+import json
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+try:
+	import resource
+except ImportError: ## not on Windows - peak RSS is reported as None
+	resource = None
+
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30] ## seconds (upper bounds; +Inf is implied)
+TRACE_MEMORY = False
+PROFILE_STAGE = None ## stage name to cProfile, or 'auto' to profile every stage & keep the slowest
+PROFILE_TOP = 25 ## functions printed from the profile
+METRIC_PREFIX = 'heatmap_'
+
+_LOCK = threading.Lock()
+_STARTED = time.time()
+_COUNTERS = {} ## (name, sorted label items) -> value
+_HISTOGRAMS = {} ## (name, sorted label items) -> Histogram
+_STAGES = {} ## stage name -> {seconds, peak_mb, ...}
+_PROFILES = {} ## stage name -> cProfile.Profile
+
+class Histogram:
+	'''Fixed-bucket histogram (cumulative counts at report time, like Prometheus).'''
+	def __init__(self, buckets=LATENCY_BUCKETS):
+		self.buckets = list(buckets)
+		self.counts = [0]*(len(self.buckets) + 1)
+		self.total = 0.0
+		self.count = 0
+
+	def observe(self, value):
+		self.counts[bisect.bisect_left(self.buckets, value)] += 1
+		self.total += value
+		self.count += 1
+
+	def quantile(self, q):
+		'''Upper bound of the bucket holding the q-th quantile (None past the last bucket).'''
+		if not self.count:
+			return None
+		target = q*self.count
+		seen = 0
+		for bound, count in zip(self.buckets + [None], self.counts):
+			seen += count
+			if seen >= target:
+				return bound
+		return None
+
+	def summary(self):
+		return {'count': self.count, 'sum': round(self.total, 4), 'mean': round(self.total/self.count, 4) if self.count else None,
+			'p50': self.quantile(0.5), 'p90': self.quantile(0.9), 'p99': self.quantile(0.99),
+			'buckets': {str(bound): count for bound, count in zip(self.buckets + ['+Inf'], self.counts)}}
+
+def _key(name, labels):
+	return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+def count(name, value=1, **labels):
+	key = _key(name, labels)
+	with _LOCK:
+		_COUNTERS[key] = _COUNTERS.get(key, 0) + value
+
+def observe(name, value, **labels):
+	key = _key(name, labels)
+	with _LOCK:
+		if key not in _HISTOGRAMS:
+			_HISTOGRAMS[key] = Histogram()
+		_HISTOGRAMS[key].observe(value)
+
+def get_count(name, **labels):
+	'''Sum of a counter over every label set that matches the given labels.'''
+	wanted = set((k, str(v)) for k, v in labels.items())
+	with _LOCK:
+		return sum(value for (key_name, key_labels), value in _COUNTERS.items() if key_name == name and wanted <= set(key_labels))
+
+def max_rss_mb():
+	'''Peak resident memory of the whole process so far (kB on linux, bytes on macOS) - None where there's no resource module.'''
+	if resource is None:
+		return None
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return round(rss / (1 << 20 if sys.platform == 'darwin' else 1 << 10), 1)
+
+@contextmanager
+def timed(name, **labels):
+	'''Times a block into the `name` histogram (ie - one API request).'''
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		observe(name, time.perf_counter() - start, **labels)
+
+@contextmanager
+def stage_timer(stage):
+	'''Wall time, CPU time & memory of one pipeline stage - and a cProfile of it, if it's the one being profiled.'''
+	trace = TRACE_MEMORY
+	if trace:
+		if not tracemalloc.is_tracing():
+			tracemalloc.start()
+		tracemalloc.reset_peak()
+	profiler = cProfile.Profile() if PROFILE_STAGE in (stage, 'auto') else None
+	start, cpu_start = time.perf_counter(), time.process_time()
+	if profiler: profiler.enable()
+	try:
+		yield
+	finally:
+		if profiler: profiler.disable()
+		record = {'seconds': round(time.perf_counter() - start, 3), 'cpu_seconds': round(time.process_time() - cpu_start, 3), 'max_rss_mb': max_rss_mb()}
+		if trace:
+			record['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / (1 << 20), 1)
+		with _LOCK:
+			_STAGES[stage] = record
+			if profiler: _PROFILES[stage] = profiler
+
+def hot_stage():
+	'''The slowest profiled stage.'''
+	profiled = [stage for stage in _PROFILES if stage in _STAGES]
+	return max(profiled, key=lambda stage: _STAGES[stage]['seconds']) if profiled else None
+
+def dump_profile(outdir):
+	'''Writes the hot stage's profile (.prof, for snakeviz/pstats) & prints its top functions. Returns the path.'''
+	stage = hot_stage()
+	if stage is None:
+		return None
+	outfile = Path(outdir) / f"profile-{stage}.prof"
+	outfile.parent.mkdir(parents=True, exist_ok=True)
+	_PROFILES[stage].dump_stats(outfile)
+	text = io.StringIO()
+	pstats.Stats(_PROFILES[stage], stream=text).sort_stats('cumulative').print_stats(PROFILE_TOP)
+	print(f"Profile of hot stage '{stage}' ({_STAGES[stage]['seconds']}s) -> {outfile}\n{text.getvalue()}")
+	return outfile
+
+def cache_hit_ratio():
+	hits, misses = get_count('cache_lookups', result='hit'), get_count('cache_lookups', result='miss')
+	return round(hits / (hits + misses), 4) if hits + misses else None
+
+def report():
+	'''Everything collected so far, as plain JSON-able data.'''
+	with _LOCK:
+		counters = [{'name': name, 'labels': dict(labels), 'value': value} for (name, labels), value in sorted(_COUNTERS.items())]
+		histograms = [{'name': name, 'labels': dict(labels), **histogram.summary()} for (name, labels), histogram in sorted(_HISTOGRAMS.items(), key=lambda item: item[0])]
+		stages = dict(_STAGES)
+	return {'started': datetime.fromtimestamp(_STARTED).isoformat(timespec='seconds'), 'seconds': round(time.time() - _STARTED, 3),
+		'max_rss_mb': max_rss_mb(), 'stages': stages, 'cache_hit_ratio': cache_hit_ratio(), 'counters': counters, 'histograms': histograms}
+
+def write_report(outfile):
+	outfile = Path(outfile)
+	outfile.parent.mkdir(parents=True, exist_ok=True)
+	with open(outfile, 'w') as f:
+		json.dump(report(), f, indent=1)
+	return outfile
+
+def _labels(labels, **extra):
+	items = list(labels) + [(k, str(v)) for k, v in extra.items()]
+	return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}" if items else ""
+
+def prometheus_text():
+	'''Prometheus text exposition format.'''
+	lines = []
+	with _LOCK:
+		for name in sorted(set(name for name, _ in _COUNTERS)):
+			lines.append(f"# TYPE {METRIC_PREFIX}{name}_total counter")
+			lines += [f"{METRIC_PREFIX}{name}_total{_labels(labels)} {value}" for (key_name, labels), value in sorted(_COUNTERS.items()) if key_name == name]
+		for name in sorted(set(name for name, _ in _HISTOGRAMS)):
+			lines.append(f"# TYPE {METRIC_PREFIX}{name} histogram")
+			for (key_name, labels), histogram in sorted(_HISTOGRAMS.items(), key=lambda item: item[0]):
+				if key_name != name:
+					continue
+				cumulative = 0
+				for bound, bucket_count in zip(histogram.buckets + ['+Inf'], histogram.counts):
+					cumulative += bucket_count
+					lines.append(f"{METRIC_PREFIX}{name}_bucket{_labels(labels, le=bound)} {cumulative}")
+				lines.append(f"{METRIC_PREFIX}{name}_sum{_labels(labels)} {histogram.total}")
+				lines.append(f"{METRIC_PREFIX}{name}_count{_labels(labels)} {histogram.count}")
+		if _STAGES:
+			lines.append(f"# TYPE {METRIC_PREFIX}stage_seconds gauge")
+			lines += [f'{METRIC_PREFIX}stage_seconds{{stage="{stage}"}} {record["seconds"]}' for stage, record in _STAGES.items()]
+			peaks = [(stage, record['peak_mb']) for stage, record in _STAGES.items() if 'peak_mb' in record]
+			if peaks:
+				lines.append(f"# TYPE {METRIC_PREFIX}stage_peak_megabytes gauge")
+				lines += [f'{METRIC_PREFIX}stage_peak_megabytes{{stage="{stage}"}} {peak}' for stage, peak in peaks]
+	rss = max_rss_mb()
+	if rss is not None:
+		lines.append(f"# TYPE {METRIC_PREFIX}max_rss_megabytes gauge")
+		lines.append(f"{METRIC_PREFIX}max_rss_megabytes {rss}")
+	return "\n".join(lines) + "\n"
+
+def write_prometheus(outfile):
+	outfile = Path(outfile)
+	outfile.parent.mkdir(parents=True, exist_ok=True)
+	tmp_file = outfile.with_suffix(outfile.suffix + ".tmp")
+	with open(tmp_file, 'w') as f:
+		f.write(prometheus_text())
+	tmp_file.replace(outfile) ## textfile collectors must never see a half-written file
+	return outfile
@@ -0,0 +1,262 @@
+## Vector tile export + local viewer
+## Writes Mapbox Vector Tiles ({z}/{x}/{y}.pbf) from the merged frame, with every metric column as a
+## feature property and geometry simplified to the zoom's pixel size (shapes under a pixel are dropped),
+## so tiles stay small for pan/zoom over tens of thousands of grid cells. A static MapLibre page
+## (viewer.html) styles one layer per plot_config.SETTINGS metric, driven by its "interactive" and
+## "tooltip_fmt" settings.
+import argparse
+import json
+import re
+import sys
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import numpy as np
+import shapely
+import mapbox_vector_tile
+from matplotlib import colormaps
+from matplotlib.colors import to_hex
+## runs standalone too, so make the project root importable (like regions.py)
+PARENT_PATH = Path(__file__).resolve().parent.parent
+sys.path.append(str(PARENT_PATH))
+import config.plot_config as plot_config
+import storage
+import render
+from constants import MERGED_FILENAME
+
+TILE_PATH = PARENT_PATH / "outputs" / "tiles"
+MERGED_FILE = PARENT_PATH / "outputs" / MERGED_FILENAME
+WEB_MERCATOR = "EPSG:3857"
+ORIGIN = 20037508.342789244 ## half the web mercator world width, in meters
+EXTENT = 4096 ## tile coordinate grid
+BUFFER = 64 ## tile units kept past the tile edge, so borders don't show seams
+MIN_ZOOM = 9
+MAX_ZOOM = 14
+SIMPLIFY_PIXELS = 1.0 ## simplification tolerance, in tile units at each zoom
+LAYER_NAME = 'areas'
+ID_COLUMNS = ['zcta', 'cell_id']
+COLOR_STOPS = 7
+VERBOSE = True
+
+def tile_span(zoom):
+	return 2*ORIGIN / 2**zoom
+
+def tile_ranges(bounds, zoom):
+	'''Inclusive (x0, x1, y0, y1) tile ranges per row of (minx, miny, maxx, maxy) web mercator bounds.'''
+	span = tile_span(zoom)
+	last = 2**zoom - 1
+	x0 = np.clip(np.floor((bounds[:, 0] + ORIGIN) / span), 0, last).astype(int)
+	x1 = np.clip(np.floor((bounds[:, 2] + ORIGIN) / span), 0, last).astype(int)
+	y0 = np.clip(np.floor((ORIGIN - bounds[:, 3]) / span), 0, last).astype(int)
+	y1 = np.clip(np.floor((ORIGIN - bounds[:, 1]) / span), 0, last).astype(int)
+	return x0, x1, y0, y1
+
+def tile_members(bounds, zoom):
+	'''(row, x, y) for every tile each row touches - expanded with numpy, no per-row loop.'''
+	x0, x1, y0, y1 = tile_ranges(bounds, zoom)
+	widths, heights = x1 - x0 + 1, y1 - y0 + 1
+	counts = widths * heights
+	rows = np.repeat(np.arange(len(bounds)), counts)
+	offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+	xs = x0[rows] + offsets % widths[rows]
+	ys = y0[rows] + offsets // widths[rows]
+	return rows, xs, ys
+
+def feature_properties(dataframe, columns):
+	'''One dict per row - NaNs are left out (MVT has no null), floats rounded to keep tiles small.'''
+	properties = [dict() for _ in range(len(dataframe))]
+	for column in columns:
+		values = dataframe[column].values
+		if np.issubdtype(values.dtype, np.number):
+			values = values.astype(float)
+			for props, value in zip(properties, values):
+				if np.isfinite(value):
+					props[column] = round(float(value), 2)
+		else:
+			for props, value in zip(properties, values):
+				if value is not None and value == value:
+					props[column] = str(value)
+	return properties
+
+def encode_tile(geometries, properties, x, y, zoom):
+	'''Clips to the (buffered) tile, moves into tile coordinates, and encodes one layer.'''
+	span = tile_span(zoom)
+	left, top = x*span - ORIGIN, ORIGIN - y*span
+	pad = span * BUFFER / EXTENT
+	clipped = shapely.clip_by_rect(geometries, left-pad, top-span-pad, left+span+pad, top+pad)
+	keep = ~shapely.is_empty(clipped)
+	if not keep.any():
+		return None
+	scale = EXTENT / span
+	local = shapely.transform(clipped[keep], lambda coords: np.column_stack([(coords[:, 0]-left)*scale, (top-coords[:, 1])*scale]))
+	features = [{'geometry': geom, 'properties': props} for geom, props in zip(local, np.asarray(properties, dtype=object)[keep])]
+	return mapbox_vector_tile.encode([{'name': LAYER_NAME, 'features': features}],
+		default_options={'quantize_bounds': None, 'y_coord_down': True, 'extents': EXTENT})
+
+def metric_columns(dataframe):
+	return [column for column, settings in plot_config.SETTINGS.items() if column in dataframe.columns and settings.get("interactive", True)]
+
+def export_tiles(gdf, outdir=TILE_PATH, min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM):
+	'''Writes {outdir}/{z}/{x}/{y}.pbf plus metadata.json & viewer.html. Returns the tile count.'''
+	outdir = Path(outdir)
+	metrics = metric_columns(gdf)
+	ids = [column for column in ID_COLUMNS if column in gdf.columns]
+	projected = gdf[ids + metrics + [gdf.geometry.name]].to_crs(WEB_MERCATOR)
+	geometries = projected.geometry.values
+	properties = np.asarray(feature_properties(projected, ids + metrics), dtype=object)
+	count, sizes = 0, []
+	for zoom in range(min_zoom, max_zoom + 1):
+		pixel = tile_span(zoom) / EXTENT
+		simplified = shapely.simplify(geometries, pixel*SIMPLIFY_PIXELS, preserve_topology=True)
+		## anything smaller than a pixel can't be seen at this zoom
+		visible = np.flatnonzero(~shapely.is_empty(simplified) & (shapely.area(simplified) >= pixel**2))
+		rows, xs, ys = tile_members(shapely.bounds(simplified[visible]), zoom)
+		order = np.lexsort((ys, xs))
+		rows, xs, ys = visible[rows[order]], xs[order], ys[order]
+		starts = np.flatnonzero(np.r_[True, (np.diff(xs) != 0) | (np.diff(ys) != 0)])
+		for start, stop in zip(starts, np.r_[starts[1:], len(rows)]):
+			members = rows[start:stop]
+			data = encode_tile(simplified[members], properties[members], xs[start], ys[start], zoom)
+			if data is None:
+				continue
+			path = outdir / str(zoom) / str(xs[start]) / f"{ys[start]}.pbf"
+			path.parent.mkdir(parents=True, exist_ok=True)
+			path.write_bytes(data)
+			count += 1
+			sizes.append(len(data))
+		if VERBOSE: print(f"\tz{zoom}: {len(starts)} tiles, {len(visible)}/{len(geometries)} shapes")
+	styles = [metric_style(gdf, column) for column in metrics]
+	write_metadata(gdf.to_crs("EPSG:4326").total_bounds, styles, ids, outdir, min_zoom, max_zoom)
+	write_viewer(outdir)
+	if VERBOSE and sizes: print(f"Wrote {count} tiles to {outdir} (median {np.median(sizes)/1024:.1f} KB, max {max(sizes)/1024:.1f} KB)")
+	return count
+
+def js_format(tooltip_fmt):
+	'''plot_config tooltip_fmt (a Python format, ie - "${:,.0f}") as prefix/suffix/decimals/commas for the viewer.'''
+	match = re.match(r'^(.*)\{:(,?)\.(\d+)f\}(.*)$', tooltip_fmt)
+	if match is None:
+		return {'prefix': '', 'suffix': '', 'decimals': 2, 'commas': False}
+	prefix, commas, decimals, suffix = match.groups()
+	return {'prefix': prefix, 'suffix': suffix, 'decimals': int(decimals), 'commas': bool(commas)}
+
+def metric_style(gdf, column):
+	'''Everything the viewer needs to draw & label one metric - the same settings plot() reads.'''
+	style = render.style_for(column)
+	values = gdf[column].astype(float)
+	vmin = style['vmin'] if style['vmin'] is not None else (float(np.nanmin(values)) if values.notna().any() else 0)
+	vmax = style['vmax'] if style['vmax'] is not None else (float(np.nanmax(values)) if values.notna().any() else 1)
+	vmax = max(vmax, vmin + 1e-9) ## MapLibre needs strictly ascending stops
+	cmap = colormaps[style['cmap']]
+	return {
+		'column': column,
+		'label': plot_config.SETTINGS.get(column, {}).get("label", column),
+		'units': plot_config.SETTINGS.get(column, {}).get("units", ""),
+		'alpha': style['alpha'],
+		'edge_color': style['edge_color'],
+		'stops': [[vmin + (vmax-vmin)*i/(COLOR_STOPS-1), to_hex(cmap(i/(COLOR_STOPS-1)))] for i in range(COLOR_STOPS)],
+		'format': js_format(plot_config.SETTINGS.get(column, {}).get("tooltip_fmt", "{:.0f}")),
+	}
+
+def write_metadata(bounds, styles, ids, outdir, min_zoom, max_zoom):
+	'''TileJSON-style metadata, plus the per-metric styles the viewer reads.'''
+	metadata = {
+		'tiles': ['{z}/{x}/{y}.pbf'],
+		'layer': LAYER_NAME,
+		'minzoom': min_zoom,
+		'maxzoom': max_zoom,
+		'bounds': [float(value) for value in bounds],
+		'ids': ids,
+		'styles': styles,
+	}
+	with open(Path(outdir) / "metadata.json", "w") as f:
+		json.dump(metadata, f, indent=2)
+
+VIEWER_HTML = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>nyc-heatmap</title>
+<link href="https://unpkg.com/maplibre-gl@4/dist/maplibre-gl.css" rel="stylesheet">
+<script src="https://unpkg.com/maplibre-gl@4/dist/maplibre-gl.js"></script>
+<style>
+  body { margin: 0; } #map { position: absolute; top: 0; bottom: 0; width: 100%; }
+  #panel { position: absolute; top: 10px; left: 10px; z-index: 1; background: white; padding: 6px 10px; font: 13px sans-serif; }
+</style>
+</head>
+<body>
+<div id="panel"><select id="metric"></select> <span id="range"></span></div>
+<div id="map"></div>
+<script>
+fetch('metadata.json').then(r => r.json()).then(meta => {
+  const STYLES = meta.styles;
+  const tiles = new URL(meta.tiles[0], window.location.href).href.replace('%7Bz%7D', '{z}').replace('%7Bx%7D', '{x}').replace('%7By%7D', '{y}');
+  const map = new maplibre.Map({
+    container: 'map',
+    style: {version: 8, sources: {osm: {type: 'raster', tiles: ['https://tile.openstreetmap.org/{z}/{x}/{y}.png'], tileSize: 256,
+      attribution: '&copy; OpenStreetMap contributors'}}, layers: [{id: 'osm', type: 'raster', source: 'osm'}]},
+    bounds: meta.bounds,
+  });
+  const select = document.getElementById('metric');
+  const format = (value, fmt) => fmt.prefix + (fmt.commas ? value.toLocaleString(undefined, {minimumFractionDigits: fmt.decimals, maximumFractionDigits: fmt.decimals}) : value.toFixed(fmt.decimals)) + fmt.suffix;
+  map.on('load', () => {
+    map.addSource('areas', {type: 'vector', tiles: [tiles], minzoom: meta.minzoom, maxzoom: meta.maxzoom});
+    for (const style of STYLES) {
+      const option = document.createElement('option');
+      option.value = style.column; option.textContent = style.label + (style.units ? ' (' + style.units + ')' : '');
+      select.appendChild(option);
+      map.addLayer({id: style.column, type: 'fill', source: 'areas', 'source-layer': meta.layer, layout: {visibility: 'none'},
+        paint: {'fill-color': ['case', ['has', style.column], ['interpolate', ['linear'], ['get', style.column]].concat(style.stops.flat()), 'lightgrey'],
+          'fill-opacity': style.alpha, 'fill-outline-color': style.edge_color}});
+      map.on('click', style.column, e => {
+        const props = e.features[0].properties;
+        const value = props[style.column] === undefined ? 'n/a' : format(props[style.column], style.format);
+        const name = meta.ids.map(id => props[id]).filter(v => v !== undefined).join(' / ');
+        new maplibre.Popup().setLngLat(e.lngLat).setHTML('<b>' + name + '</b><br>' + style.label + ': ' + value).addTo(map);
+      });
+    }
+    const show = column => {
+      for (const style of STYLES) map.setLayoutProperty(style.column, 'visibility', style.column === column ? 'visible' : 'none');
+      const style = STYLES.find(s => s.column === column);
+      document.getElementById('range').textContent = format(style.stops[0][0], style.format) + ' to ' + format(style.stops[style.stops.length-1][0], style.format);
+    };
+    select.onchange = () => show(select.value);
+    if (STYLES.length) show(STYLES[0].column);
+  });
+});
+</script>
+</body>
+</html>
+'''
+
+def write_viewer(outdir):
+	'''Static viewer.html - it reads metadata.json, so serve the folder (see serve()) rather than opening the file.'''
+	path = Path(outdir) / "viewer.html"
+	path.write_text(VIEWER_HTML)
+	return path
+
+def serve(outdir=TILE_PATH, port=8000):
+	'''Local static server for the tiles & viewer (.pbf gets a protobuf content type).'''
+	handler = partial(SimpleHTTPRequestHandler, directory=str(outdir))
+	SimpleHTTPRequestHandler.extensions_map['.pbf'] = 'application/x-protobuf'
+	server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+	print(f"Serving {outdir} - open http://127.0.0.1:{port}/viewer.html (Ctrl-C to stop)")
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Export the merged frame as vector tiles, and/or serve the viewer.")
+	parser.add_argument('command', choices=['build', 'serve'])
+	parser.add_argument('--in', dest='infile', default=str(MERGED_FILE), help="merged GeoParquet (MERGED_FILE)")
+	parser.add_argument('--out', default=str(TILE_PATH))
+	parser.add_argument('--min-zoom', type=int, default=MIN_ZOOM)
+	parser.add_argument('--max-zoom', type=int, default=MAX_ZOOM)
+	parser.add_argument('--port', type=int, default=8000)
+	args = parser.parse_args()
+	if args.command == 'build':
+		export_tiles(storage.read_frame(args.infile), outdir=args.out, min_zoom=args.min_zoom, max_zoom=args.max_zoom)
+	else:
+		serve(args.out, port=args.port)
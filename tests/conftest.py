@@ -0,0 +1,7 @@
+## scripts/ are run as scripts (flat imports), and a few import config.* from the project root
+import sys
+from pathlib import Path
+
+PARENT_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PARENT_PATH))
+sys.path.insert(0, str(PARENT_PATH / "scripts"))
@@ -0,0 +1,60 @@
+import math
+import time
+import pytest
+import commute_cache
+import retry_logic
+import telemetry
+import commute_providers
+import config.commute_config as commute_config
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+	'''A fresh cache file per test - the module keeps one shared connection, so swap it out.'''
+	monkeypatch.setattr(commute_cache, '_CONNECTION', None)
+	monkeypatch.setattr(commute_cache, 'ENABLED', True)
+	conn = commute_cache._connect(tmp_path / "commute_cache.sqlite")
+	yield commute_cache
+	conn.close()
+
+def test_keys_round_away_float_noise():
+	assert commute_cache.make_key(40.7128000001, -74.0060000004, "Times Square", "08:30", "transit") == \
+		commute_cache.make_key(40.7128, -74.006, "Times Square", "08:30", "transit")
+	assert commute_cache.make_key(40.71281, -74.006, "x", "08:30", "transit") != commute_cache.make_key(40.71282, -74.006, "x", "08:30", "transit")
+
+def test_hits_misses_and_cached_no_route(cache):
+	found = cache.make_key(40.71, -74.0, "Times Square", "08:30", "transit")
+	no_route = cache.make_key(40.72, -74.0, "Times Square", "08:30", "transit")
+	cache.store_times([(found, 31.5), (no_route, math.nan)])
+	assert cache.get_cached_time(found) == (True, 31.5)
+	hit, minutes = cache.get_cached_time(no_route)
+	assert hit and math.isnan(minutes)
+	assert cache.get_cached_time(cache.make_key(40.71, -74.0, "Times Square", "08:30", "driving")) == (False, None)
+
+def test_entries_expire_after_the_ttl(cache, monkeypatch):
+	key = cache.make_key(40.71, -74.0, "Times Square", "08:30", "transit")
+	cache.store_times([(key, 20.0)])
+	now = time.time()
+	monkeypatch.setattr(commute_cache.time, 'time', lambda: now + (cache.CACHE_TTL_DAYS + 1)*86400)
+	assert cache.get_cached_time(key) == (False, None)
+	cache.evict()
+	monkeypatch.setattr(commute_cache.time, 'time', lambda: now)
+	assert cache.get_cached_time(key) == (False, None) ## evicted, not just hidden
+
+def test_evict_keeps_the_newest_entries(cache):
+	for i in range(5):
+		cache.store_times([(cache.make_key(40.0 + i/100, -74.0, "x", "08:30", "transit"), float(i))])
+	cache.evict(max_entries=2)
+	hits = [cache.get_cached_time(cache.make_key(40.0 + i/100, -74.0, "x", "08:30", "transit"))[0] for i in range(5)]
+	assert hits == [False, False, False, True, True]
+
+def test_cache_hits_cost_no_quota(cache, monkeypatch):
+	monkeypatch.setattr(retry_logic, 'API_RUN_COUNTER', 0)
+	monkeypatch.setattr(retry_logic, 'CACHE_HIT_COUNTER', 0)
+	monkeypatch.setattr(commute_config, 'PROVIDER', 'google')
+	row = {'lat': 40.71, 'lon': -74.0, 'destination': "Times Square", 'departure': "08:30"}
+	cache.store_times([(cache.make_key(40.71, -74.0, "Times Square", "08:30", commute_providers.get_provider().cache_mode), 25.0)])
+	hits_before = telemetry.get_count('cache_lookups', result='hit')
+	assert retry_logic.call_api_with_limits(row) == 25.0
+	assert retry_logic.CACHE_HIT_COUNTER == 1
+	assert retry_logic.API_RUN_COUNTER == 0
+	assert telemetry.get_count('cache_lookups', result='hit') == hits_before + 1
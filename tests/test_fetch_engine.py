@@ -0,0 +1,60 @@
+import threading
+import time
+import numpy as np
+import pandas as pd
+import pytest
+import fetch_engine
+from constants import BAD_VAL
+
+class FakeClock:
+	'''Stands in for the time module: sleep() just moves monotonic() forward.'''
+	def __init__(self):
+		self.now = 100.0
+		self.slept = []
+
+	def monotonic(self):
+		return self.now
+
+	def sleep(self, seconds):
+		self.slept.append(seconds)
+		self.now += seconds
+
+def test_token_bucket_allows_a_burst_then_holds_the_rate(monkeypatch):
+	clock = FakeClock()
+	monkeypatch.setattr(fetch_engine, 'time', clock)
+	bucket = fetch_engine.TokenBucket(rate=4, capacity=2)
+	for _ in range(6):
+		bucket.acquire()
+	## 2 from the burst, then 4 more at 4/s
+	assert clock.slept == pytest.approx([0.25]*4)
+	assert clock.now - 100.0 == pytest.approx(1.0)
+
+def frame():
+	return pd.DataFrame({'lat': [40.70, 40.71, 40.70, np.nan, 40.72], 'lon': [-74.0, -74.0, -74.0, -74.0, -74.0]})
+
+def test_fetch_maps_results_back_to_rows_in_order():
+	calls = []
+	lock = threading.Lock()
+	def fetch(row):
+		with lock:
+			calls.append((row['lat'], row['lon']))
+		time.sleep(0.02 if row['lat'] == 40.70 else 0) ## finishes last
+		return BAD_VAL if row['lat'] == 40.72 else round((row['lat'] - 40.0)*100, 2)
+	minutes = fetch_engine.fetch_commute_times(frame(), fetch_fn=fetch, max_workers=3, requests_per_second=1000)
+	assert sorted(calls) == [(40.70, -74.0), (40.71, -74.0), (40.72, -74.0)] ## once per unique origin
+	assert minutes.index.tolist() == [0, 1, 2, 3, 4]
+	assert minutes.iloc[[0, 1, 2]].tolist() == [70.0, 71.0, 70.0]
+	assert np.isnan(minutes.iloc[3]) ## no location, never fetched
+	assert minutes.iloc[4] == BAD_VAL ## a failed origin stays BAD_VAL, it isn't dropped
+
+def test_fetch_errors_propagate_and_cancel_queued_calls():
+	calls = []
+	def fetch(row):
+		calls.append(row['lat'])
+		raise RuntimeError("API Access was rejected.")
+	origins = pd.DataFrame({'lat': 40.0 + np.arange(20)*0.01, 'lon': -74.0})
+	limiter = fetch_engine.retry_logic.RATE_LIMITER
+	with pytest.raises(RuntimeError, match="rejected"):
+		fetch_engine.fetch_commute_times(origins, fetch_fn=fetch, max_workers=1, requests_per_second=1000)
+	assert len(calls) < 20
+	assert fetch_engine.retry_logic.RATE_LIMITER is limiter ## the pool's limiter is always removed
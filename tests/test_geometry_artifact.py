@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+gpd = pytest.importorskip('geopandas')
+import shapely
+import geometry_artifact
+
+RENAMES = {'ZCTA5CE20': 'zcta', 'geometry': 'geometry'}
+
+@pytest.fixture
+def artifact(tmp_path):
+	'''A 20 x 20 lattice of ~1km squares over Manhattan-ish lon/lat.'''
+	xs, ys = np.meshgrid(np.arange(20)*0.01 - 74.0, np.arange(20)*0.01 + 40.7)
+	xs, ys = xs.ravel(), ys.ravel()
+	source = gpd.GeoDataFrame({'ZCTA5CE20': [str(10000 + i) for i in range(len(xs))]},
+		geometry=shapely.box(xs, ys, xs + 0.01, ys + 0.01), crs="EPSG:4326")
+	source_file = tmp_path / "zcta.parquet"
+	source.to_parquet(source_file)
+	return geometry_artifact.GeometryArtifact(source_file, RENAMES, cache_path=tmp_path / "cache")
+
+def test_bounds_come_from_the_bbox_columns(artifact):
+	frame = artifact.frame()
+	assert len(frame) == 400
+	np.testing.assert_allclose(artifact.bounds(), frame.geometry.bounds.values)
+
+def test_bbox_read_and_query_match_a_full_scan(artifact):
+	window = shapely.box(-73.955, 40.755, -73.925, 40.775)
+	full = artifact.frame()
+	expected = sorted(full.loc[full.intersects(window), 'zcta'])
+	assert sorted(artifact.query(window)['zcta']) == expected
+	assert set(expected) <= set(artifact.frame(bbox=window.bounds)['zcta'])
+	assert len(artifact.frame(bbox=window.bounds)) < len(full)
+	candidates = artifact.sindex().query(window)
+	assert sorted(full['zcta'].iloc[candidates]) == expected
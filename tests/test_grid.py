@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+gpd = pytest.importorskip('geopandas')
+import shapely
+import grid
+
+@pytest.fixture
+def zctas():
+	'''Two adjacent 1 km ZCTAs, laid out in the grid CRS and handed over in EPSG:4326 like load_geoms.'''
+	boxes = [shapely.box(580000, 4500000, 581000, 4501000), shapely.box(581000, 4500000, 582000, 4501000)]
+	return gpd.GeoDataFrame({'zcta': ['10001', '10002']}, geometry=boxes, crs=grid.GRID_CRS).to_crs(epsg=4326)
+
+@pytest.fixture(autouse=True)
+def quiet(monkeypatch):
+	monkeypatch.setattr(grid, 'VERBOSE', False)
+
+def test_square_cells_tile_the_bounds():
+	cells = grid.square_cells((0, 0, 1000, 500), 250)
+	assert len(cells) == 8
+	assert shapely.area(cells) == pytest.approx(np.full(8, 250.0**2))
+	assert shapely.union_all(cells).equals(shapely.box(0, 0, 1000, 500))
+
+def test_hex_cells_have_the_square_spacing():
+	cells = grid.hex_cells((0, 0, 1000, 1000), 250)
+	assert shapely.area(cells) == pytest.approx(np.full(len(cells), np.sqrt(3)/2 * 250.0**2))
+	## neighbouring centers sit cell_size apart, across the flats
+	centers = shapely.get_coordinates(shapely.centroid(cells))
+	assert np.linalg.norm(centers[1] - centers[0]) == pytest.approx(250.0)
+	assert shapely.box(0, 0, 1000, 1000).difference(shapely.union_all(cells)).area == pytest.approx(0, abs=1e-6) ## no gaps, bar float slivers
+
+def test_unknown_shape(zctas):
+	with pytest.raises(ValueError):
+		grid.make_cells(zctas, shape='triangle')
+
+def test_assign_zcta_drops_cells_outside_every_zcta(zctas):
+	cells = gpd.GeoDataFrame(geometry=[shapely.box(580100, 4500100, 580200, 4500200), shapely.box(581500, 4500500, 581600, 4500600),
+		shapely.box(590000, 4500000, 590100, 4500100)], crs=grid.GRID_CRS)
+	assigned = grid.assign_zcta(cells, zctas)
+	assert assigned.index.tolist() == [0, 1]
+	assert assigned['zcta'].tolist() == ['10001', '10002']
+
+def test_build_grid_square(zctas):
+	cells = grid.build_grid(zctas, cell_size_m=250, shape='square')
+	assert cells.crs.to_epsg() == 4326
+	assert cells['cell_id'].tolist() == list(range(16*2))
+	assert (cells['zcta'].value_counts() == 16).all()
+	## each cell's centroid lies in the ZCTA it was joined to
+	by_zcta = zctas.set_index('zcta').geometry
+	assert all(by_zcta[zcta].contains(shapely.Point(lon, lat)) for zcta, lat, lon in cells[['zcta', 'lat', 'lon']].itertuples(index=False))
+
+def test_build_grid_hex(zctas):
+	cells = grid.build_grid(zctas, cell_size_m=250, shape='hex')
+	assert set(cells['zcta']) == {'10001', '10002'}
+	projected = cells.to_crs(grid.GRID_CRS)
+	assert projected.area.to_numpy() == pytest.approx(np.sqrt(3)/2 * 250.0**2, rel=1e-3)
+	## the cells cover both ZCTAs, short of the ragged edge
+	covered = shapely.union_all(projected.geometry.values)
+	assert covered.intersection(shapely.box(580000, 4500000, 582000, 4501000)).area > 0.8 * 2e6
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+import interpolate
+import planner
+from local_routing import to_xy
+from constants import BAD_VAL, COMMUTE_KEY
+
+## two known origins ~2.2 km apart on one meridian
+KNOWN_LATS, KNOWN_LONS, KNOWN_VALUES = [40.70, 40.72], [-74.0, -74.0], [10.0, 30.0]
+
+def distances_to_known(lat, lon):
+	return np.linalg.norm(to_xy(KNOWN_LATS, KNOWN_LONS) - to_xy([lat], [lon]), axis=1)
+
+@pytest.mark.parametrize('method', ['idw', 'gaussian'])
+def test_midpoint_is_the_mean(method):
+	estimate = interpolate.estimate(KNOWN_LATS, KNOWN_LONS, KNOWN_VALUES, [40.71], [-74.0], method=method)
+	assert estimate == pytest.approx([20.0])
+
+def test_idw_weights():
+	distances = distances_to_known(40.705, -74.0)
+	weights = distances**-interpolate.POWER
+	expected = (weights * KNOWN_VALUES).sum() / weights.sum()
+	estimate = interpolate.estimate(KNOWN_LATS, KNOWN_LONS, KNOWN_VALUES, [40.705], [-74.0], method='idw')
+	assert estimate == pytest.approx([expected])
+	assert 10 < estimate[0] < 20 ## pulled toward the nearer origin
+
+def test_gaussian_weights():
+	distances = distances_to_known(40.705, -74.0)
+	weights = np.exp(-0.5*(distances/interpolate.BANDWIDTH_M)**2)
+	expected = (weights * KNOWN_VALUES).sum() / weights.sum()
+	estimate = interpolate.estimate(KNOWN_LATS, KNOWN_LONS, KNOWN_VALUES, [40.705], [-74.0], method='gaussian')
+	assert estimate == pytest.approx([expected])
+
+def test_coincident_neighbour_dominates():
+	estimate = interpolate.estimate(KNOWN_LATS, KNOWN_LONS, KNOWN_VALUES, [40.70], [-74.0], method='idw')
+	assert estimate[0] == pytest.approx(10.0, abs=0.01)
+
+def test_max_distance_cutoff():
+	## one known origin inside the cutoff, one far outside - only the near one counts
+	estimate = interpolate.estimate(KNOWN_LATS, KNOWN_LONS, KNOWN_VALUES, [40.70, 40.90], [-73.99, -74.0], max_distance_m=2000)
+	assert estimate[0] == pytest.approx(10.0)
+	assert np.isnan(estimate[1])
+
+def test_unknown_method():
+	with pytest.raises(ValueError):
+		interpolate.estimate(KNOWN_LATS, KNOWN_LONS, KNOWN_VALUES, [40.71], [-74.0], method='kriging')
+
+def test_fill_missing_flags_only_what_it_filled():
+	lats = [40.70, 40.71, 40.72, 40.95]
+	lons = [-74.0, -74.0, -74.0, -74.0]
+	filled, estimated = interpolate.fill_missing(lats, lons, [10.0, np.nan, 30.0, np.nan], method='idw')
+	assert filled[:3] == pytest.approx([10.0, 20.0, 30.0])
+	assert np.isnan(filled[3]) ## no known origin within MAX_DISTANCE_M
+	assert estimated.tolist() == [False, True, False, False]
+
+def test_fill_skipped_ignores_failed_neighbours():
+	commute_df = pd.DataFrame({'lat': [40.70, 40.72, 40.71], 'lon': [-74.0, -74.0, -74.001],
+		'destination': 'work', 'departure': 0, COMMUTE_KEY: [10.0, 30.0, BAD_VAL]})
+	skipped = pd.DataFrame({'lat': [40.71], 'lon': [-74.0]})
+	estimates = planner.fill_skipped(commute_df, skipped, [('work', 0)], method='idw')
+	assert estimates['estimated'].tolist() == [True]
+	assert estimates[COMMUTE_KEY].tolist() == [20.0]
@@ -0,0 +1,27 @@
+import journal
+
+def test_replay_skips_a_torn_line(tmp_path):
+	path = tmp_path / "run.jsonl"
+	log = journal.Journal(path, fsync_every=1)
+	log.append({'seq': 1}, {'seq': 2})
+	log.close()
+	with open(path, 'a') as f:
+		f.write('{"seq": 3') ## crash mid-write
+	assert journal.replay(path) == [{'seq': 1}, {'seq': 2}]
+	assert journal.replay(tmp_path / "missing.jsonl") == []
+
+def test_is_abandoned_tracks_the_writer(tmp_path):
+	path = tmp_path / "run.jsonl"
+	log = journal.Journal(path)
+	log.append({'seq': 1})
+	assert not journal.is_abandoned(path)
+	log.close()
+	assert journal.is_abandoned(path)
+
+def test_is_abandoned_never_recreates_a_discarded_journal(tmp_path):
+	path = tmp_path / "run.jsonl"
+	journal.Journal(path).close()
+	journal.discard(path)
+	assert not journal.is_abandoned(path)
+	assert not path.exists()
+	journal.discard(path) ## already gone is fine
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+import local_routing
+
+## 6 km/h and no circuity: 100 m of walking is exactly one minute
+SETTINGS = {"walk_speed_kmh": 6, "walk_circuity": 1, "access_nodes": 2, "max_access_walk_m": 500,
+	"transfer_walk_m": 100, "boarding_penalty_min": 2, "max_wait_min": 20}
+LAT = 40.7
+KM_LON = 1000 / (local_routing.METERS_PER_DEG_LON*np.cos(np.radians(local_routing.REF_LAT))) ## one km east, in degrees
+
+def line_nodes():
+	'''A, B, C one km apart along a parallel.'''
+	return pd.DataFrame({'node_id': ['A', 'B', 'C'], 'lat': LAT, 'lon': -74.0 + np.arange(3)*KM_LON})
+
+@pytest.fixture
+def graph():
+	## one-way line: A -> B (2 min) -> C (3 min)
+	edges = pd.DataFrame({'from': ['A', 'B'], 'to': ['B', 'C'], 'minutes': [2.0, 3.0]})
+	return local_routing.RoutingGraph(line_nodes(), edges, SETTINGS)
+
+def test_reverse_search_gives_every_node_its_time_to_the_destination(graph):
+	node_times = graph.times_to(LAT, -74.0 + 2*KM_LON)
+	## the destination sits on C, so egress is the MIN_EDGE_MINUTES hop off the virtual node
+	np.testing.assert_allclose(node_times, [5.01, 3.01, 0.01], atol=1e-6)
+
+def test_isochrone_matches_per_origin_search_and_respects_direction(graph):
+	dest = (LAT, -74.0 + 2*KM_LON)
+	lats = np.array([LAT, LAT + 0.001])
+	lons = np.array([-74.0, -74.0])
+	iso = graph.isochrone_times(lats, lons, *dest, access_penalty=4)
+	walk_north = local_routing.to_xy([LAT + 0.001], [-74.0])[0, 1] - local_routing.to_xy([LAT], [-74.0])[0, 1]
+	np.testing.assert_allclose(iso, [4 + 5.01, walk_north/100 + 4 + 5.01], atol=1e-3)
+	## same answer as searching from each origin - up to the MIN_EDGE_MINUTES floor on the virtual egress edge
+	np.testing.assert_allclose(graph.route_times(lats, lons, *dest, access_penalty=4), iso, atol=local_routing.MIN_EDGE_MINUTES + 1e-6)
+	## no C -> A service: walking the 2 km is the only way back
+	np.testing.assert_allclose(graph.isochrone_times([dest[0]], [dest[1]], LAT, -74.0, access_penalty=4), [20.0], atol=1e-3)
+
+def test_origins_past_the_access_walk_only_walk(graph):
+	far = graph.isochrone_times([LAT + 0.05], [-74.0], LAT, -74.0 + 2*KM_LON)
+	meters = np.linalg.norm(local_routing.to_xy([LAT + 0.05], [-74.0])[0] - local_routing.to_xy([LAT], [-74.0 + 2*KM_LON])[0])
+	assert far[0] == pytest.approx(meters / 100) ## no stop within max_access_walk_m
+
+def write_feed(path):
+	(path / "stops.txt").write_text("stop_id,stop_name,stop_lat,stop_lon\n" +
+		"".join(f"{stop},{stop},{LAT},{-74.0 + i*KM_LON}\n" for i, stop in enumerate(['S1', 'S2', 'S3'])) +
+		f"P1,parent,{LAT},-73.5\n")
+	rows = [('t1', '08:00:00', 'S1', 1), ('t1', '08:04:00', 'S2', 2), ('t1', '08:10:00', 'S3', 3),
+		('t2', '08:15:00', 'S1', 1), ('t2', '08:21:00', 'S2', 2), ('t2', '08:25:00', 'S3', 3),
+		('t3', '25:10:00', 'S1', 1), ('t3', '25:15:00', 'S2', 2)]
+	(path / "stop_times.txt").write_text("trip_id,arrival_time,departure_time,stop_id,stop_sequence\n" +
+		"".join(f"{trip},{time},{time},{stop},{seq}\n" for trip, time, stop, seq in rows))
+
+def test_gtfs_graph_uses_median_ride_times(tmp_path):
+	write_feed(tmp_path)
+	nodes, edges = local_routing.load_gtfs_graph(tmp_path, SETTINGS)
+	assert sorted(nodes['node_id']) == ['S1', 'S2', 'S3'] ## the unserved stop is dropped
+	rides = edges.set_index(['from', 'to'])['minutes']
+	assert rides[('S1', 'S2')] == pytest.approx(5.0) ## median of 4, 6 and 5
+	assert rides[('S2', 'S3')] == pytest.approx(5.0) ## median of 6 and 4
+	assert len(edges) == 2 ## stops 1 km apart get no walking transfer
+
+def test_headway_wait_is_half_the_hourly_headway(tmp_path, monkeypatch):
+	monkeypatch.setattr(local_routing, 'CACHE_PATH', tmp_path / "cache")
+	write_feed(tmp_path)
+	waits = local_routing.hourly_waits(tmp_path, SETTINGS)
+	assert waits.shape == (24,)
+	assert waits[8] == pytest.approx(15.0) ## 2 departures per stop in the hour -> 30/2
+	assert waits[1] == pytest.approx(20.0) ## 25:10 is 01:10 - one departure (30 min) capped at max_wait_min
+	assert waits[12] == pytest.approx(20.0) ## no service
+	assert (tmp_path / "cache").exists() and np.array_equal(local_routing.hourly_waits(tmp_path, SETTINGS), waits)
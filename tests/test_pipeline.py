@@ -0,0 +1,50 @@
+import pandas as pd
+import pytest
+pytest.importorskip('geopandas')
+import pipeline
+
+def test_transient_output_is_not_cached_and_taints_downstream(tmp_path):
+	calls = []
+	def fetch():
+		calls.append('fetch')
+		return pipeline.Transient(pd.DataFrame({'x': [1.0]}))
+	stages = pipeline.Pipeline(cache_path=tmp_path)
+	fetched = stages.stage('fetch', fetch)
+	scored = stages.stage('score', lambda df: df.assign(y=df['x']*2), upstream=[fetched])
+	assert scored.load()['y'].tolist() == [2.0]
+	assert not fetched.is_cached() and not scored.is_cached()
+	## the next run recomputes both
+	rerun = pipeline.Pipeline(cache_path=tmp_path)
+	rerun_scored = rerun.stage('score', lambda df: df.assign(y=df['x']*2), upstream=[rerun.stage('fetch', fetch)])
+	rerun_scored.load()
+	assert calls == ['fetch', 'fetch']
+
+def test_complete_output_is_cached(tmp_path):
+	stages = pipeline.Pipeline(cache_path=tmp_path)
+	fetched = stages.stage('fetch', lambda: pd.DataFrame({'x': [1.0]}), params={'k': 1})
+	fetched.load()
+	assert fetched.is_cached()
+	assert pipeline.Pipeline(cache_path=tmp_path).stage('fetch', lambda: None, params={'k': 1}).load()['x'].tolist() == [1.0]
+
+def test_content_keyed_stage_keeps_downstream_cached(tmp_path, monkeypatch):
+	heatmap = pytest.importorskip('NYCRentHeatmap')
+	merged_df = pd.DataFrame({'lat': [40.70, 40.71, 40.72], 'lon': [-74.0, -74.0, -74.0],
+		'rent_1BR': [2000.0, 2100.0, None], 'rent_2BR': [2500.0, 2600.0, None]})
+	fetched = []
+	def build(br_count):
+		monkeypatch.setattr(heatmap, 'RENT_KEY', f"rent_{br_count}BR")
+		stages = pipeline.Pipeline(cache_path=tmp_path)
+		merged = stages.stage('merge', lambda: merged_df, params={'br': br_count})
+		origins = stages.stage('origins', heatmap.origins_stage, upstream=[merged], params={'rent_key': heatmap.RENT_KEY}, content_key=True)
+		commutes = stages.stage('commute', lambda df: fetched.append(len(df)) or df.assign(minutes=30.0), upstream=[origins])
+		scored = stages.stage('score', lambda df: df, upstream=[commutes], params={'rent_key': heatmap.RENT_KEY})
+		return stages, commutes, scored
+	stages, commutes, scored = build(1)
+	scored.load()
+	assert fetched == [2]
+	## CHOSEN_BR_COUNT 1 -> 2: same origins have rent, so only scoring reruns
+	stages, commutes, scored = build(2)
+	assert commutes.is_cached()
+	assert stages.plan(scored) == [scored]
+	scored.load()
+	assert fetched == [2]
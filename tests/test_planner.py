@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+import planner
+
+TRIPS = [('Times Square', '08:30'), ('Times Square', '18:00')]
+
+@pytest.fixture
+def cached(monkeypatch):
+	'''Origins (lat, lon) whose every trip is already in the commute cache.'''
+	origins = set()
+	monkeypatch.setattr(planner.commute_cache, 'get_cached_time', lambda key: ((key[0], key[1]) in origins, 30.0))
+	return origins
+
+def line_of_origins(count):
+	return pd.DataFrame({'lat': 40.6 + np.arange(count)*0.01, 'lon': -74.0 + np.zeros(count), 'rent_1BR': 2000.0})
+
+def test_prunes_rows_without_rent_and_collapses_duplicates(cached):
+	frame = pd.concat([line_of_origins(3), line_of_origins(1)], ignore_index=True)
+	frame.loc[1, 'rent_1BR'] = np.nan
+	plan = planner.plan_calls(frame, TRIPS, 'transit', budget=100, rent_col='rent_1BR')
+	assert plan.naive_calls == 8
+	assert plan.pruned_rows == 1
+	assert len(plan.origins) == 2
+	assert plan.planned_calls == 4 and plan.skipped_calls == 0
+
+def test_cached_pairs_are_free(cached):
+	frame = line_of_origins(3)
+	cached.add((round(frame.lat[0], 5), round(frame.lon[0], 5)))
+	plan = planner.plan_calls(frame, TRIPS, 'transit', budget=4)
+	assert plan.cached_pairs == 2
+	assert plan.planned_calls == 4
+	assert plan.fetch.all()
+
+def test_over_budget_samples_spread_out_origins(cached):
+	frame = line_of_origins(5)
+	plan = planner.plan_calls(frame, TRIPS, 'transit', budget=4)
+	assert plan.planned_calls <= 4
+	assert len(plan.fetch_origins) == 2 and len(plan.skipped_origins) == 3
+	## farthest-point sampling starts from the ends of the line
+	assert sorted(plan.fetch_origins.lat.round(2)) == [40.6, 40.64]
+
+def test_sample_fraction_caps_calls_under_budget(cached):
+	plan = planner.plan_calls(line_of_origins(10), TRIPS, 'transit', budget=1000, sample_fraction=0.25)
+	assert plan.planned_calls <= 5
+	assert plan.skipped_calls == 20 - plan.planned_calls
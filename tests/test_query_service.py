@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+import scoring
+import query_service
+from constants import COMMUTE_KEY
+
+def score_stage_frame(rows=12):
+	'''Shaped like what score_stage writes to MERGED_FILE: rent, commute, every {metric}_{n}BR & the bare chosen metrics.'''
+	rng = np.random.default_rng(0)
+	frame = pd.DataFrame({
+		'zcta': [f"{10001+i}" for i in range(rows)],
+		'lat': 40.6 + rng.random(rows)/5, 'lon': -74.0 + rng.random(rows)/5,
+		**{scoring.rent_key(br): rng.integers(1500, 5000, rows).astype(float) for br in scoring.BR_COUNTS},
+		COMMUTE_KEY: rng.uniform(10, 60, rows),
+	})
+	frame.loc[3, COMMUTE_KEY] = np.nan
+	frame = frame.join(scoring.score_all(frame))
+	return frame.assign(**{name: frame[scoring.metric_key(name, 1)] for name in scoring.METRICS})
+
+def test_loads_score_stage_output(tmp_path):
+	gpd = pytest.importorskip('geopandas')
+	storage = pytest.importorskip('storage')
+	frame = score_stage_frame()
+	outfile = storage.write_frame(gpd.GeoDataFrame(frame, geometry=gpd.points_from_xy(frame['lon'], frame['lat']), crs="EPSG:4326"), tmp_path / "merged.parquet")
+	index = query_service.ScoreIndex(storage.read_frame(outfile, geometry=False))
+	result = index.query(sort='score', br=2, limit=5)
+	assert result['count'] == len(frame) - 1 # the NaN commute has no score
+	scores = [row[scoring.metric_key('score', 2)] for row in result['rows']]
+	assert scores == sorted(scores, reverse=True) and len(scores) == 5
+
+def test_reuses_precomputed_metric_columns():
+	frame = score_stage_frame()
+	frame[scoring.metric_key('score', 1)] = np.arange(len(frame), dtype=float) # not what score_all would compute
+	index = query_service.ScoreIndex(frame)
+	assert np.array_equal(index.columns[scoring.metric_key('score', 1)], np.arange(len(frame), dtype=float))
+
+def test_fills_missing_metric_columns():
+	frame = score_stage_frame().drop(columns=[scoring.metric_key('gravity', 0)])
+	index = query_service.ScoreIndex(frame)
+	assert scoring.metric_key('gravity', 0) in index.columns
+
+@pytest.mark.parametrize('params', [{'limit': ['0']}, {'limit': ['-3']}, {'br': ['7']}, {'order': ['up']}, {'foo': ['1']}])
+def test_parse_query_rejects_bad_params(params):
+	with pytest.raises(query_service.QueryError):
+		query_service.parse_query(params)
+
+def test_parse_query_ranges_and_limit_cap():
+	kwargs = query_service.parse_query({'br': ['2'], 'limit': ['99999'], 'max_rent': ['3000'], 'min_commute': ['5']})
+	assert kwargs['br'] == 2 and kwargs['limit'] == query_service.MAX_LIMIT
+	assert kwargs['ranges'] == (('commute', 5.0, None), ('rent', None, 3000.0))
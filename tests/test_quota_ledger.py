@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+import quota_ledger
+
+def make_ledger(tmp_path, api_key='key'):
+	return quota_ledger.QuotaLedger(tmp_path / "ledger.sqlite", api_key=api_key)
+
+def test_reserve_is_all_or_nothing_unless_partial(tmp_path):
+	ledger = make_ledger(tmp_path)
+	assert ledger.reserve(8, limit=10, run_id='a')[1] == 8
+	assert ledger.reserve(5, limit=10, run_id='b') == (None, 0)
+	assert ledger.reserve(5, limit=10, run_id='b', partial=True)[1] == 2
+	assert ledger.usage() == (0, 10)
+
+def test_apply_is_idempotent_and_release_frees_the_rest(tmp_path):
+	ledger = make_ledger(tmp_path)
+	reservation, _ = ledger.reserve(5, limit=10, run_id='run')
+	records = [{'seq': 1, 'calls': 1, 'reservation': reservation}, {'seq': 2, 'calls': 2, 'reservation': reservation}]
+	assert ledger.apply('run', records) == 3
+	assert ledger.apply('run', records) == 0 ## replaying the same journal
+	assert ledger.usage() == (3, 2)
+	ledger.release('run')
+	assert ledger.usage() == (3, 0)
+	assert ledger.claimed() == 3
+
+def test_months_and_keys_are_separate_buckets(tmp_path, monkeypatch):
+	ledger = make_ledger(tmp_path)
+	ledger.apply('run', [{'seq': 1, 'calls': 4, 'reservation': None, 'month': '2026-01'}])
+	assert ledger.used('2026-01') == 4
+	monkeypatch.setattr(quota_ledger, 'month_key', lambda when=None: '2026-02')
+	assert ledger.used() == 0
+	assert ledger.reserve(10, limit=10, run_id='next')[1] == 10
+	assert make_ledger(tmp_path, api_key='other').claimed() == 0
+
+def test_shared_between_handles(tmp_path):
+	first, second = make_ledger(tmp_path), make_ledger(tmp_path)
+	first.reserve(6, limit=10, run_id='a')
+	assert second.reserve(6, limit=10, run_id='b') == (None, 0)
+
+def test_migrate_legacy_counts_this_month_once(tmp_path):
+	now = datetime.now()
+	counter_file = tmp_path / "monthly_api_counter.log"
+	counter_file.write_text(f"{now - timedelta(days=40)}: 100\nnot a line\n{now - timedelta(seconds=2)}: 130\n{now}: 150\n")
+	ledger = make_ledger(tmp_path)
+	assert ledger.migrate_legacy(counter_file) == 50
+	assert ledger.used() == 50
+	assert ledger.migrate_legacy(counter_file) == 0
+	assert ledger.used() == 50
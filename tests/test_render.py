@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+gpd = pytest.importorskip('geopandas')
+import shapely
+import render
+
+PNG_MAGIC = b'\x89PNG\r\n\x1a\n'
+
+@pytest.fixture
+def frame():
+	'''Three cells (one a two-part multipolygon) with a missing value.'''
+	cells = [shapely.box(-74.0, 40.70, -73.99, 40.71), shapely.box(-73.99, 40.70, -73.98, 40.71),
+		shapely.MultiPolygon([shapely.box(-74.0, 40.71, -73.995, 40.72), shapely.box(-73.99, 40.71, -73.985, 40.72)])]
+	return gpd.GeoDataFrame({'score': [1.0, 2.5, np.nan], 'rent_1BR': [2000.0, 2500.0, 3000.0]}, geometry=cells, crs="EPSG:4326")
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_render_metrics_writes_one_png_per_metric(frame, tmp_path, processes):
+	outfiles = render.render_metrics(frame, columns=['score', 'rent_1BR'], outdir=tmp_path, prefix='nyc-', processes=processes)
+	assert sorted(path.name for path in outfiles) == ['nyc-rent_1BR.png', 'nyc-score.png']
+	for path in outfiles:
+		assert path.read_bytes()[:8] == PNG_MAGIC
+
+def test_renderer_builds_the_collection_once(frame, tmp_path):
+	renderer = render.MapRenderer(frame)
+	assert renderer.part_rows.tolist() == [0, 1, 2, 2] ## one path per polygon part
+	collection = renderer.collection
+	renderer.render(frame['score'].values, 'score', tmp_path / "a.png")
+	renderer.render(frame['rent_1BR'].values, 'rent_1BR', tmp_path / "b.png")
+	assert renderer.collection is collection
+	assert (tmp_path / "a.png").exists() and (tmp_path / "b.png").exists()
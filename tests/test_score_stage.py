@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+import pytest
+pytest.importorskip('geopandas')
+import NYCRentHeatmap as heatmap
+from constants import BAD_VAL, COMMUTE_KEY, ESTIMATED_KEY
+
+def frames():
+	'''Four origins on one trip - the last one failed (BAD_VAL).'''
+	(dest, slot, _), = heatmap.trip_slots()
+	merged_df = pd.DataFrame({'zcta': ['10001', '10002', '10003', '10004'], 'lat': [40.70, 40.71, 40.72, 40.73],
+		'lon': [-74.0, -74.0, -74.0, -74.0], 'rent_1BR': [2000.0, 2200.0, 2400.0, 2600.0], 'rent_2BR': [2500.0, 2700.0, 2900.0, 3100.0]})
+	commute_df = merged_df[['lat', 'lon']].assign(destination=dest, departure=slot, **{COMMUTE_KEY: [30.0, 40.0, 50.0, BAD_VAL]})
+	return merged_df, commute_df
+
+def test_score_stage_interpolates_bad_values(monkeypatch):
+	monkeypatch.setattr(heatmap, 'INTERPOLATE_MISSING', True)
+	merged_df, commute_df = frames()
+	scored = heatmap.score_stage(merged_df, commute_df)
+	assert len(scored) == 4
+	assert scored[ESTIMATED_KEY].tolist() == [False, False, False, True]
+	assert 30 <= scored[COMMUTE_KEY].iloc[3] <= 50
+	assert not scored[heatmap.SCORE_KEY].isna().any()
+
+def test_score_stage_drops_bad_values(monkeypatch):
+	monkeypatch.setattr(heatmap, 'INTERPOLATE_MISSING', False)
+	merged_df, commute_df = frames()
+	scored = heatmap.score_stage(merged_df, commute_df)
+	assert scored['zcta'].tolist() == ['10001', '10002', '10003']
+	assert (scored[COMMUTE_KEY] != BAD_VAL).all()
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+import scoring
+
+def test_compiled_metric_broadcasts():
+	metrics = scoring.compile_metrics({'per_minute': 'rent / maximum(commute, 1)'})
+	values = metrics['per_minute'](np.array([[2000.0]]), np.array([[40.0], [0.0]]))
+	assert values.ravel().tolist() == [50.0, 2000.0]
+
+@pytest.mark.parametrize('expression', [
+	"__import__('os').system('true')",
+	"rent.__class__",
+	"open('x')",
+	"np.log(rent)",
+	"'a' * commute",
+	"[rent, commute]",
+	"(lambda: rent)()",
+	"rent if commute else 0",
+	"budget - rent",
+])
+def test_compile_metrics_rejects_non_whitelisted_nodes(expression):
+	with pytest.raises(ValueError, match="Metric 'bad'"):
+		scoring.compile_metrics({'bad': expression})
+
+## the first trip counts three times over (ie - the main commute, vs. two weekly errands)
+TRIP_WEIGHTS = np.array([3.0, 1.0, 1.0])
+TRIP_MINUTES = np.array([[10.0, 20.0, 40.0], [40.0, 20.0, 10.0]])
+
+@pytest.mark.parametrize('how, expected', [
+	('mean', [18.0, 30.0]),
+	('max', [40.0, 40.0]),
+	('p50', [10.0, 40.0]),
+	('p90', [40.0, 40.0]),
+	('p70', [20.0, 40.0]),
+])
+def test_aggregate_commute_weights_trips(how, expected):
+	assert scoring.aggregate_commute(TRIP_MINUTES, TRIP_WEIGHTS, how=how).tolist() == expected
+
+def test_weighted_percentile_matches_repeated_values():
+	## integer weights behave like repeating each trip that many times
+	repeated = np.repeat(TRIP_MINUTES, TRIP_WEIGHTS.astype(int), axis=1)
+	for percentile in [20, 50, 60, 100]:
+		expected = np.percentile(repeated, percentile, axis=1, method='inverted_cdf')
+		assert scoring.weighted_percentile(TRIP_MINUTES, TRIP_WEIGHTS, percentile).tolist() == expected.tolist()
+
+def test_aggregate_commute_max_skips_unweighted_trips():
+	assert scoring.aggregate_commute(TRIP_MINUTES, [3.0, 1.0, 0.0], how='max').tolist() == [20.0, 40.0]
+
+@pytest.mark.parametrize('how', ['mean', 'max', 'p90'])
+def test_aggregate_commute_keeps_nan_rows(how):
+	minutes = np.array([[10.0, np.nan, 40.0], [40.0, 20.0, 10.0]])
+	reduced = scoring.aggregate_commute(minutes, TRIP_WEIGHTS, how=how)
+	assert np.isnan(reduced[0]) and np.isfinite(reduced[1])
+
+def test_aggregate_commute_single_trip_passes_through():
+	assert scoring.aggregate_commute([[12.5], [np.nan]], [1.0], how='p90')[0] == 12.5
+
+def test_aggregate_commute_rejects_unknown_aggregate():
+	with pytest.raises(ValueError):
+		scoring.aggregate_commute(TRIP_MINUTES, TRIP_WEIGHTS, how='median')
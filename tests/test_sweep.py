@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pytest
+pytest.importorskip('geopandas')
+import NYCRentHeatmap as heatmap
+import commute
+import commute_providers
+import config.commute_config as commute_config
+import pipeline
+import retry_logic
+from constants import BAD_VAL, COMMUTE_KEY
+
+def slot_minutes(slot):
+	hours, minutes = slot.split(':')
+	return int(hours)*60 + int(minutes)
+
+class FakeProvider(commute_providers.CommuteProvider):
+	'''Offline stand-in: 2 more minutes every quarter hour after 07:00, 10 more per 0.01 deg of latitude.
+	The origin at lat 40.71 fails at 07:15. Half-hour buckets, so a sweep only computes every other slot.'''
+	name = 'fake'
+
+	def __init__(self):
+		self.slots = []
+
+	def departure_bucket(self, slot):
+		return slot_minutes(slot) // 30
+
+	def get_times(self, lats, lons, destination, departure_time=True):
+		self.slots.append(departure_time)
+		lats = np.asarray(lats, dtype=float)
+		minutes = 20 + np.round((lats - 40.70)*1000) + 2*(slot_minutes(departure_time) - 7*60)/15
+		minutes[np.isclose(lats, 40.71) & (departure_time == "07:15")] = BAD_VAL
+		return minutes
+
+@pytest.fixture
+def provider(monkeypatch):
+	fake = FakeProvider()
+	monkeypatch.setitem(commute_providers.PROVIDERS, 'fake', lambda: fake)
+	monkeypatch.setattr(commute_providers, '_ACTIVE', {})
+	monkeypatch.setattr(commute_config, 'PROVIDER', 'fake')
+	monkeypatch.setattr(retry_logic, 'JOURNAL_ENABLED', False)
+	monkeypatch.setattr(heatmap, 'COMMUTE_MODE', 'matrix')
+	return fake
+
+def test_departure_slots():
+	assert commute.departure_slots("07:00", "08:00") == ["07:00", "07:15", "07:30", "07:45"]
+	assert commute.departure_slots("07:00", "07:50", step=20) == ["07:00", "07:20", "07:40"]
+	assert commute.departure_slots("09:50", "10:10", step=10) == ["09:50", "10:00"]
+	assert commute.departure_slots("08:00", "08:00") == []
+
+def test_sweep_stage_profile(provider, monkeypatch):
+	monkeypatch.setattr(heatmap, 'SWEEP_WINDOW', ("07:00", "08:00"))
+	origins_df = pd.DataFrame({'lat': [40.70, 40.72], 'lon': [-74.0, -74.0]})
+	profile = heatmap.sweep_stage(origins_df)
+	assert sorted(provider.slots) == ["07:00", "07:30"] ## one per half-hour bucket
+	assert not isinstance(profile, pipeline.Transient)
+	assert profile.columns.tolist() == ['lat', 'lon', "07:00", "07:15", "07:30", "07:45", 'destination']
+	assert profile["07:15"].tolist() == profile["07:00"].tolist()
+	assert profile["07:00"].tolist() == [20.0, 40.0] and profile["07:30"].tolist() == [24.0, 44.0]
+	assert (profile['destination'] == heatmap.TRIPS[0][0]).all()
+
+def test_failed_slot_is_nan_and_transient(provider, monkeypatch):
+	monkeypatch.setattr(heatmap, 'SWEEP_WINDOW', ("07:00", "08:00"))
+	monkeypatch.setattr(provider, 'departure_bucket', lambda slot: slot) ## every slot computed
+	origins_df = pd.DataFrame({'lat': [40.70, 40.71], 'lon': [-74.0, -74.0]})
+	profile = heatmap.sweep_stage(origins_df)
+	assert isinstance(profile, pipeline.Transient) ## a failed slot is retried next run
+	profile = profile.output
+	assert len(provider.slots) == 4
+	assert profile.loc[1, "07:00"] == 30.0 and np.isnan(profile.loc[1, "07:15"])
+	assert not profile.loc[0, ["07:00", "07:15", "07:30", "07:45"]].isna().any()
+
+def test_profile_stats_skip_failed_slots(monkeypatch):
+	monkeypatch.setattr(heatmap, 'SWEEP_STATS', ['median', 'p90'])
+	profile = pd.DataFrame({'lat': [40.70, 40.71, 40.72], 'lon': [-74.0, -74.0, -74.0],
+		"07:00": [20.0, 30.0, np.nan], "07:15": [22.0, np.nan, np.nan], "07:30": [24.0, 34.0, np.nan], "07:45": [26.0, 36.0, np.nan],
+		'destination': 'work'}).astype({"07:00": np.float32, "07:15": np.float32, "07:30": np.float32, "07:45": np.float32})
+	stats = heatmap.profile_stats(profile)
+	assert stats.columns.tolist() == ['lat', 'lon', f"{COMMUTE_KEY}_median", f"{COMMUTE_KEY}_p90"]
+	assert stats[f"{COMMUTE_KEY}_median"].tolist()[:2] == pytest.approx([23.0, 34.0])
+	assert stats[f"{COMMUTE_KEY}_p90"].tolist()[:2] == pytest.approx([25.4, 35.6])
+	assert stats.iloc[2, 2:].isna().all() ## an origin that never returned a time